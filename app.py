@@ -3,18 +3,50 @@
 # ===============================================================
 import streamlit as st
 import os
+import json
+import time
+import logging
 import pandas as pd
 from io import BytesIO
 
-from funciones.cargar_base import cargar_todas_las_hojas
-from funciones.analizar_materiales import analizar_volumen_por_material
+from funciones.cargar_base import cargar_base_compilada
 from funciones.utils.ia import cargar_modelo
-from funciones.utils.formatear_hojas_para_ia import formatear_hojas_para_ia
+from funciones.utils.formatear_hojas_para_ia import contexto_relevante_para_ia
+from funciones.utils.normalizar_materiales_ifc import normalizar_materiales_con_ia
+from funciones.utils.calcular_huella import matriz_huella, huella_desde_matriz, resumen_desde_matriz
+from funciones.utils.planificador_ia import generar_en_paralelo
+from funciones.utils.salida_estructurada import configuracion_json, unir_respuestas_json
+from postprocesar_huella import postprocesar_huella
 from funciones.procesar_ifc_con_progreso import procesar_ifc
-from funciones.agregar_huella_ifc import agregar_huella_ifc
+from funciones.cache_extraccion import hash_contenido, cargar_extraccion, guardar_extraccion
+from funciones.tabla_propiedades import extraer_tabla_larga, columnas_disponibles, pivotar_propiedades, fila_elemento
+from funciones.trabajos import (
+    ESTADOS_ACTIVOS, lanzar_trabajo, estado_trabajo, resultado_trabajo, cancelar_trabajo, buscar_trabajo, listar_trabajos,
+)
+from funciones.revisiones import (
+    nombre_proyecto, hash_elementos, comparar_revisiones, resumen_cambios, guardar_revision,
+    guardar_totales_ia, revision_anterior, totales_reutilizables, delta_huella,
+)
+from funciones.utils import instrumentacion
 
 st.set_page_config(page_title="Huella de Carbono IFC", layout="wide")
 
+logger = logging.getLogger(__name__)
+
+# Procesos para la extracción del IFC (IFC_PROCESOS=1 desactiva el modo paralelo). Cada proceso abre
+# su propia copia del modelo y varias sesiones pueden extraer a la vez: por defecto como mucho 2
+N_PROCESOS_IFC = int(os.environ.get("IFC_PROCESOS", min(2, os.cpu_count() or 1)))
+# Formato largo (una fila por propiedad) para modelos con miles de psets distintos: IFC_FORMATO=largo
+FORMATO_LARGO = os.environ.get("IFC_FORMATO", "ancho").lower() == "largo"
+# Peticiones simultáneas a la IA y límite de ritmo (según la cuota de la API)
+IA_CONCURRENCIA = int(os.environ.get("IA_CONCURRENCIA", 4))
+IA_PETICIONES_MINUTO = int(os.environ.get("IA_PETICIONES_MINUTO", 60))
+# Respuesta de la IA por bloque: JSON con esquema (por defecto) o tabla Markdown normalizada después (IA_SALIDA=markdown)
+SALIDA_IA_ESTRUCTURADA = os.environ.get("IA_SALIDA", "json").lower() != "markdown"
+
+# Trabajos en segundo plano que siguen activos en esta ejecución (ver sección 14)
+trabajos_en_curso = []
+
 # ===============================================================
 # 02 --- FUNCIÓN: Exportar tabla a Excel -----------------------------
 # ===============================================================
@@ -43,6 +75,76 @@ def exportar_tabla_excel(markdown: str, nombre_archivo: str):
         st.error(f"❌ Error al procesar la tabla Markdown: {e}")
         return None
 
+# ===============================================================
+# 02b --- FUNCIONES: Trabajos en segundo plano -----------------------
+# ===============================================================
+def extraer_ifc(ruta_ifc, hash_ifc, formato_largo, n_procesos, update_progress=None):
+    # Se ejecuta como trabajo: extracción completa y guardado en la caché de extracciones
+    if formato_largo:
+        datos = extraer_tabla_larga(ruta_ifc, update_progress=update_progress)
+    else:
+        datos = procesar_ifc(ruta_ifc, carpeta_salida="resultados", update_progress=update_progress, n_procesos=n_procesos)
+
+    try:
+        if formato_largo:
+            # Cada parte de la tabla larga se guarda en caché como una entrada propia
+            for parte, df_parte in datos.items():
+                guardar_extraccion(f"{hash_ifc}-{parte}", df_parte)
+        else:
+            guardar_extraccion(hash_ifc, datos)
+    except Exception as e:
+        logger.warning("⚠️ No se pudo guardar la extracción en caché: %s", e)
+    return datos
+
+def seguir_trabajo(clave_estado, texto):
+    """
+    Muestra el progreso del trabajo cuyo id está en st.session_state[clave_estado], con botón para cancelarlo.
+    Devuelve el resultado una sola vez, cuando termina; mientras sigue activo devuelve None
+    y la página se vuelve a ejecutar al final del script (sección 14).
+    """
+    id_trabajo = st.session_state.get(clave_estado)
+    estado = estado_trabajo(id_trabajo) if id_trabajo else None
+    if estado is None:
+        st.session_state.pop(clave_estado, None)
+        return None
+
+    if estado["estado"] in ESTADOS_ACTIVOS:
+        col_progreso, col_cancelar = st.columns([5, 1])
+        col_progreso.progress(estado["progreso"], text=f"{texto} ({estado['progreso']:.0%})")
+        if col_cancelar.button("✖️ Cancelar", key=f"cancelar_{clave_estado}"):
+            cancelar_trabajo(id_trabajo)
+        trabajos_en_curso.append(id_trabajo)
+        return None
+
+    del st.session_state[clave_estado]
+    if estado["estado"] == "completado":
+        return resultado_trabajo(id_trabajo)
+    if estado["estado"] == "cancelado":
+        st.warning(f"⚠️ {texto}: cancelado")
+    elif estado["estado"] == "interrumpido":
+        st.warning(f"⚠️ {texto}: interrumpido al reiniciarse el servidor, vuelve a lanzarlo")
+    else:
+        st.error(f"❌ {texto}: {estado['error']}")
+    return None
+
+# ===============================================================
+# 02c --- FUNCIONES: Modo revisión -----------------------------------
+# ===============================================================
+def matriz_de_elementos(df_elementos):
+    # Materiales normalizados con la base (sin IA) y matriz de GWP por elemento y etapa
+    df_calculo = normalizar_materiales_con_ia(df_elementos.copy(), st.session_state.hojas_sostenibilidad, usar_ia=False)
+    normalizado = df_calculo["Material_Normalizado"]
+    df_calculo["Material"] = normalizado.where(normalizado != "NO ENCONTRADO", df_calculo["Material"])
+    return matriz_huella(df_calculo, st.session_state.hojas_sostenibilidad)
+
+def completar_con_revision(df_resultado):
+    # Añade los totales reutilizados de la revisión anterior (elementos sin cambios que no se enviaron a la IA)
+    reutilizados = st.session_state.get("huella_reutilizada")
+    if reutilizados is None or reutilizados.empty:
+        return df_resultado
+    ids_calculados = set(df_resultado["ID"].astype(str).str.strip()) if "ID" in df_resultado.columns else set()
+    return pd.concat([df_resultado, reutilizados[~reutilizados["ID"].isin(ids_calculados)]], ignore_index=True)
+
 # ===============================================================
 # 03 --- BOTÓN: Reiniciar estado -------------------------------------
 # ===============================================================
@@ -58,9 +160,11 @@ st.title(" Herramienta de Cálculo de Huella de Carbono IFC")
 st.markdown("**Carga automática de base de datos y análisis de materiales del archivo IFC.**")
 
 if "hojas_sostenibilidad" not in st.session_state:
-    hojas = cargar_todas_las_hojas("datos/00 - Base datos DIGITAEC v2.xlsx")
-    if hojas and "error" not in hojas:
-        st.session_state.hojas_sostenibilidad = hojas
+    # Instantánea compilada del Excel, compartida por todas las sesiones del proceso
+    base = cargar_base_compilada("datos/00 - Base datos DIGITAEC v2.xlsx")
+    if base and "error" not in base:
+        st.session_state.hojas_sostenibilidad = base["hojas"]
+        st.session_state.indice_sostenibilidad = base["indice"]
         st.success("✅ Base de datos cargada correctamente (v2)")
     else:
         st.error("❌ Error al cargar la base de datos")
@@ -79,39 +183,107 @@ st.markdown("""
 
 archivo_ifc = st.file_uploader("Sube tu archivo IFC", type=["ifc"])
 
+modo_revision = st.checkbox(
+    " Modo revisión: comparar con la revisión anterior del mismo proyecto",
+    key="modo_revision",
+    help="Actívalo antes de subir el IFC. Se reutilizan las columnas detectadas y la huella de la IA de los elementos sin cambios, y se muestra la diferencia de huella entre revisiones.",
+)
+# Estado del modo revisión en la sesión; se descarta al cambiar de IFC o al desactivar el modo
+CLAVES_REVISION = ("revision_anterior", "comparacion_revision", "matriz_anterior", "totales_revision_anterior", "huella_reutilizada")
+if not modo_revision:
+    for clave in CLAVES_REVISION:
+        st.session_state.pop(clave, None)
+if modo_revision and archivo_ifc is not None:
+    proyecto = st.text_input("Proyecto", value=nombre_proyecto(archivo_ifc.name), help="Las revisiones de un mismo proyecto se comparan entre sí.")
+
 # ===============================================================
 # 06 --- PROCESAMIENTO DEL ARCHIVO IFC -------------------------------
 # ===============================================================
 if archivo_ifc is not None:
     nombre_actual = archivo_ifc.name
-    if "ultimo_ifc" not in st.session_state or st.session_state.ultimo_ifc != nombre_actual:
-        st.session_state.ultimo_ifc = nombre_actual
+    # Se identifica el IFC por su contenido, no por el nombre del fichero. El hash se calcula una vez
+    # por fichero subido: la página se vuelve a ejecutar cada segundo mientras hay trabajos activos
+    id_subida = getattr(archivo_ifc, "file_id", None) or (archivo_ifc.name, getattr(archivo_ifc, "size", None))
+    if st.session_state.get("id_subida_ifc") != id_subida:
+        st.session_state["hash_subida_ifc"] = hash_contenido(archivo_ifc.getbuffer())
+        st.session_state["id_subida_ifc"] = id_subida
+    hash_actual = st.session_state["hash_subida_ifc"]
+    if "ultimo_ifc" not in st.session_state or st.session_state.ultimo_ifc != hash_actual:
+        st.session_state.ultimo_ifc = hash_actual
+        for clave in CLAVES_REVISION:
+            st.session_state.pop(clave, None)
         ruta_guardado = os.path.join("subidos", nombre_actual)
         st.session_state["ruta_guardado"] = ruta_guardado
         os.makedirs("subidos", exist_ok=True)
         with open(ruta_guardado, "wb") as f:
             f.write(archivo_ifc.getbuffer())
 
-        progress_bar = st.progress(0)
-        with st.spinner(" Procesando IFC completo..."):
-            df_ifc = procesar_ifc(ruta_guardado, carpeta_salida="resultados", update_progress=progress_bar.progress)
+        if FORMATO_LARGO:
+            # Cada parte de la tabla larga se guarda en caché como una entrada propia
+            tabla_ifc = {parte: cargar_extraccion(f"{hash_actual}-{parte}") for parte in ("elementos", "propiedades")}
+            en_cache = all(parte is not None for parte in tabla_ifc.values())
+            datos_cache = tabla_ifc
+        else:
+            datos_cache = cargar_extraccion(hash_actual)
+            en_cache = datos_cache is not None
+
+        if en_cache:
+            st.success("✅ IFC ya procesado anteriormente: datos recuperados de la caché")
+            st.session_state["extraccion_ifc"] = datos_cache
+        else:
+            # La extracción corre en segundo plano; si el mismo IFC ya se está procesando
+            # (otra sesión o una recarga de la página) se reutiliza ese trabajo
+            st.session_state["trabajo_extraccion"] = lanzar_trabajo(
+                "extraccion", extraer_ifc, ruta_guardado, hash_actual, FORMATO_LARGO, N_PROCESOS_IFC,
+                clave=f"extraccion:{hash_actual}:{FORMATO_LARGO}",
+            )
+
+    if "trabajo_extraccion" in st.session_state:
+        datos_extraidos = seguir_trabajo("trabajo_extraccion", " Procesando IFC completo")
+        if datos_extraidos is not None:
+            st.success("✅ IFC procesado correctamente")
+            st.session_state["extraccion_ifc"] = datos_extraidos
+
+    # La detección de columnas se hace una vez por IFC, cuando su extracción está disponible
+    datos_ifc = st.session_state.pop("extraccion_ifc", None)
+    if datos_ifc is not None:
+        if FORMATO_LARGO:
+            tabla_ifc = datos_ifc
+        else:
+            df_ifc = datos_ifc
 
-        st.success("✅ IFC procesado correctamente")
+        if FORMATO_LARGO:
+            columnas_ifc = columnas_disponibles(tabla_ifc)
+            vista_ifc = pivotar_propiedades(tabla_ifc, columnas_ifc, indices=range(15))
+            elementos_ifc = tabla_ifc["elementos"]
+        else:
+            columnas_ifc = list(df_ifc.columns)
+            vista_ifc = df_ifc.head(15)
+            elementos_ifc = df_ifc
+        # GlobalIds del IFC para validar la exportación sin volver a abrir el modelo
+        st.session_state["guids_ifc"] = set(elementos_ifc["ID"].dropna().astype(str)) if "ID" in elementos_ifc.columns else set()
 
         st.markdown("###  Datos extraídos del IFC")
-        st.dataframe(df_ifc.head(15))
+        st.dataframe(vista_ifc)
 
         st.markdown("###  Procesamiento por IA para columnas clave")
 
         fila_ejemplo = None
-        for _, fila in df_ifc.iterrows():
-            if fila.dropna().shape[0] >= 2:
-                fila_ejemplo = fila
-                break
+        if FORMATO_LARGO:
+            for idx in tabla_ifc["elementos"]["element_idx"]:
+                fila = fila_elemento(tabla_ifc, idx)
+                if fila.shape[0] >= 2:
+                    fila_ejemplo = fila
+                    break
+        else:
+            for _, fila in df_ifc.iterrows():
+                if fila.dropna().shape[0] >= 2:
+                    fila_ejemplo = fila
+                    break
 
         if fila_ejemplo is None:
             st.error("❌ No se encontró un elemento con datos suficientes para usar como ejemplo.")
-            st.dataframe(df_ifc.head(10))
+            st.dataframe(vista_ifc.head(10))
             st.stop()
 
         propiedades_ejemplo = "\n".join([f"- {col}: {fila_ejemplo[col]}" for col in fila_ejemplo.index if pd.notna(fila_ejemplo[col])])
@@ -145,30 +317,54 @@ unidad_col: ...
 guid_col: ...
 """
 
-        modelo = cargar_modelo()
-        with st.spinner(" Consultando IA para detectar columnas clave..."):
-            respuesta = modelo.generate_content(prompt_identificar).text
+        anterior = revision_anterior(proyecto, hash_actual) if modo_revision else None
+        columnas_anteriores = anterior["columnas"] if anterior else {}
+        if all(columnas_anteriores.get(c) in columnas_ifc for c in ("material_col", "cantidad_col", "guid_col")):
+            # Nueva revisión con las mismas propiedades clave: no hace falta volver a consultar a la IA
+            columnas_detectadas = columnas_anteriores
+            anterior["columnas_reutilizadas"] = True
+        else:
+            modelo = cargar_modelo()
+            with st.spinner(" Consultando IA para detectar columnas clave..."):
+                respuesta = modelo.generate_content(prompt_identificar).text
 
-        columnas_detectadas = {}
-        for linea in respuesta.strip().splitlines():
-            if ":" in linea:
-                clave, valor = linea.split(":", 1)
-                columnas_detectadas[clave.strip()] = valor.strip()
+            columnas_detectadas = {}
+            for linea in respuesta.strip().splitlines():
+                if ":" in linea:
+                    clave, valor = linea.split(":", 1)
+                    columnas_detectadas[clave.strip()] = valor.strip()
 
         material_col = columnas_detectadas.get("material_col")
         cantidad_col = columnas_detectadas.get("cantidad_col")
         unidad_col = columnas_detectadas.get("unidad_col")
         guid_col = columnas_detectadas.get("guid_col")
 
-        columnas_validas = [c for c in [material_col, cantidad_col, unidad_col, guid_col] if c in df_ifc.columns]
-        df_filtrado = df_ifc[columnas_validas].copy()
+        columnas_validas = [c for c in [material_col, cantidad_col, unidad_col, guid_col] if c in columnas_ifc]
+        if FORMATO_LARGO:
+            df_filtrado = pivotar_propiedades(tabla_ifc, columnas_validas)
+        else:
+            df_filtrado = df_ifc[columnas_validas].copy()
 
         rename_map = {material_col: "Material", cantidad_col: "Cantidad", guid_col: "ID"}
-        if unidad_col and unidad_col in df_ifc.columns:
+        if unidad_col and unidad_col in columnas_ifc:
             rename_map[unidad_col] = "Unidad"
         df_filtrado.rename(columns=rename_map, inplace=True)
 
+        if modo_revision and "ID" in df_filtrado.columns:
+            # Hash de contenido de cada elemento (todas sus propiedades extraídas) para compararlo por GlobalId
+            elementos_revision = df_filtrado[[c for c in ("ID", "Material", "Cantidad", "Unidad") if c in df_filtrado.columns]].copy()
+            elementos_revision["ID"] = elementos_revision["ID"].astype(str).str.strip()
+            elementos_revision["hash_elemento"] = hash_elementos(tabla_ifc if FORMATO_LARGO else df_ifc).to_numpy()
+            guardar_revision(proyecto, hash_actual, nombre_actual, elementos_revision, columnas_detectadas)
+            if anterior is not None:
+                st.session_state["revision_anterior"] = anterior
+                st.session_state["comparacion_revision"] = comparar_revisiones(anterior["elementos"], elementos_revision)
+
         st.session_state.df_filtrado = df_filtrado
+        # La matriz de huella es de las columnas del IFC anterior
+        st.session_state.pop("matriz_huella", None)
+        st.session_state.pop("seleccion_huella", None)
+        st.session_state.pop("df_huella", None)
         st.rerun()
 
 # ===============================================================
@@ -179,6 +375,18 @@ if "df_filtrado" in st.session_state:
     st.markdown("###  Datos filtrados por IA")
     st.dataframe(df)
 
+    if "comparacion_revision" in st.session_state:
+        anterior = st.session_state["revision_anterior"]
+        cambios = resumen_cambios(st.session_state["comparacion_revision"])
+        st.info(
+            f" Comparado con la revisión anterior ({anterior['archivo']}, {anterior['fecha'][:10]}): "
+            f"{cambios['nuevo']} nuevos, {cambios['modificado']} modificados, {cambios['eliminado']} eliminados "
+            f"y {cambios['igual']} sin cambios"
+            + (". Columnas clave reutilizadas sin consultar a la IA." if anterior.get("columnas_reutilizadas") else "")
+        )
+    elif modo_revision and "ID" not in df.columns:
+        st.warning("⚠️ Sin columna de GlobalId (ID) no se puede comparar con otras revisiones.")
+
     with st.expander(" Seleccionar materiales a analizar"):
         materiales = df['Material'].dropna().unique().tolist()
         all_selected = st.checkbox("Seleccionar todos los materiales", value=True, key="select_all_materials")
@@ -206,19 +414,179 @@ if "df_filtrado" in st.session_state:
 # ===============================================================
 # 09 --- GENERACIÓN DE HUELLA DE CARBONO -----------------------------
 # ===============================================================
-    if st.button(" Calcular huella de carbono"):
+    modo_calculo = st.radio(
+        " Modo de cálculo",
+        ["Local (base de datos)", "IA (Gemini)"],
+        horizontal=True,
+        key="modo_calculo",
+        help="El modo local calcula la huella directamente con la base de sostenibilidad y la actualiza al cambiar etapas, materiales o distancia; la IA solo se usa para explicar resultados.",
+    )
+    modo_local = modo_calculo.startswith("Local")
+    filas_seleccionadas = df["Material"].isin(seleccionados).to_numpy() if seleccionados else None
+
+    if modo_local:
+        if "ID" not in df.columns:
+            st.error("❌ No se detectó la columna de GlobalId (ID); no se puede calcular la huella por elemento.")
+            st.stop()
+
+        if "matriz_huella" not in st.session_state:
+            # GWP de cada elemento en todas las etapas, una vez por IFC: después las etapas, los materiales
+            # y la distancia solo filtran y escalan la matriz, sin volver a buscar en la base
+            with st.spinner(" Normalizando materiales y preparando la huella por etapa..."):
+                st.session_state["matriz_huella"] = matriz_de_elementos(df)
+                if "comparacion_revision" in st.session_state:
+                    # La revisión anterior se recalcula con la misma selección para comparar en igualdad de condiciones
+                    st.session_state["matriz_anterior"] = matriz_de_elementos(st.session_state["revision_anterior"]["elementos"])
+                st.session_state.pop("seleccion_huella", None)
+
+        distancia_km = st.session_state.get("distancia_km") if "A4" in etapas_seleccionadas else None
+        seleccion_actual = (tuple(etapas_seleccionadas), tuple(seleccionados), distancia_km)
+        if st.session_state.get("seleccion_huella") != seleccion_actual:
+            matriz = st.session_state["matriz_huella"]
+            df_huella = huella_desde_matriz(matriz, etapas_seleccionadas, distancia_km=distancia_km, filas=filas_seleccionadas)
+            df_huella.insert(df_huella.columns.get_loc("Material") + 1, "Material_Base", df_huella["Material"])
+            df_huella["Material"] = df["Material"]
+            df_huella["Unidad"] = "kg CO₂ eq"
+
+            st.session_state["seleccion_huella"] = seleccion_actual
+            st.session_state["df_huella"] = df_huella
+            st.session_state["resumen_huella"] = resumen_desde_matriz(matriz, etapas_seleccionadas, distancia_km=distancia_km, filas=filas_seleccionadas)
+            # Los elementos no seleccionados se exportan con Total = 0
+            ids_ifc = df["ID"].astype(str).str.strip().tolist()
+            st.session_state["df_resultado"] = postprocesar_huella(df_huella[["ID", "Total", "Unidad"]].copy(), ids_ifc)
+            if "matriz_anterior" in st.session_state:
+                elementos_anteriores = st.session_state["revision_anterior"]["elementos"]
+                filas_anteriores = elementos_anteriores["Material"].isin(seleccionados).to_numpy() if seleccionados else None
+                st.session_state["totales_revision_anterior"] = huella_desde_matriz(
+                    st.session_state["matriz_anterior"], etapas_seleccionadas, distancia_km=distancia_km, filas=filas_anteriores
+                )[["ID", "Total"]]
+            st.session_state.pop("tabla_original", None)
+            st.session_state.pop("huella_ia", None)
+            st.session_state.pop("explicacion_huella", None)
+
+    seleccion_ia = {
+        "etapas": list(etapas_seleccionadas),
+        "distancia_km": st.session_state.get("distancia_km") if "A4" in etapas_seleccionadas else None,
+    }
+    # Clave del cálculo con IA para este IFC y esta selección: tras recargar la página (o desde otra sesión
+    # con el mismo IFC) la app se vuelve a enganchar al trabajo en curso o a su resultado ya terminado
+    clave_ia, trabajo_previo = None, None
+    if not modo_local:
+        anterior = st.session_state.get("revision_anterior") if "comparacion_revision" in st.session_state else None
+        clave_ia = "huella_ia:" + hash_contenido(json.dumps({
+            "ifc": st.session_state.get("ultimo_ifc"), "seleccion": seleccion_ia, "materiales": sorted(map(str, seleccionados)),
+            "salida": "json" if SALIDA_IA_ESTRUCTURADA else "markdown", "revision": anterior["hash_ifc"] if anterior else None,
+        }, sort_keys=True, default=str).encode("utf-8"))
+        if "trabajo_huella_ia" not in st.session_state and st.session_state.get("clave_ia_recogida") != clave_ia:
+            trabajo_previo = buscar_trabajo(clave_ia)
+
+    if not modo_local and not etapas_seleccionadas:
+        st.warning("⚠️ Selecciona al menos una etapa del ciclo de vida para calcular la huella con IA.")
+    calcular = not modo_local and st.button(" Calcular huella de carbono", disabled=not etapas_seleccionadas)
+    reanudar = not calcular and trabajo_previo is not None
+    if calcular or reanudar:
+        df_analizar = df[filas_seleccionadas].copy() if filas_seleccionadas is not None else df.copy()
+
+        # Memoria de mapeos + emparejamiento local: la IA solo ve los materiales nuevos
+        with st.spinner(" Normalizando materiales..."):
+            df_analizar = normalizar_materiales_con_ia(df_analizar, st.session_state.hojas_sostenibilidad, usar_ia=True)
+
+        # Modo revisión: los elementos sin cambios reutilizan la huella de la IA de la revisión anterior
+        # si se calculó con las mismas etapas y distancia; solo se envían los nuevos y modificados
+        st.session_state["seleccion_ia"] = seleccion_ia
+        st.session_state["clave_huella_ia"] = clave_ia
+        st.session_state.pop("huella_reutilizada", None)
+        st.session_state.pop("totales_revision_anterior", None)
+        if "comparacion_revision" in st.session_state:
+            anterior = st.session_state["revision_anterior"]
+            reutilizados = totales_reutilizables(anterior, st.session_state["comparacion_revision"], seleccion_ia)
+            ids_analizar = df_analizar["ID"].astype(str).str.strip()
+            reutilizados = reutilizados[reutilizados["ID"].isin(set(ids_analizar))]
+            df_analizar = df_analizar[~ids_analizar.isin(set(reutilizados["ID"]))]
+            st.session_state["huella_reutilizada"] = reutilizados
+            if anterior.get("seleccion_ia") == seleccion_ia:
+                st.session_state["totales_revision_anterior"] = anterior["totales_ia"]
+            if not reutilizados.empty:
+                st.info(f" {len(reutilizados)} elementos sin cambios reutilizan la huella de la revisión anterior; se envían a la IA {len(df_analizar)}")
+
+    if modo_local and "df_huella" in st.session_state:
+        st.markdown("###  Huella de carbono por elemento")
+        st.dataframe(st.session_state["df_huella"])
+        st.markdown("###  Resumen por material")
+        st.dataframe(st.session_state["resumen_huella"])
+
+        if st.button(" Explicar resultados con IA"):
+            modelo = cargar_modelo()
+            prompt_explicacion = f"""
+Actúa como experto ambiental.
+Estos son los resultados de huella de carbono por material, calculados a partir de la base de sostenibilidad:
+
+{st.session_state["resumen_huella"].to_markdown(index=False)}
+
+Etapas seleccionadas: {etapas_seleccionadas}
+
+Explica brevemente qué materiales y etapas concentran la mayor parte de la huella y qué alternativas podrían reducirla.
+No recalcules los valores.
+"""
+            with st.spinner(" Consultando IA..."):
+                st.session_state["explicacion_huella"] = modelo.generate_content(prompt_explicacion).text
+
+        if "explicacion_huella" in st.session_state:
+            st.markdown(st.session_state["explicacion_huella"])
+
+    if reanudar:
+        st.session_state["trabajo_huella_ia"] = trabajo_previo
+        st.session_state["ids_enviados_ia"] = df_analizar["ID"].astype(str).str.strip().tolist() if "ID" in df_analizar.columns else []
+        st.info(" Cálculo con IA de este IFC y esta selección recuperado tras recargar la página")
+    elif calcular and df_analizar.empty and "comparacion_revision" in st.session_state:
+        # Ningún elemento nuevo ni modificado: el resultado es el de la revisión anterior
+        st.session_state["df_resultado"] = completar_con_revision(pd.DataFrame(columns=["ID", "Total", "Unidad"]))
+        if modo_revision and archivo_ifc is not None:
+            guardar_totales_ia(proyecto, hash_actual, st.session_state["df_resultado"], st.session_state["seleccion_ia"])
+        st.session_state.pop("tabla_original", None)
+        st.session_state.pop("huella_ia", None)
+        st.session_state.pop("seleccion_huella", None)
+        st.success("✅ Sin cambios respecto a la revisión anterior: se reutiliza su huella")
+    elif calcular:
         modelo = cargar_modelo()
-        df_analizar = df[df['Material'].isin(seleccionados) if seleccionados else df.index].copy()
-        markdown_sostenibilidad = formatear_hojas_para_ia(st.session_state.hojas_sostenibilidad, max_filas_por_hoja=30)
         km_str = f"\nDistancia A4: {st.session_state.get('distancia_km', 'No especificada')} km" if "A4" in etapas_seleccionadas else ""
 
+        if SALIDA_IA_ESTRUCTURADA:
+            instrucciones_salida = """3. Devuelve un array JSON con un objeto por cada elemento de la tabla IFC, con:
+- ID: GlobalId del elemento IFC, igual que en la tabla
+- Material
+- Cantidad: número
+- GWP: objeto con el GWP por unidad de cada etapa seleccionada [kg CO₂ eq/unidad]
+- Total: huella total del elemento [kg CO₂ eq], número
+- Unidad: "kg CO₂ eq"
+"""
+        else:
+            instrucciones_salida = """3. Genera una única tabla con columnas claras:
+- ID (GlobalId del elemento IFC)
+- Material
+- Cantidad [unidad]
+- GWP por etapa [kg CO₂ eq/unidad]
+- Total
+
+⚠️ IMPORTANTE:
+- Solo incluye la línea de encabezado en la PRIMERA parte.
+- NO incluyas líneas Markdown de alineación (como `:--`, `--:`, etc.) fuera de la primera tabla.
+- NO repitas encabezados en las partes siguientes.
+- NO agregues texto antes o después de la tabla.
+"""
+
         # Dividir en bloques de 20
         chunk_size = 20
         bloques = [df_analizar.iloc[i:i+chunk_size] for i in range(0, len(df_analizar), chunk_size)]
-        respuesta_total = ""
+        prompts = []
 
         for i, bloque in enumerate(bloques):
             markdown_tabla = bloque.to_markdown(index=False)
+            # Solo las filas de la base relacionadas con los materiales de este bloque
+            consultas = bloque["Material"].tolist() + bloque.get("Material_Normalizado", pd.Series(dtype=object)).tolist()
+            markdown_sostenibilidad = contexto_relevante_para_ia(
+                st.session_state.hojas_sostenibilidad, consultas, indice=st.session_state.get("indice_sostenibilidad")
+            )
 
             prompt = f"""
 Actúa como experto ambiental.
@@ -234,25 +602,46 @@ Etapas seleccionadas: {etapas_seleccionadas}
 {km_str}
 
 1. Usa los valores de la columna 'Cantidad' para el cálculo.
+Usa la columna 'Material_Normalizado' como nombre del material en la base de sostenibilidad (si es "NO ENCONTRADO", interpreta la columna 'Material').
 Si la unidad es m³, interpreta como volumen.
 2. Si algún valor falta, asigna 0.
-3. Genera una única tabla con columnas claras:
-- ID (GlobalId del elemento IFC)
-- Material
-- Cantidad [unidad]
-- GWP por etapa [kg CO₂ eq/unidad]
-- Total
-
-⚠️ IMPORTANTE:
-- Solo incluye la línea de encabezado en la PRIMERA parte.
-- NO incluyas líneas Markdown de alineación (como `:--`, `--:`, etc.) fuera de la primera tabla.
-- NO repitas encabezados en las partes siguientes.
-- NO agregues texto antes o después de la tabla.
-"""
-
-            with st.spinner(f" Consultando IA (parte {i+1}/{len(bloques)})..."):
-                parte = modelo.generate_content(prompt).text
-                respuesta_total += parte.strip() + "\n"
+{instrucciones_salida}"""
+            prompts.append(prompt)
+
+        # Los bloques se consultan en paralelo en segundo plano y las respuestas se unen en el orden original.
+        # Con salida estructurada cada respuesta es un array JSON validado contra el esquema
+        parametros_ia = {"generation_config": configuracion_json(etapas_seleccionadas)} if SALIDA_IA_ESTRUCTURADA else {}
+        st.session_state["trabajo_huella_ia"] = lanzar_trabajo(
+            "huella_ia", generar_en_paralelo, modelo, prompts,
+            clave=clave_ia,
+            max_concurrencia=IA_CONCURRENCIA,
+            peticiones_por_minuto=IA_PETICIONES_MINUTO,
+            **parametros_ia,
+        )
+        st.session_state["ids_enviados_ia"] = df_analizar["ID"].astype(str).str.strip().tolist() if "ID" in df_analizar.columns else []
+        st.session_state.pop("tabla_original", None)
+        st.session_state.pop("huella_ia", None)
+
+    partes = seguir_trabajo("trabajo_huella_ia", " Consultando IA en paralelo") if "trabajo_huella_ia" in st.session_state else None
+    if partes is not None:
+        # Resultado recogido: no volver a engancharse a este trabajo en la misma sesión
+        st.session_state["clave_ia_recogida"] = st.session_state.get("clave_huella_ia")
+    if partes is not None and SALIDA_IA_ESTRUCTURADA:
+        # Cada bloque ya trae [ID, Material, Cantidad, GWP por etapa, Total, Unidad]: sin segunda consulta ni limpieza
+        huella_ia, errores = unir_respuestas_json(partes, st.session_state["seleccion_ia"]["etapas"])
+        for bloque, error in errores:
+            st.warning(f"⚠️ Bloque {bloque + 1}: {error}")
+        st.session_state["huella_ia"] = huella_ia
+        st.session_state["df_resultado"] = completar_con_revision(huella_ia[["ID", "Total", "Unidad"]])
+        # Al volver al modo local se recalcula su resultado
+        st.session_state.pop("seleccion_huella", None)
+        if modo_revision and archivo_ifc is not None:
+            guardar_totales_ia(proyecto, hash_actual, st.session_state["df_resultado"], st.session_state["seleccion_ia"])
+    elif partes is not None:
+        modelo = cargar_modelo()
+        respuesta_total = ""
+        for parte in partes:
+            respuesta_total += parte.strip() + "\n"
 
         # ---------------------------------------------------------
         # LIMPIEZA de respuesta_total antes de normalizar
@@ -319,7 +708,12 @@ Tu tarea es:
                     df_normalizado = df_normalizado.rename(columns={col_total: "Total"})
 
                 st.text(f"Columnas de df_normalizado: {df_normalizado.columns.tolist()}")
+                df_normalizado = completar_con_revision(df_normalizado)
                 st.session_state["df_resultado"] = df_normalizado
+                # Al volver al modo local se recalcula su resultado
+                st.session_state.pop("seleccion_huella", None)
+                if modo_revision and archivo_ifc is not None and "ID" in df_normalizado.columns:
+                    guardar_totales_ia(proyecto, hash_actual, df_normalizado, st.session_state.get("seleccion_ia"))
 
             except Exception as e:
                 st.error(f"❌ No se pudo leer la tabla normalizada: {e}")
@@ -331,6 +725,18 @@ Tu tarea es:
 # ===============================================================
 # 10 --- EXPORTACIÓN IFC CON RESULTADOS -------------------------
 # ===============================================================
+if "huella_ia" in st.session_state:
+    # Salida estructurada: la tabla de la IA ya es un DataFrame tipado, no hace falta normalizarla
+    huella_ia = st.session_state["huella_ia"]
+    st.markdown("### \U0001F4DC Huella por elemento calculada por la IA")
+    st.dataframe(huella_ia)
+
+    ids_faltantes = set(st.session_state.get("ids_enviados_ia", [])) - set(huella_ia["ID"])
+    st.info(f"🔍 Elementos enviados: {len(st.session_state.get('ids_enviados_ia', []))} — Devueltos por la IA: {len(huella_ia)}")
+    if ids_faltantes:
+        st.warning(f"⚠️ {len(ids_faltantes)} elementos no fueron incluidos en el resultado. Puedes revisarlos manualmente si es necesario.")
+        st.text("IDs faltantes:\n" + "\n".join(sorted(ids_faltantes)))
+
 if "tabla_original" in st.session_state and "ruta_guardado" in st.session_state:
     st.markdown("## \U0001F4C4 Exportar huella de carbono al IFC")
 
@@ -472,7 +878,7 @@ Sin texto adicional ni explicaciones. No agregues líneas de separación redunda
                 st.warning(f"⚠️ {len(ids_faltantes)} elementos no fueron incluidos en el resultado. Puedes revisarlos manualmente si es necesario.")
                 st.text("IDs faltantes:\n" + "\n".join(sorted(ids_faltantes)))
 
-        st.session_state["df_resultado"] = df_normalizado
+        st.session_state["df_resultado"] = completar_con_revision(df_normalizado)
         st.success("✅ Datos listos para exportar")
 
     except Exception as e:
@@ -499,8 +905,10 @@ if "df_resultado" in st.session_state and "ruta_guardado" in st.session_state:
         st.error("❌ La columna 'ID' no está presente.")
         st.stop()
 
-    # Limpiar columna Total
-    if "Total" in df.columns:
+    # Limpiar columna Total (solo si llega como texto, p. ej. de una tabla Markdown)
+    if "Total" in df.columns and pd.api.types.is_numeric_dtype(df["Total"]):
+        df["Total"] = df["Total"].fillna(0.0)
+    elif "Total" in df.columns:
         def limpiar_valor_total(valor):
             import re
             match = re.search(r"[\-\d\.,]+", str(valor))
@@ -529,35 +937,48 @@ if "df_resultado" in st.session_state and "ruta_guardado" in st.session_state:
     st.markdown("### ✅ Datos listos para exportar")
     st.dataframe(df)
 
-    import ifcopenshell
-    model_debug = ifcopenshell.open(st.session_state["ruta_guardado"])
-    no_encontrados = []
-
-    for guid in df["ID"]:
-        guid = str(guid).strip()
-        try:
-            if not model_debug.by_guid(guid):
-                no_encontrados.append(guid)
-        except Exception as e:
-            st.warning(f"⚠️ Error al buscar GUID '{guid}': {e}")
-            no_encontrados.append(guid)
+    guids_ifc = st.session_state.get("guids_ifc", set())
+    no_encontrados = [guid for guid in df["ID"].astype(str).str.strip() if guid not in guids_ifc]
 
     if no_encontrados:
         st.warning(f"⚠️ Algunos GUIDs no se encontraron en el IFC:\n{no_encontrados}")
     else:
         st.success("✅ Todos los GUIDs están presentes en el archivo IFC")
 
-    if st.button("🚀 Ejecutar exportación IFC"):
-        try:
-            ruta_exportado = agregar_huella_ifc(
-                ruta_ifc_original=st.session_state["ruta_guardado"],
-                df_resultado=df,
-                nombre_salida="IFC_con_ImpactoAmbiental.ifc"
-            )
+    if "comparacion_revision" in st.session_state:
+        st.markdown("###  Cambios de huella respecto a la revisión anterior")
+        if "totales_revision_anterior" in st.session_state:
+            delta = delta_huella(st.session_state["comparacion_revision"], st.session_state["totales_revision_anterior"], df)
+            col_anterior, col_actual, col_delta = st.columns(3)
+            col_anterior.metric("Revisión anterior", f"{delta['total_anterior']:,.2f} kg CO₂ eq")
+            col_actual.metric("Revisión actual", f"{delta['total_actual']:,.2f} kg CO₂ eq")
+            col_delta.metric("Diferencia", f"{delta['delta']:+,.2f} kg CO₂ eq",
+                             delta=f"{delta['delta']:+,.2f}", delta_color="inverse")
+            st.dataframe(delta["por_estado"])
+            st.markdown("#### Diferencia por material")
+            st.dataframe(delta["por_material"])
+            with st.expander(f"Elementos con cambios ({len(delta['elementos'])})"):
+                st.dataframe(delta["elementos"])
+        else:
+            st.info("ℹ️ La revisión anterior no tiene huella calculada con la IA con las mismas etapas y distancia: no se puede comparar.")
+
+    if st.button("🚀 Ejecutar exportación IFC", disabled="trabajo_exportacion" in st.session_state):
+        # ifcopenshell se carga solo al exportar, no en cada arranque de la app
+        from funciones.agregar_huella_ifc import agregar_huella_ifc
+        st.session_state.pop("ifc_exportado", None)
+        st.session_state["trabajo_exportacion"] = lanzar_trabajo(
+            "exportacion", agregar_huella_ifc,
+            ruta_ifc_original=st.session_state["ruta_guardado"],
+            df_resultado=df,
+            nombre_salida="IFC_con_ImpactoAmbiental.ifc",
+            con_progreso=False,
+        )
+
+    if "trabajo_exportacion" in st.session_state:
+        ruta_exportado = seguir_trabajo("trabajo_exportacion", "🚀 Exportando IFC")
+        if ruta_exportado is not None:
             st.session_state["ifc_exportado"] = ruta_exportado
             st.success("✅ IFC exportado correctamente.")
-        except Exception as e:
-            st.error(f"❌ Error al exportar: {e}")
 
     if "ifc_exportado" in st.session_state:
         with open(st.session_state["ifc_exportado"], "rb") as f:
@@ -582,7 +1003,11 @@ if "hojas_sostenibilidad" in st.session_state and "df_resultado" in st.session_s
     if consulta_usuario:
         modelo = cargar_modelo()
         contexto_ifc = df_resultado.to_markdown(index=False)
-        contexto_bbdd = formatear_hojas_para_ia(hojas_sostenibilidad, max_filas_por_hoja=20)
+        # Solo las filas de la base relacionadas con la pregunta y con los materiales del resultado
+        consultas = [consulta_usuario] + (df_resultado["Material"].dropna().unique().tolist() if "Material" in df_resultado.columns else [])
+        contexto_bbdd = contexto_relevante_para_ia(
+            hojas_sostenibilidad, consultas, indice=st.session_state.get("indice_sostenibilidad")
+        )
 
         # Construir historial como parte del prompt (últimos 5 turnos)
         historial = st.session_state["historial_chat"][-5:]
@@ -622,3 +1047,57 @@ Asistente:"""
             st.markdown(respuesta)
 else:
     st.info("🔄 Carga un archivo IFC y realiza los cálculos para activar el asistente.")
+
+# ===============================================================
+# 13 --- PANEL DE DEPURACIÓN: TIEMPOS, MEMORIA E IA -------------
+# ===============================================================
+if st.sidebar.toggle("🐞 Panel de depuración"):
+    with st.sidebar:
+        st.markdown("### 🐞 Rendimiento del proceso")
+        st.caption("Registro común a todas las sesiones de este servidor.")
+        memoria = instrumentacion.memoria_proceso()
+        st.metric("Memoria RSS", f"{memoria.get('rss_mb', '?')} MB", help=f"Pico: {memoria.get('pico_rss_mb', '?')} MB")
+
+        resumen_etapas = instrumentacion.resumen_etapas()
+        if resumen_etapas:
+            st.markdown("**Etapas**")
+            st.dataframe(pd.DataFrame(resumen_etapas), hide_index=True)
+        else:
+            st.caption("Aún no se ha registrado ninguna etapa.")
+
+        contadores = instrumentacion.contadores()
+        if contadores:
+            st.markdown("**Contadores (IA)**")
+            st.dataframe(pd.Series(contadores, name="valor").round(3))
+
+        memoria_python = instrumentacion.instantanea_tracemalloc()
+        if memoria_python:
+            st.markdown("**Memoria de Python por línea (tracemalloc)**")
+            st.dataframe(pd.DataFrame(memoria_python), hide_index=True)
+
+        st.download_button("⬇️ Registro JSON", data=json.dumps(instrumentacion.exportar_json(), ensure_ascii=False, default=str),
+                           file_name="instrumentacion.json", mime="application/json")
+        st.download_button("⬇️ Traza para Chrome/Perfetto", data=json.dumps(instrumentacion.exportar_chrome_trace(), default=str),
+                           file_name="traza_chrome.json", mime="application/json")
+        if st.button("🧹 Reiniciar registro"):
+            instrumentacion.reiniciar()
+            st.rerun()
+
+# ===============================================================
+# 14 --- SEGUIMIENTO DE TRABAJOS EN SEGUNDO PLANO ---------------
+# ===============================================================
+with st.sidebar.expander("🗂️ Trabajos en segundo plano"):
+    trabajos = listar_trabajos()
+    if trabajos:
+        tabla_trabajos = pd.DataFrame(trabajos)[["tipo", "estado", "progreso", "creado", "error"]]
+        tabla_trabajos["creado"] = pd.to_datetime(tabla_trabajos["creado"], unit="s").dt.strftime("%H:%M:%S")
+        st.dataframe(tabla_trabajos, hide_index=True)
+        st.caption("Los trabajos siguen en el servidor al recargar la página; al volver a subir el mismo IFC se recuperan.")
+    else:
+        st.caption("No hay trabajos en este servidor.")
+
+# Mientras haya trabajos activos la página se vuelve a ejecutar para refrescar su progreso;
+# el resto de la interfaz sigue respondiendo entre refrescos
+if trabajos_en_curso:
+    time.sleep(1)
+    st.rerun()
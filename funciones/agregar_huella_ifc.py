@@ -1,63 +1,218 @@
 import os
+import numpy as np
 import pandas as pd
-import ifcopenshell
-import ifcopenshell.api
-
-def aplicar_colores_por_impacto(model, df_resultado):
-    """Asigna colores a los elementos del IFC según su huella de carbono (compatible con visores como BIMvision)."""
+import ifcopenshell.guid
+
+from funciones.cache_modelos import abrir_copia_ifc
+from funciones.utils.instrumentacion import instrumentar, medir
+
+N_CLASES_COLOR = 10
+
+def rampa_impacto(norm):
+    """
+    Rampa verde → amarillo → rojo para valores normalizados entre 0 y 1 (array de NumPy).
+    Devuelve un array (n, 3) con RGB entre 0 y 1.
+    """
+    norm = np.clip(np.asarray(norm, dtype=float), 0.0, 1.0)
+    r = np.where(norm < 0.5, np.floor(2 * norm * 255), 255)
+    g = np.where(norm < 0.5, 255, np.floor((1 - 2 * (norm - 0.5)) * 255))
+    return np.round(np.column_stack([r, g, np.zeros_like(norm)]) / 255.0, 3)
+
+def clasificar_impacto(totales, n_clases=N_CLASES_COLOR, modo="lineal"):
+    """
+    Asigna a cada total una clase 0..n_clases-1.
+    modo="lineal": intervalos de igual amplitud entre el mínimo y el máximo.
+    modo="cuantiles": intervalos con el mismo número de elementos (útil si unos pocos valores muy altos
+    concentran toda la escala).
+    Devuelve (clases, colores) con colores un array (n_clases, 3) evaluado en el centro de cada clase.
+    """
+    totales = np.nan_to_num(np.asarray(totales, dtype=float), nan=0.0)
+    n_clases = max(1, int(n_clases))
+    if modo == "cuantiles":
+        limites = np.quantile(totales, np.linspace(0, 1, n_clases + 1)) if len(totales) else np.zeros(n_clases + 1)
+    elif modo == "lineal":
+        limites = np.linspace(totales.min(), totales.max(), n_clases + 1) if len(totales) else np.zeros(n_clases + 1)
+    else:
+        raise ValueError(f"❌ Modo de clasificación no válido: {modo}. Usa 'lineal' o 'cuantiles'")
+
+    clases = np.clip(np.searchsorted(limites[1:-1], totales, side="right"), 0, n_clases - 1)
+    if limites[-1] == limites[0]:
+        clases = np.zeros(len(totales), dtype=int)
+    colores = rampa_impacto((np.arange(n_clases) + 0.5) / n_clases if n_clases > 1 else [0.0])
+    return clases, colores
+
+def _crear_estilo(model, color_rgb):
+    color = model.create_entity("IfcColourRgb", Name=None, Red=color_rgb[0], Green=color_rgb[1], Blue=color_rgb[2])
+    surface_style = model.create_entity("IfcSurfaceStyle",
+        Name=f"Color_{tuple(color_rgb)}",
+        Side="BOTH",
+        Styles=[model.create_entity("IfcSurfaceStyleRendering", SurfaceColour=color)]
+    )
+    return model.create_entity("IfcPresentationStyleAssignment", Styles=[surface_style])
+
+def _asignar_estilo(model, item, estilo):
+    # Siempre un IfcStyledItem nuevo: el que ya tenga el ítem puede estar compartido (sus Styles con
+    # otros ítems, o el ítem con otros elementos vía IfcRepresentationMap) y modificarlo recolorearía el resto
+    return model.create_entity("IfcStyledItem", Item=item, Styles=[estilo])
+
+@instrumentar(categoria="exportacion")
+def aplicar_colores_por_impacto(model, df_resultado, n_clases=N_CLASES_COLOR, modo="lineal", por_guid=None):
+    """
+    Asigna colores a los elementos del IFC según su huella de carbono (compatible con visores como BIMvision).
+    Los totales se agrupan en n_clases colores (ver clasificar_impacto) y se crea un único estilo por clase.
+    La geometría compartida mediante IfcRepresentationMap se colorea una sola vez en el mapa si todos
+    sus elementos caen en la misma clase; si no, se colorea cada IfcMappedItem.
+    """
     if "ID" not in df_resultado.columns or "Total" not in df_resultado.columns:
         raise ValueError("❌ El DataFrame necesita columnas 'ID' y 'Total'")
 
-    df_resultado["Total"] = pd.to_numeric(df_resultado["Total"], errors="coerce").fillna(0.0)
-
-    min_val = df_resultado["Total"].min()
-    max_val = df_resultado["Total"].max()
-    rango = max_val - min_val if max_val != min_val else 1e-6
-
-    color_cache = {}
-
-    def interpolar_color(valor):
-        norm = (valor - min_val) / rango
-        if norm < 0.5:
-            r = int(2 * norm * 255)
-            g = 255
-        else:
-            r = 255
-            g = int((1 - 2 * (norm - 0.5)) * 255)
-        b = 0
-        return (r / 255.0, g / 255.0, b / 255.0)
-
-    for _, row in df_resultado.iterrows():
-        guid = str(row["ID"]).strip()
-        total = row["Total"]
-        producto = model.by_guid(guid)
-        if not producto or not hasattr(producto, "Representation"):
-            continue
+    if por_guid is None:
+        por_guid = indexar_guids(model)
 
-        rep = producto.Representation
+    totales = pd.to_numeric(df_resultado["Total"], errors="coerce").fillna(0.0).to_numpy()
+    clases, colores = clasificar_impacto(totales, n_clases=n_clases, modo=modo)
+
+    # Ítems de cada elemento: directos (se colorean solos) y mapeados (pueden compartir el mapa)
+    clase_item = {}
+    items = {}
+    clases_mapa = {}
+    mapas = {}
+    for guid, clase in zip(df_resultado["ID"], clases):
+        producto = por_guid.get(str(guid).strip()) if pd.notna(guid) else None
+        rep = getattr(producto, "Representation", None) if producto is not None else None
         if not rep or not hasattr(rep, "Representations"):
             continue
-
         for subrep in rep.Representations:
-            if hasattr(subrep, "Items"):
-                for item in subrep.Items:
-                    color_rgb = interpolar_color(total)
-                    color_key = tuple(round(c, 3) for c in color_rgb)
-
-                    if color_key not in color_cache:
-                        color = model.create_entity("IfcColourRgb", Name=None, Red=color_key[0], Green=color_key[1], Blue=color_key[2])
-                        surface_style = model.create_entity("IfcSurfaceStyle",
-                            Name=f"Color_{color_key}",
-                            Side="BOTH",
-                            Styles=[model.create_entity("IfcSurfaceStyleRendering", SurfaceColour=color)]
-                        )
-                        pres_style = model.create_entity("IfcPresentationStyleAssignment", Styles=[surface_style])
-                        color_cache[color_key] = pres_style
-
-                    model.create_entity("IfcStyledItem", Item=item, Styles=[color_cache[color_key]])
-
-
-def agregar_huella_ifc(ruta_ifc_original, df_resultado, nombre_salida="IFC_con_pset_exportado.ifc"):
+            for item in getattr(subrep, "Items", None) or []:
+                clase_item[item.id()] = int(clase)
+                items[item.id()] = item
+                if item.is_a("IfcMappedItem"):
+                    mapa = item.MappingSource
+                    clases_mapa.setdefault(mapa.id(), set()).add(int(clase))
+                    mapas[mapa.id()] = mapa
+
+    estilos = {}
+    def estilo_de(clase):
+        if clase not in estilos:
+            estilos[clase] = _crear_estilo(model, colores[clase].tolist())
+        return estilos[clase]
+
+    mapas_coloreados = set()
+    for id_mapa, clases_usadas in clases_mapa.items():
+        if len(clases_usadas) == 1:
+            estilo = estilo_de(next(iter(clases_usadas)))
+            for item in mapas[id_mapa].MappedRepresentation.Items:
+                _asignar_estilo(model, item, estilo)
+            mapas_coloreados.add(id_mapa)
+
+    for id_item, item in items.items():
+        if item.is_a("IfcMappedItem") and item.MappingSource.id() in mapas_coloreados:
+            continue
+        _asignar_estilo(model, item, estilo_de(clase_item[id_item]))
+
+NOMBRE_PSET = "ImpactoAmbiental"
+
+@instrumentar(categoria="exportacion")
+def indexar_guids(model):
+    """
+    Diccionario GlobalId -> entidad construido en una sola pasada por el modelo.
+    """
+    return {e.GlobalId: e for e in model.by_type("IfcRoot")}
+
+def _owner_history(model):
+    # En IFC2X3 OwnerHistory es obligatorio: se reutiliza el del propio archivo
+    if model.schema != "IFC2X3":
+        return None
+    existentes = model.by_type("IfcOwnerHistory")
+    return existentes[0] if existentes else None
+
+def _quitar_pset_anterior(model, producto, nombre):
+    # Reexportar un IFC ya exportado no duplica el pset: se desvincula el anterior
+    for rel in list(getattr(producto, "IsDefinedBy", None) or []):
+        if not rel.is_a("IfcRelDefinesByProperties") or getattr(rel.RelatingPropertyDefinition, "Name", None) != nombre:
+            continue
+        relacionados = [o for o in rel.RelatedObjects if o != producto]
+        if relacionados:
+            rel.RelatedObjects = relacionados
+            continue
+        pset = rel.RelatingPropertyDefinition
+        model.remove(rel)
+        if not model.get_total_inverses(pset):
+            propiedades = list(pset.HasProperties or [])
+            model.remove(pset)
+            for prop in propiedades:
+                if not model.get_total_inverses(prop):
+                    model.remove(prop)
+
+@instrumentar(categoria="exportacion")
+def escribir_psets_huella(model, df_resultado, nombre_pset=NOMBRE_PSET, por_guid=None):
+    """
+    Escribe el pset de huella (IA_HuellaCarbono, IA_Unidad) de todos los elementos de df_resultado
+    creando las entidades directamente, sin pasar por ifcopenshell.api en cada fila.
+    Los GUID se resuelven con un único índice y los elementos con la misma huella y unidad
+    comparten IfcPropertySingleValue, IfcPropertySet e IfcRelDefinesByProperties.
+    Devuelve la lista de errores (filas inválidas o GUID inexistentes).
+    """
+    errores = []
+    if por_guid is None:
+        por_guid = indexar_guids(model)
+    owner_history = _owner_history(model)
+
+    ids = [str(v).strip() if pd.notna(v) else "" for v in df_resultado["ID"]]
+    totales = pd.to_numeric(df_resultado["Total"], errors="coerce")
+    if "Unidad" in df_resultado.columns:
+        unidades = df_resultado["Unidad"].where(df_resultado["Unidad"].notna(), "kg CO2 eq").astype(str)
+    else:
+        unidades = pd.Series("kg CO2 eq", index=df_resultado.index)
+
+    # Última fila de cada GUID -> (huella, unidad)
+    valores = {}
+    for idx, guid, huella, unidad in zip(df_resultado.index, ids, totales, unidades):
+        if not guid or pd.isna(huella):
+            errores.append(f"Fila {idx}: ID o Total no válidos → ID: {guid}, Total: {huella}")
+            continue
+        producto = por_guid.get(guid)
+        if producto is None:
+            errores.append(f"⚠️ No se encontró el objeto IFC con GUID: {guid}")
+            continue
+        if not (producto.is_a("IfcObject") or producto.is_a("IfcContext")):
+            errores.append(f"❌ Error al añadir pset a {guid}: la clase {producto.is_a()} no admite psets por relación")
+            continue
+        valores[guid] = (float(huella), unidad)
+
+    grupos = {}
+    for guid, clave in valores.items():
+        grupos.setdefault(clave, []).append(por_guid[guid])
+
+    propiedades_huella = {}
+    propiedades_unidad = {}
+    for (huella, unidad), productos in grupos.items():
+        for producto in productos:
+            _quitar_pset_anterior(model, producto, nombre_pset)
+
+        if huella not in propiedades_huella:
+            propiedades_huella[huella] = model.create_entity(
+                "IfcPropertySingleValue", Name="IA_HuellaCarbono", NominalValue=model.create_entity("IfcReal", huella)
+            )
+        if unidad not in propiedades_unidad:
+            propiedades_unidad[unidad] = model.create_entity(
+                "IfcPropertySingleValue", Name="IA_Unidad", NominalValue=model.create_entity("IfcLabel", unidad)
+            )
+
+        pset = model.create_entity(
+            "IfcPropertySet", GlobalId=ifcopenshell.guid.new(), OwnerHistory=owner_history,
+            Name=nombre_pset, HasProperties=[propiedades_huella[huella], propiedades_unidad[unidad]]
+        )
+        model.create_entity(
+            "IfcRelDefinesByProperties", GlobalId=ifcopenshell.guid.new(), OwnerHistory=owner_history,
+            RelatedObjects=productos, RelatingPropertyDefinition=pset
+        )
+
+    return errores
+
+@instrumentar(categoria="exportacion")
+def agregar_huella_ifc(ruta_ifc_original, df_resultado, nombre_salida="IFC_con_pset_exportado.ifc",
+                       n_clases=N_CLASES_COLOR, modo_colores="lineal", carpeta_salida="resultados"):
     if not os.path.isfile(ruta_ifc_original):
         raise FileNotFoundError("❌ IFC original no encontrado")
 
@@ -67,40 +222,20 @@ def agregar_huella_ifc(ruta_ifc_original, df_resultado, nombre_salida="IFC_con_p
     if "ID" not in df_resultado.columns:
         raise ValueError("❌ La columna 'ID' es obligatoria para identificar los elementos IFC.")
 
-    model = ifcopenshell.open(ruta_ifc_original)
-    errores = []
-
-    for idx, row in df_resultado.iterrows():
-        guid = str(row.get("ID")).strip()
-        huella = row.get("Total")
-        unidad = row.get("Unidad") if "Unidad" in row and pd.notna(row["Unidad"]) else "kg CO2 eq"
-
-        if not guid or pd.isna(huella):
-            errores.append(f"Fila {idx}: ID o Total no válidos → ID: {guid}, Total: {huella}")
-            continue
-
-        producto = model.by_guid(guid)
-        if not producto:
-            errores.append(f"⚠️ No se encontró el objeto IFC con GUID: {guid}")
-            continue
-
-        try:
-            pset = ifcopenshell.api.run("pset.add_pset", model, product=producto, name="ImpactoAmbiental")
-            ifcopenshell.api.run("pset.edit_pset", model, pset=pset, properties={
-                "IA_HuellaCarbono": float(huella),
-                "IA_Unidad": str(unidad)
-            })
-        except Exception as e:
-            errores.append(f"❌ Error al añadir pset a {guid}: {e}")
+    # Copia privada del modelo: se le añaden psets y estilos, así que no puede ser la compartida de la caché
+    model = abrir_copia_ifc(ruta_ifc_original)
+    por_guid = indexar_guids(model)
+    errores = escribir_psets_huella(model, df_resultado, por_guid=por_guid)
 
-    aplicar_colores_por_impacto(model, df_resultado)
+    aplicar_colores_por_impacto(model, df_resultado, n_clases=n_clases, modo=modo_colores, por_guid=por_guid)
 
-    os.makedirs("resultados", exist_ok=True)
-    ruta_exportado = os.path.join("resultados", nombre_salida)
-    model.write(ruta_exportado)
+    os.makedirs(carpeta_salida, exist_ok=True)
+    ruta_exportado = os.path.join(carpeta_salida, nombre_salida)
+    with medir("escribir_ifc", categoria="exportacion"):
+        model.write(ruta_exportado)
 
     if errores:
-        with open("resultados/errores_exportacion.txt", "w", encoding="utf-8") as f:
+        with open(os.path.join(carpeta_salida, "errores_exportacion.txt"), "w", encoding="utf-8") as f:
             f.write("\n".join(errores))
 
     return ruta_exportado
@@ -1,6 +1,16 @@
 import pandas as pd
 import os
 
+claves_material = ["material", "pset_material", "tipo_material", "nombre_material"]
+claves_volumen = ["volumen", "volume", "pset_volumen", "cantidad_volumen", "vol_total", "cantidad"]
+
+def encontrar_columna(columnas, posibles_nombres):
+    for col in columnas:
+        for clave in posibles_nombres:
+            if clave in str(col).lower():
+                return col
+    return None
+
 def analizar_volumen_por_material(ruta_csv):
     """
     Analiza un CSV exportado del IFC y retorna un DataFrame con volumen total por material.
@@ -11,18 +21,8 @@ def analizar_volumen_por_material(ruta_csv):
 
     df = pd.read_csv(ruta_csv)
 
-    claves_material = ["material", "pset_material", "tipo_material", "nombre_material"]
-    claves_volumen = ["volumen", "volume", "pset_volumen", "cantidad_volumen", "vol_total", "cantidad"]
-
-    def encontrar_columna(df, posibles_nombres):
-        for col in df.columns:
-            for clave in posibles_nombres:
-                if clave in str(col).lower():
-                    return col
-        return None
-
-    col_material = encontrar_columna(df, claves_material)
-    col_volumen = encontrar_columna(df, claves_volumen)
+    col_material = encontrar_columna(df.columns, claves_material)
+    col_volumen = encontrar_columna(df.columns, claves_volumen)
 
     if not col_material or not col_volumen:
         raise ValueError("No se encontró columna de material o volumen.")
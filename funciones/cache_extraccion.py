@@ -0,0 +1,184 @@
+import hashlib
+import json
+import logging
+import os
+import numpy as np
+import pandas as pd
+
+from funciones.utils.instrumentacion import instrumentar
+
+logger = logging.getLogger(__name__)
+
+# Subir cuando cambie el formato de las columnas que devuelve procesar_ifc
+# (3: las columnas de tipos mezclados se guardan como JSON y se restauran al leer)
+VERSION_ESQUEMA = 3
+
+CARPETA_CACHE = os.path.join("cache", "extracciones")
+TAMANO_MAXIMO_CACHE = 2 * 1024 ** 3  # 2 GB
+# Clave de los metadatos propios en el esquema Parquet
+CLAVE_METADATOS = b"ia6d_extraccion"
+
+def hash_contenido(datos):
+    """
+    Devuelve el SHA-256 hexadecimal del contenido de un IFC.
+    Acepta bytes/memoryview (por ejemplo archivo_ifc.getbuffer()) o una ruta a fichero.
+    """
+    sha = hashlib.sha256()
+    if isinstance(datos, (bytes, bytearray, memoryview)):
+        sha.update(datos)
+    else:
+        with open(datos, "rb") as f:
+            for bloque in iter(lambda: f.read(1024 * 1024), b""):
+                sha.update(bloque)
+    return sha.hexdigest()
+
+def _eliminar(ruta):
+    # Otra sesión puede haber purgado la misma entrada a la vez
+    try:
+        os.remove(ruta)
+    except FileNotFoundError:
+        pass
+
+def _ruta_cache(clave, carpeta_cache):
+    return os.path.join(carpeta_cache, f"{clave}.v{VERSION_ESQUEMA}.parquet")
+
+def _codificar(valor):
+    if isinstance(valor, np.generic):
+        valor = valor.item()
+    # Las tuplas (listas de valores de IFC) se marcan para no volver como listas
+    if isinstance(valor, tuple):
+        return json.dumps({"tupla": [v.item() if isinstance(v, np.generic) else v for v in valor]}, default=str)
+    if isinstance(valor, (dict, list)):
+        return json.dumps({"valor": valor}, default=str)
+    return json.dumps(valor, default=str)
+
+def _decodificar(texto):
+    valor = json.loads(texto)
+    if isinstance(valor, dict):
+        return tuple(valor["tupla"]) if "tupla" in valor else valor.get("valor")
+    return valor
+
+def preparar_para_parquet(df):
+    """
+    Arrow no admite columnas object con tipos mezclados (str + float + bool).
+    En esas columnas cada valor se guarda como JSON, que conserva su tipo ([1.5, "N/A", True] ->
+    '1.5', '"N/A"', 'true'); devuelve (DataFrame, columnas codificadas) para anotarlas en los metadatos.
+    """
+    df = df.copy()
+    codificadas = []
+    for col in df.columns:
+        if df[col].dtype == object:
+            tipo = pd.api.types.infer_dtype(df[col], skipna=True)
+            if tipo.startswith("mixed"):
+                df[col] = df[col].map(_codificar, na_action="ignore")
+                codificadas.append(str(col))
+    df.columns = [str(c) for c in df.columns]
+    return df, codificadas
+
+def restaurar_tipos(df, codificadas):
+    """
+    Inverso de preparar_para_parquet: devuelve a su tipo original los valores de las columnas codificadas.
+    """
+    for col in codificadas:
+        if col in df.columns:
+            df[col] = df[col].astype(object).map(_decodificar, na_action="ignore").astype(object)
+    return df
+
+def columnas_codificadas(ruta):
+    """
+    Columnas de tipos mezclados anotadas en los metadatos de un Parquet escrito con escribir_parquet.
+    """
+    import pyarrow.parquet as pq
+
+    metadatos = (pq.read_schema(ruta).metadata or {}).get(CLAVE_METADATOS)
+    return json.loads(metadatos).get("columnas_json", []) if metadatos else []
+
+def escribir_parquet(df, ruta, **metadatos):
+    """
+    Escribe df en Parquet con las columnas de tipos mezclados codificadas (ver preparar_para_parquet)
+    y anotadas en los metadatos junto con metadatos. Escritura atómica: nunca se lee un fichero a medias.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    df_guardar, codificadas = preparar_para_parquet(df)
+    tabla = pa.Table.from_pandas(df_guardar, preserve_index=False)
+    esquema = dict(tabla.schema.metadata or {})
+    esquema[CLAVE_METADATOS] = json.dumps({**metadatos, "columnas_json": codificadas}).encode("utf-8")
+    tabla = tabla.replace_schema_metadata(esquema)
+
+    ruta_tmp = f"{ruta}.{os.getpid()}.tmp"
+    pq.write_table(tabla, ruta_tmp)
+    os.replace(ruta_tmp, ruta)
+    return ruta
+
+def leer_parquet(ruta, columnas=None):
+    """
+    Lee un Parquet escrito con escribir_parquet restaurando los valores de tipos mezclados.
+    """
+    return restaurar_tipos(pd.read_parquet(ruta, columns=columnas), columnas_codificadas(ruta))
+
+@instrumentar(categoria="cache")
+def cargar_extraccion(clave, carpeta_cache=CARPETA_CACHE):
+    """
+    Devuelve el DataFrame cacheado para el hash dado, o None si no existe
+    (o si fue generado con otra versión de esquema).
+    """
+    ruta = _ruta_cache(clave, carpeta_cache)
+    if not os.path.isfile(ruta):
+        return None
+    try:
+        df = leer_parquet(ruta)
+    except Exception as e:
+        logger.warning("⚠️ Entrada de caché ilegible, se descarta (%s): %s", ruta, e)
+        _eliminar(ruta)
+        return None
+    # Marcar como usado recientemente para la política LRU
+    try:
+        os.utime(ruta, None)
+    except FileNotFoundError:
+        pass
+    return df
+
+@instrumentar(categoria="cache")
+def guardar_extraccion(clave, df, carpeta_cache=CARPETA_CACHE, tamano_maximo=TAMANO_MAXIMO_CACHE):
+    """
+    Guarda la extracción en Parquet con la versión de esquema en los metadatos
+    y aplica el límite de tamaño de la caché.
+    """
+    os.makedirs(carpeta_cache, exist_ok=True)
+    ruta = _ruta_cache(clave, carpeta_cache)
+    escribir_parquet(df, ruta, version_esquema=VERSION_ESQUEMA, sha256=clave)
+
+    purgar_cache(carpeta_cache, tamano_maximo, conservar=ruta)
+    return ruta
+
+def purgar_cache(carpeta_cache=CARPETA_CACHE, tamano_maximo=TAMANO_MAXIMO_CACHE, conservar=None):
+    """
+    Elimina entradas de versiones de esquema antiguas y, después, las menos usadas
+    recientemente hasta dejar la caché por debajo de tamano_maximo bytes.
+    La entrada indicada en conservar (la recién escrita) nunca se elimina.
+    """
+    if not os.path.isdir(carpeta_cache):
+        return
+
+    sufijo_actual = f".v{VERSION_ESQUEMA}.parquet"
+    entradas = []
+    for nombre in os.listdir(carpeta_cache):
+        ruta = os.path.join(carpeta_cache, nombre)
+        if not nombre.endswith(".parquet"):
+            continue
+        if not nombre.endswith(sufijo_actual):
+            _eliminar(ruta)
+            continue
+        info = os.stat(ruta)
+        entradas.append((info.st_mtime, info.st_size, ruta))
+
+    total = sum(tamano for _, tamano, _ in entradas)
+    for _, tamano, ruta in sorted(entradas):
+        if total <= tamano_maximo:
+            break
+        if ruta == conservar:
+            continue
+        _eliminar(ruta)
+        total -= tamano
@@ -0,0 +1,144 @@
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+from funciones.cache_extraccion import hash_contenido
+from funciones.utils.instrumentacion import instrumentar
+
+# Memoria que ocupa un modelo abierto respecto al tamaño del archivo (medido: ~7×)
+FACTOR_MEMORIA_MODELO = 8
+
+def _memoria_total():
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (AttributeError, ValueError, OSError):
+        return 8 * 1024 ** 3
+
+# Presupuesto de memoria para modelos abiertos (IFC_MEMORIA_MODELOS_MB o un cuarto de la RAM)
+MEMORIA_MAXIMA_MODELOS = int(os.environ.get("IFC_MEMORIA_MODELOS_MB", 0)) * 1024 ** 2 or _memoria_total() // 4
+
+# hash del IFC -> (modelo, memoria estimada), del menos al más recientemente usado
+_modelos = OrderedDict()
+# (ruta, mtime, tamaño) -> hash, para no volver a leer el archivo entero en cada consulta
+_hashes = {}
+# Hashes y aperturas en curso: clave -> Future, para que cada IFC se lea una sola vez aunque lo pidan
+# varias sesiones a la vez. El cerrojo solo protege los diccionarios; leer y abrir se hace fuera de él
+_en_curso = {}
+_cerrojo_modelos = threading.RLock()
+
+def _memoria_disponible():
+    # Solo en Linux; en otros sistemas se usa únicamente el presupuesto fijo
+    try:
+        with open("/proc/meminfo", encoding="ascii") as f:
+            for linea in f:
+                if linea.startswith("MemAvailable:"):
+                    return int(linea.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+def _una_vez(clave, calcular):
+    """
+    Ejecuta calcular() sin retener el cerrojo global. Si otro hilo ya está calculando la misma clave,
+    espera a su resultado (o a su excepción) en lugar de repetir el trabajo.
+    """
+    with _cerrojo_modelos:
+        futuro = _en_curso.get(clave)
+        propio = futuro is None
+        if propio:
+            futuro = _en_curso[clave] = Future()
+    if not propio:
+        return futuro.result()
+    try:
+        resultado = calcular()
+    except BaseException as e:
+        futuro.set_exception(e)
+        raise
+    else:
+        futuro.set_result(resultado)
+        return resultado
+    finally:
+        with _cerrojo_modelos:
+            _en_curso.pop(clave, None)
+
+def clave_ifc(ruta_ifc):
+    """
+    Hash del contenido del IFC, recordado mientras no cambien la fecha de modificación ni el tamaño.
+    """
+    estado = os.stat(ruta_ifc)
+    clave_archivo = (os.path.abspath(ruta_ifc), estado.st_mtime_ns, estado.st_size)
+    with _cerrojo_modelos:
+        if clave_archivo in _hashes:
+            return _hashes[clave_archivo]
+
+    def calcular():
+        with _cerrojo_modelos:
+            if clave_archivo in _hashes:
+                return _hashes[clave_archivo]
+        valor = hash_contenido(ruta_ifc)
+        with _cerrojo_modelos:
+            _hashes[clave_archivo] = valor
+        return valor
+
+    return _una_vez(("hash", clave_archivo), calcular)
+
+@instrumentar("abrir_ifc", categoria="ifc")
+def _abrir(ruta_ifc):
+    # Importación diferida: ifcopenshell solo se carga cuando realmente se abre un IFC
+    import ifcopenshell
+    return ifcopenshell.open(ruta_ifc)
+
+def _liberar_memoria(necesaria):
+    ocupada = sum(memoria for _, memoria in _modelos.values())
+    while _modelos:
+        disponible = _memoria_disponible()
+        if ocupada + necesaria <= MEMORIA_MAXIMA_MODELOS and (disponible is None or disponible >= necesaria):
+            break
+        _, (_, memoria) = _modelos.popitem(last=False)
+        ocupada -= memoria
+
+def abrir_ifc(ruta_ifc):
+    """
+    Devuelve el modelo del IFC abierto una sola vez por proceso y compartido por todas las sesiones
+    (extracción, tabla larga, exportación...). La clave es el hash del contenido y, si no cabe en
+    MEMORIA_MAXIMA_MODELOS o falta memoria libre, se descartan primero los modelos usados hace más tiempo.
+    Varias sesiones que piden a la vez el mismo IFC esperan a una única apertura; IFC distintos se abren en paralelo.
+    El modelo devuelto es compartido y no debe modificarse: para eso usa abrir_copia_ifc.
+    """
+    clave = clave_ifc(ruta_ifc)
+    with _cerrojo_modelos:
+        if clave in _modelos:
+            _modelos.move_to_end(clave)
+            return _modelos[clave][0]
+
+    def abrir():
+        memoria = os.path.getsize(ruta_ifc) * FACTOR_MEMORIA_MODELO
+        with _cerrojo_modelos:
+            # Otro hilo pudo terminar de abrirlo entre la consulta anterior y esta
+            if clave in _modelos:
+                _modelos.move_to_end(clave)
+                return _modelos[clave][0]
+            _liberar_memoria(memoria)
+        model = _abrir(ruta_ifc)
+        # Un modelo mayor que todo el presupuesto se usa pero no se guarda
+        if memoria <= MEMORIA_MAXIMA_MODELOS:
+            with _cerrojo_modelos:
+                _modelos[clave] = (model, memoria)
+        return model
+
+    return _una_vez(("modelo", clave), abrir)
+
+def abrir_copia_ifc(ruta_ifc):
+    """
+    Abre siempre una copia privada del IFC, fuera de la caché: quien la recibe puede modificarla
+    (p. ej. añadir psets al exportar) sin afectar al modelo compartido que usan otras sesiones.
+    """
+    return _abrir(ruta_ifc)
+
+def vaciar_cache_modelos():
+    """
+    Cierra todos los modelos guardados en la caché del proceso.
+    """
+    with _cerrojo_modelos:
+        _modelos.clear()
@@ -1,6 +1,26 @@
-import pandas as pd
+import json
+import logging
 import os
+import shutil
+import threading
+import pandas as pd
+
+from funciones.cache_extraccion import hash_contenido
+from funciones.utils.formatear_hojas_para_ia import indexar_hojas_para_ia, markdown_por_fila
+from funciones.utils.instrumentacion import instrumentar
+
+logger = logging.getLogger(__name__)
 
+# Subir cuando cambie la forma de limpiar o guardar la base compilada
+VERSION_BASE_COMPILADA = 1
+CARPETA_BASE_COMPILADA = os.path.join("cache", "base_datos")
+
+# Bases ya compiladas en este proceso, compartidas por todas las sesiones de Streamlit:
+# (ruta, mtime, tamaño) -> {"hojas", "indice", "unidades"}
+_bases_compiladas = {}
+_cerrojo_bases = threading.Lock()
+
+@instrumentar("leer_excel_base", categoria="base")
 def cargar_todas_las_hojas(ruta_excel="datos/00 - Base datos DIGITAEC v2.xlsx"):
     """
     Carga todas las hojas de un archivo Excel como DataFrames en un diccionario.
@@ -27,3 +47,156 @@ def cargar_todas_las_hojas(ruta_excel="datos/00 - Base datos DIGITAEC v2.xlsx"):
 
     except Exception as e:
         return {"error": f"Error al leer el archivo Excel: {e}"}
+
+def _es_numero(v):
+    return isinstance(v, (int, float)) and not isinstance(v, bool) and not pd.isna(v)
+
+def _reparar_encabezado(df):
+    # Hojas con el encabezado real dentro de los datos (la mayoría de columnas sin nombre)
+    if df.columns.isna().sum() <= df.shape[1] // 2:
+        return df
+    for i in range(min(5, len(df))):
+        fila = df.iloc[i]
+        if sum(isinstance(v, str) for v in fila) >= 3:
+            df = df.iloc[i + 1:].reset_index(drop=True)
+            df.columns = [v.strip() if isinstance(v, str) else float("nan") for v in fila]
+            return df
+    return df
+
+def limpiar_hoja(df):
+    """
+    Limpia una hoja de cargar_todas_las_hojas: repara el encabezado si está en los datos,
+    separa las filas de unidades del principio ("kg CO2 eq") y convierte a número las columnas
+    cuyos valores son todos numéricos. Las posiciones de las columnas no cambian.
+    Devuelve (hoja, {posición de columna: unidad}).
+    """
+    df = _reparar_encabezado(df)
+    valores = df.to_numpy(dtype=object)
+
+    # Columnas numéricas (o vacías): sin textos a partir de la tercera fila
+    numericas = [all(_es_numero(v) or pd.isna(v) for v in valores[3:, j]) for j in range(df.shape[1])]
+
+    unidades = {}
+    filas_unidades = []
+    for i in range(min(3, len(df))):
+        textos = [j for j, v in enumerate(valores[i]) if isinstance(v, str)]
+        if textos and not any(_es_numero(v) for v in valores[i]) and all(numericas[j] for j in textos):
+            filas_unidades.append(i)
+            for j in textos:
+                unidades.setdefault(j, valores[i][j].strip())
+
+    df = df.drop(index=df.index[filas_unidades]).reset_index(drop=True)
+    columnas = list(df.columns)
+    df.columns = range(df.shape[1])
+    for j, numerica in enumerate(numericas):
+        if numerica:
+            df[j] = pd.to_numeric(df[j], errors="coerce")
+        else:
+            df[j] = df[j].map(lambda v: v if pd.isna(v) else str(v)).astype(object)
+    df.columns = columnas
+    return df, unidades
+
+def _ruta_base_compilada(clave, carpeta_cache):
+    return os.path.join(carpeta_cache, f"{clave}.v{VERSION_BASE_COMPILADA}")
+
+def _guardar_base_compilada(ruta, hojas, unidades, markdown):
+    temporal = f"{ruta}.tmp{os.getpid()}-{threading.get_ident()}"
+    os.makedirs(temporal, exist_ok=True)
+    meta = {"hojas": []}
+    filas_markdown = []
+    for i, (nombre_hoja, df) in enumerate(hojas.items()):
+        archivo = f"hoja_{i}.parquet"
+        df_guardar = df.copy()
+        df_guardar.columns = [str(j) for j in range(df.shape[1])]
+        df_guardar.to_parquet(os.path.join(temporal, archivo), index=False)
+        meta["hojas"].append({
+            "nombre": nombre_hoja,
+            "archivo": archivo,
+            "columnas": [None if pd.isna(c) else str(c) for c in df.columns],
+            "unidades": {str(j): u for j, u in unidades[nombre_hoja].items()},
+        })
+        md = markdown[nombre_hoja]
+        filas_markdown += [(nombre_hoja, -1 - k, linea) for k, linea in enumerate(reversed(md["encabezado"]))]
+        filas_markdown += [(nombre_hoja, k, linea) for k, linea in enumerate(md["filas"])]
+
+    pd.DataFrame(filas_markdown, columns=["hoja", "fila", "texto"]).to_parquet(os.path.join(temporal, "markdown.parquet"), index=False)
+    with open(os.path.join(temporal, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False)
+    try:
+        os.replace(temporal, ruta)
+    except OSError:
+        # Otra sesión o proceso la compiló a la vez
+        shutil.rmtree(temporal, ignore_errors=True)
+
+@instrumentar("leer_base_compilada", categoria="base")
+def _leer_base_compilada(ruta):
+    with open(os.path.join(ruta, "meta.json"), encoding="utf-8") as f:
+        meta = json.load(f)
+    hojas, unidades = {}, {}
+    for info in meta["hojas"]:
+        df = pd.read_parquet(os.path.join(ruta, info["archivo"]))
+        # Los textos vuelven como object, igual que al compilar
+        for c in df.columns:
+            if pd.api.types.is_string_dtype(df[c]):
+                df[c] = df[c].astype(object).where(df[c].notna(), float("nan"))
+        df.columns = [float("nan") if c is None else c for c in info["columnas"]]
+        hojas[info["nombre"]] = df
+        unidades[info["nombre"]] = {int(j): u for j, u in info["unidades"].items()}
+
+    markdown = {nombre_hoja: {"encabezado": [], "filas": []} for nombre_hoja in hojas}
+    for nombre_hoja, grupo in pd.read_parquet(os.path.join(ruta, "markdown.parquet")).groupby("hoja", sort=False):
+        grupo = grupo.sort_values("fila")
+        markdown[nombre_hoja] = {
+            "encabezado": grupo.loc[grupo["fila"] < 0, "texto"].tolist(),
+            "filas": grupo.loc[grupo["fila"] >= 0, "texto"].tolist(),
+        }
+    return hojas, unidades, markdown
+
+@instrumentar(categoria="base")
+def cargar_base_compilada(ruta_excel="datos/00 - Base datos DIGITAEC v2.xlsx", carpeta_cache=CARPETA_BASE_COMPILADA):
+    """
+    Carga la base de sostenibilidad limpia, tipada e indexada.
+    La primera vez compila el Excel a una instantánea en Parquet (hojas + Markdown por fila) identificada
+    por el hash del archivo; después se lee de la instantánea, y dentro del mismo proceso se reutiliza
+    en memoria mientras no cambien la fecha de modificación ni el tamaño del Excel.
+    Devuelve {"hojas", "indice", "unidades"} o {"error": mensaje}. Las hojas se comparten: no modificarlas.
+    """
+    if not os.path.exists(ruta_excel):
+        return {"error": f"No se encontró el archivo: {ruta_excel}"}
+
+    estado = os.stat(ruta_excel)
+    clave_proceso = (os.path.abspath(ruta_excel), estado.st_mtime_ns, estado.st_size)
+    with _cerrojo_bases:
+        if clave_proceso in _bases_compiladas:
+            return _bases_compiladas[clave_proceso]
+
+        ruta = _ruta_base_compilada(hash_contenido(ruta_excel), carpeta_cache)
+        base = None
+        if os.path.isdir(ruta):
+            try:
+                hojas, unidades, markdown = _leer_base_compilada(ruta)
+                base = {"hojas": hojas, "unidades": unidades, "indice": indexar_hojas_para_ia(hojas, markdown=markdown)}
+            except Exception as e:
+                logger.warning("⚠️ Base compilada ilegible, se vuelve a compilar (%s): %s", ruta, e)
+                shutil.rmtree(ruta, ignore_errors=True)
+
+        if base is None:
+            hojas_crudas = cargar_todas_las_hojas(ruta_excel)
+            if "error" in hojas_crudas:
+                return hojas_crudas
+            hojas, unidades = {}, {}
+            for nombre_hoja, df in hojas_crudas.items():
+                hojas[nombre_hoja], unidades[nombre_hoja] = limpiar_hoja(df)
+            markdown = markdown_por_fila(hojas)
+            try:
+                os.makedirs(carpeta_cache, exist_ok=True)
+                _guardar_base_compilada(ruta, hojas, unidades, markdown)
+            except Exception as e:
+                logger.warning("⚠️ No se pudo guardar la base compilada: %s", e)
+            base = {"hojas": hojas, "unidades": unidades, "indice": indexar_hojas_para_ia(hojas, markdown=markdown)}
+
+        # Solo se conserva la versión actual de cada Excel
+        for clave in [c for c in _bases_compiladas if c[0] == clave_proceso[0]]:
+            del _bases_compiladas[clave]
+        _bases_compiladas[clave_proceso] = base
+        return base
@@ -1,8 +1,11 @@
-
 import re
-import ifcopenshell
 import pandas as pd
 import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from funciones.cache_modelos import abrir_ifc
+from funciones.utils.instrumentacion import instrumentar
 
 def es_valor_valido(valor):
     if not valor:
@@ -10,85 +13,237 @@ def es_valor_valido(valor):
     valor_str = str(valor).strip().lower()
     return valor_str not in ["n/a", "na", "none", "empty", "-", "sin definir", ""]
 
-def procesar_ifc(ruta_ifc, carpeta_salida="resultados", update_progress=None):
+def _valor_nominal(valor):
+    if hasattr(valor, "wrappedValue"):
+        return valor.wrappedValue
+    return valor
+
+def _propiedades_de_pset(prop_def):
+    props = []
+    for prop in prop_def.HasProperties:
+        value = _valor_nominal(getattr(prop, "NominalValue", None))
+        props.append((prop_def.Name, prop.Name, value))
+    return props
+
+def _cantidades_de_qto(qto):
+    quantities = []
+    for q in qto.Quantities:
+        val = getattr(q, "VolumeValue", getattr(q, "AreaValue", getattr(q, "LengthValue", None)))
+        val = _valor_nominal(val)
+        if val is not None:
+            quantities.append((qto.Name, q.Name, val))
+    return quantities
+
+def _materiales_de_relacion(mat):
+    posibles = []
+    if hasattr(mat, "Name"):
+        posibles.append(mat.Name)
+    if hasattr(mat, "ForLayerSet"):
+        for layer in mat.ForLayerSet.MaterialLayers:
+            if hasattr(layer.Material, "Name"):
+                posibles.append(layer.Material.Name)
+    return [nombre.strip() for nombre in posibles if es_valor_valido(nombre)]
+
+@instrumentar(categoria="ifc")
+def indexar_relaciones(model):
+    """
+    Recorre una sola vez cada tipo de relación del modelo y construye índices
+    id de producto → propiedades, materiales y cantidades.
+    Cada relación se resuelve una única vez y se reparte entre sus RelatedObjects.
+    Propiedades y cantidades se guardan como tuplas (pset, propiedad, valor).
+    """
+    psets = {}
+    materiales = {}
+    cantidades = {}
+
+    for rel in model.by_type("IfcRelDefinesByProperties"):
+        if not rel.RelatedObjects:
+            continue
+        prop_def = rel.RelatingPropertyDefinition
+        if prop_def.is_a("IfcPropertySet"):
+            destino, valores = psets, _propiedades_de_pset(prop_def)
+        elif model.schema == "IFC4" and prop_def.is_a("IfcElementQuantity"):
+            # En IFC4 las cantidades llegan como IfcElementQuantity vía IfcRelDefinesByProperties
+            destino, valores = cantidades, _cantidades_de_qto(prop_def)
+        else:
+            continue
+        for obj in rel.RelatedObjects:
+            destino.setdefault(obj.id(), []).extend(valores)
+
+    for rel in model.by_type("IfcRelAssociatesMaterial"):
+        if not rel.RelatedObjects:
+            continue
+        nombres = _materiales_de_relacion(rel.RelatingMaterial)
+        for obj in rel.RelatedObjects:
+            materiales.setdefault(obj.id(), []).extend(nombres)
+
+    return {"psets": psets, "materiales": materiales, "cantidades": cantidades}
+
+# Atributos declarados en el esquema por clase IFC ("IFC4.IfcWall" → [(posición, nombre), ...])
+_atributos_por_clase = {}
+
+def _atributos_de_clase(element):
+    clase = element.is_a(True)
+    atributos = _atributos_por_clase.get(clase)
+    if atributos is None:
+        esquema, entidad = clase.split(".")
+        from ifcopenshell import ifcopenshell_wrapper
+        declaracion = ifcopenshell_wrapper.schema_by_name(esquema).declaration_by_name(entidad)
+        atributos = [(i, attr.name()) for i, attr in enumerate(declaracion.as_entity().all_attributes())]
+        _atributos_por_clase[clase] = atributos
+    return atributos
+
+def atributos_simples(element):
+    """
+    Devuelve ID, Nombre y los atributos escalares (str, int, float, bool) del producto.
+    Solo se leen los atributos directos que declara el esquema para su clase (sin inversos),
+    accediendo por posición; la lista se calcula una vez por clase.
+    """
+    element_data = {
+        "ID": element.GlobalId,
+        "Nombre": getattr(element, "Name", "N/A"),
+    }
+    for i, attr in _atributos_de_clase(element):
+        val = element[i]
+        if isinstance(val, (str, int, float, bool)):
+            element_data[attr] = val
+    return element_data
+
+def texto_materiales(element, indice):
+    # Orden de aparición, igual en modo secuencial y paralelo
+    materiales = dict.fromkeys(indice["materiales"].get(element.id(), ()))
+    return ", ".join(materiales) if materiales else "N/A"
+
+def extraer_elemento(element, indice):
+    """
+    Construye el diccionario de datos de un producto IFC a partir del índice de relaciones.
+    """
+    # Atributos simples
+    element_data = atributos_simples(element)
+
+    # Propiedades Pset
+    props = {f"{pset}_{prop}": valor for pset, prop, valor in indice["psets"].get(element.id(), ())}
+
+    # Cantidades (IFC4)
+    quantities = {nombre: valor for _, nombre, valor in indice["cantidades"].get(element.id(), ())}
+
+    return {
+        **element_data,
+        **props,
+        "Material_IFC": texto_materiales(element, indice),
+        **quantities
+    }
+
+# Modelo e índice abiertos por cada proceso trabajador (uno por proceso)
+_modelo_worker = {}
+
+def _extraer_rango(ruta_ifc, inicio, fin):
+    """
+    Extrae las filas de los productos [inicio, fin) en un proceso trabajador.
+    El modelo y el índice se abren una sola vez por proceso y se reutilizan entre fragmentos.
+    """
+    if _modelo_worker.get("ruta") != ruta_ifc:
+        import ifcopenshell
+        model = ifcopenshell.open(ruta_ifc)
+        _modelo_worker.update(ruta=ruta_ifc, model=model, indice=indexar_relaciones(model))
+
+    model = _modelo_worker["model"]
+    indice = _modelo_worker["indice"]
+    productos = model.by_type("IfcProduct")
+    return inicio, [extraer_elemento(element, indice) for element in productos[inicio:fin]]
+
+def _contexto_procesos():
+    # fork desde un servidor con hilos (Streamlit, trabajos en segundo plano) puede copiar cerrojos tomados
+    # y la caché de modelos abiertos: los trabajadores arrancan limpios con forkserver (o spawn fuera de Unix)
+    metodos = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context("forkserver" if "forkserver" in metodos else "spawn")
+
+@instrumentar(categoria="extraccion")
+def _extraer_en_paralelo(ruta_ifc, total, n_procesos, update_progress=None):
+    # Más fragmentos que procesos para repartir carga y dar progreso fluido
+    n_fragmentos = min(total, n_procesos * 4)
+    tam = -(-total // n_fragmentos)
+    rangos = [(i, min(i + tam, total)) for i in range(0, total, tam)]
+
+    resultados = {}
+    procesados = 0
+    with ProcessPoolExecutor(max_workers=n_procesos, mp_context=_contexto_procesos()) as pool:
+        futuros = [pool.submit(_extraer_rango, ruta_ifc, inicio, fin) for inicio, fin in rangos]
+        try:
+            for futuro in as_completed(futuros):
+                inicio, filas = futuro.result()
+                resultados[inicio] = filas
+                procesados += len(filas)
+                if update_progress:
+                    update_progress(procesados / total)
+        except BaseException:
+            # Error o cancelación desde update_progress: no se empiezan los fragmentos pendientes
+            for futuro in futuros:
+                futuro.cancel()
+            raise
+
+    # Unir en el orden original de model.by_type("IfcProduct")
+    data = []
+    for inicio, _ in rangos:
+        data.extend(resultados[inicio])
+    return data
+
+@instrumentar(categoria="extraccion")
+def procesar_ifc(ruta_ifc, carpeta_salida="resultados", update_progress=None, n_procesos=1):
+    """
+    Extrae atributos, psets, materiales y cantidades de cada IfcProduct y guarda un CSV.
+    Con n_procesos > 1 los productos se reparten en fragmentos entre un pool de procesos,
+    cada uno con su propia copia abierta del IFC, y las filas se unen en el orden original.
+    """
     if not os.path.isfile(ruta_ifc):
         raise FileNotFoundError(f"Archivo IFC no encontrado: {ruta_ifc}")
 
     os.makedirs(carpeta_salida, exist_ok=True)
-    model = ifcopenshell.open(ruta_ifc)
+    model = abrir_ifc(ruta_ifc)
     ifc_filename = os.path.splitext(os.path.basename(ruta_ifc))[0]
 
-    data = []
     productos = model.by_type("IfcProduct")
     total = len(productos)
 
-    for idx, element in enumerate(productos):
-        if update_progress:
-            update_progress(idx / total)
+    if n_procesos and n_procesos > 1 and total > 1:
+        data = _extraer_en_paralelo(ruta_ifc, total, n_procesos, update_progress)
+    else:
+        indice = indexar_relaciones(model)
+        data = []
+        for idx, element in enumerate(productos):
+            if update_progress:
+                update_progress(idx / total)
 
-        element_data = {
-            "ID": element.GlobalId,
-            "Nombre": getattr(element, "Name", "N/A"),
-        }
-
-        # Propiedades Pset
-        props = {}
-        for rel in model.by_type("IfcRelDefinesByProperties"):
-            if rel.RelatedObjects and element in rel.RelatedObjects:
-                prop_def = rel.RelatingPropertyDefinition
-                if prop_def.is_a("IfcPropertySet"):
-                    for prop in prop_def.HasProperties:
-                        value = getattr(prop, "NominalValue", None)
-                        if hasattr(value, "wrappedValue"):
-                            value = value.wrappedValue
-                        props[f"{prop_def.Name}_{prop.Name}"] = value
-
-        # Materiales
-        materiales = set()
-        for rel in model.by_type("IfcRelAssociatesMaterial"):
-            if rel.RelatedObjects and element in rel.RelatedObjects:
-                mat = rel.RelatingMaterial
-                posibles = []
-                if hasattr(mat, "Name"):
-                    posibles.append(mat.Name)
-                if hasattr(mat, "ForLayerSet"):
-                    for layer in mat.ForLayerSet.MaterialLayers:
-                        if hasattr(layer.Material, "Name"):
-                            posibles.append(layer.Material.Name)
-                for nombre in posibles:
-                    if es_valor_valido(nombre):
-                        materiales.add(nombre.strip())
-
-        # Atributos simples
-        for attr in dir(element):
-            if not attr.startswith("_") and not callable(getattr(element, attr, None)):
-                val = getattr(element, attr)
-                if isinstance(val, (str, int, float, bool)):
-                    element_data[attr] = val
-
-        # Cantidades (IFC4)
-        quantities = {}
-        if model.schema == "IFC4":
-            for rel in model.by_type("IfcRelDefinesByQuantity"):
-                if rel.RelatedObjects and element in rel.RelatedObjects:
-                    for q in rel.RelatingQuantity.Quantities:
-                        val = getattr(q, "VolumeValue", getattr(q, "AreaValue", getattr(q, "LengthValue", None)))
-                        if hasattr(val, "wrappedValue"):
-                            val = val.wrappedValue
-                        if val is not None:
-                            quantities[q.Name] = val
-
-        final_data = {
-            **element_data,
-            **props,
-            "Material_IFC": ", ".join(materiales) if materiales else "N/A",
-            **quantities
-        }
-
-        data.append(final_data)
+            data.append(extraer_elemento(element, indice))
 
     df = pd.DataFrame(data)
     output_path = os.path.join(carpeta_salida, f"{ifc_filename}.csv")
     df.to_csv(output_path, index=False)
 
     return df
+
+def iterar_lotes_ifc(ruta_ifc, tam_lote=5000, update_progress=None):
+    """
+    Generador que devuelve las filas de procesar_ifc en listas de como máximo tam_lote
+    elementos, sin acumular el modelo completo en un DataFrame.
+    """
+    if not os.path.isfile(ruta_ifc):
+        raise FileNotFoundError(f"Archivo IFC no encontrado: {ruta_ifc}")
+
+    model = abrir_ifc(ruta_ifc)
+    indice = indexar_relaciones(model)
+    productos = model.by_type("IfcProduct")
+    total = len(productos)
+
+    lote = []
+    for idx, element in enumerate(productos):
+        if update_progress:
+            update_progress(idx / total)
+
+        lote.append(extraer_elemento(element, indice))
+        if len(lote) >= tam_lote:
+            yield lote
+            lote = []
+
+    if lote:
+        yield lote
@@ -0,0 +1,143 @@
+import os
+import shutil
+import pandas as pd
+
+from funciones.procesar_ifc_con_progreso import iterar_lotes_ifc
+from funciones.cache_extraccion import escribir_parquet, columnas_codificadas, restaurar_tipos
+
+def _actualizar_columnas(lote, columnas, vistas):
+    # Las columnas nuevas se añaden al final, en orden de primera aparición (igual que pd.DataFrame(data))
+    for fila in lote:
+        for col in fila:
+            if col not in vistas:
+                vistas.add(col)
+                columnas.append(col)
+
+def _escribir_csv(lotes, ruta_salida):
+    """
+    Escribe cada lote con todas las columnas conocidas hasta ese momento.
+    Las filas antiguas quedan con menos campos al final; pandas los lee como NaN.
+    La cabecera definitiva se escribe al terminar, copiando el cuerpo por bloques.
+    """
+    columnas, vistas = [], set()
+    ruta_cuerpo = f"{ruta_salida}.cuerpo.tmp"
+
+    with open(ruta_cuerpo, "w", encoding="utf-8", newline="") as f:
+        for lote in lotes:
+            _actualizar_columnas(lote, columnas, vistas)
+            pd.DataFrame(lote, columns=columnas).to_csv(f, header=False, index=False)
+
+    with open(ruta_salida, "w", encoding="utf-8", newline="") as salida:
+        pd.DataFrame(columns=columnas).to_csv(salida, index=False)
+        with open(ruta_cuerpo, "r", encoding="utf-8", newline="") as cuerpo:
+            shutil.copyfileobj(cuerpo, salida)
+    os.remove(ruta_cuerpo)
+
+    return columnas
+
+def _escribir_parquet(lotes, ruta_salida):
+    """
+    Escribe cada lote como un fichero Parquet dentro de la carpeta ruta_salida.
+    Cada parte lleva su propio esquema, así las columnas nuevas no obligan a reescribir las anteriores.
+    """
+    if os.path.isdir(ruta_salida):
+        shutil.rmtree(ruta_salida)
+    os.makedirs(ruta_salida)
+
+    columnas, vistas = [], set()
+    for n, lote in enumerate(lotes):
+        _actualizar_columnas(lote, columnas, vistas)
+        escribir_parquet(pd.DataFrame(lote), os.path.join(ruta_salida, f"parte-{n:05d}.parquet"))
+
+    return columnas
+
+def procesar_ifc_streaming(ruta_ifc, carpeta_salida="resultados", formato="parquet", tam_lote=5000, update_progress=None):
+    """
+    Variante de procesar_ifc para modelos grandes: extrae por lotes y va escribiendo
+    cada lote en disco, de modo que la memoria depende de tam_lote y no del tamaño del modelo.
+    formato: "parquet" (carpeta con una parte por lote) o "csv".
+    Devuelve la ruta de salida; leer_salida_streaming la carga de nuevo como DataFrame.
+    """
+    if formato not in ("parquet", "csv"):
+        raise ValueError(f"Formato no soportado: {formato}. Usa 'parquet' o 'csv'.")
+
+    os.makedirs(carpeta_salida, exist_ok=True)
+    ifc_filename = os.path.splitext(os.path.basename(ruta_ifc))[0]
+    ruta_salida = os.path.join(carpeta_salida, f"{ifc_filename}.{formato}")
+
+    lotes = iterar_lotes_ifc(ruta_ifc, tam_lote=tam_lote, update_progress=update_progress)
+    if formato == "csv":
+        _escribir_csv(lotes, ruta_salida)
+    else:
+        _escribir_parquet(lotes, ruta_salida)
+
+    if update_progress:
+        update_progress(1.0)
+
+    return ruta_salida
+
+def leer_salida_streaming(ruta_salida, columnas=None):
+    """
+    Carga la salida de procesar_ifc_streaming como DataFrame.
+    Con columnas se leen solo esas columnas (en Parquet sin tocar el resto del fichero).
+    """
+    if os.path.isfile(ruta_salida):
+        return pd.read_csv(ruta_salida, usecols=columnas)
+
+    if not os.path.isdir(ruta_salida):
+        raise FileNotFoundError(f"Salida no encontrada: {ruta_salida}")
+
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    partes = sorted(os.path.join(ruta_salida, p) for p in os.listdir(ruta_salida) if p.endswith(".parquet"))
+    tablas = []
+    codificadas = []
+    orden = []
+    for parte in partes:
+        disponibles = pq.read_schema(parte).names
+        leer = [c for c in columnas if c in disponibles] if columnas is not None else disponibles
+        tablas.append(pq.read_table(parte, columns=leer))
+        codificadas.append([c for c in columnas_codificadas(parte) if c in leer])
+        orden.extend(c for c in leer if c not in orden)
+
+    if not tablas:
+        return pd.DataFrame(columns=columnas or [])
+
+    # Una columna puede tener otro tipo en otro lote. Entera en uno y decimal en otro se unifica como
+    # float64 en Arrow; si mezcla números y texto (u otros tipos) se deja como object con cada valor
+    # en su tipo, igual que en el DataFrame de procesar_ifc
+    tipos = {}
+    for tabla in tablas:
+        for campo in tabla.schema:
+            if not pa.types.is_null(campo.type):
+                tipos.setdefault(campo.name, set()).add(campo.type)
+    conflictivas = {col for col, t in tipos.items() if len(t) > 1}
+    numericas = {
+        col for col in conflictivas
+        if all(pa.types.is_integer(x) or pa.types.is_floating(x) for x in tipos[col])
+    }
+    mezcladas = conflictivas - numericas
+
+    if numericas:
+        unificadas = []
+        for tabla in tablas:
+            for col in numericas & set(tabla.column_names):
+                i = tabla.column_names.index(col)
+                tabla = tabla.set_column(i, col, tabla.column(col).cast(pa.float64()))
+            unificadas.append(tabla)
+        tablas = unificadas
+
+    # Columnas de tipos mezclados (guardadas como JSON dentro de un lote o con tipos distintos entre
+    # lotes): se restauran lote a lote y se unen en pandas como object
+    if mezcladas or any(codificadas):
+        dfs = []
+        for tabla, cod in zip(tablas, codificadas):
+            df_parte = restaurar_tipos(tabla.to_pandas(), cod)
+            for col in mezcladas & set(df_parte.columns):
+                df_parte[col] = df_parte[col].astype(object)
+            dfs.append(df_parte)
+        return pd.concat(dfs, ignore_index=True)[orden]
+
+    df = pa.concat_tables(tablas, promote_options="default").to_pandas()
+    return df[orden]
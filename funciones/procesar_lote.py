@@ -0,0 +1,208 @@
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+from funciones.agregar_huella_ifc import agregar_huella_ifc
+from funciones.analizar_materiales import claves_material, claves_volumen, encontrar_columna
+from funciones.cache_extraccion import hash_contenido
+from funciones.cargar_base import cargar_base_compilada
+from funciones.procesar_ifc_con_progreso import procesar_ifc
+from funciones.utils import instrumentacion
+from funciones.utils.calcular_huella import ETAPAS_CICLO_VIDA, calcular_huella_carbono, calcular_huella_por_elemento
+from funciones.utils.normalizar_materiales_ifc import normalizar_materiales_con_ia
+from postprocesar_huella import postprocesar_huella
+
+# Cálculo de huella por lotes, sin Streamlit: procesar_ifc → normalización → huella → postproceso → exportación IFC
+
+RUTA_BASE_DATOS = "datos/00 - Base datos DIGITAEC v2.xlsx"
+ARCHIVO_ESTADO = "estado_lote.json"
+ARCHIVO_RESUMEN = "resumen_lote.csv"
+
+def _columnas_calculo(df_ifc, col_material=None, col_cantidad=None):
+    # Sin IA para detectar columnas: Material_IFC y la primera columna con volumen/cantidad
+    if col_material is None:
+        col_material = "Material_IFC" if "Material_IFC" in df_ifc.columns else encontrar_columna(df_ifc.columns, claves_material)
+    if col_cantidad is None:
+        col_cantidad = encontrar_columna(df_ifc.columns, claves_volumen)
+    faltan = [nombre for nombre, col in (("material", col_material), ("cantidad", col_cantidad)) if col not in df_ifc.columns]
+    if faltan:
+        raise ValueError(f"❌ No se encontró la columna de {' ni de '.join(faltan)} en el IFC")
+    return col_material, col_cantidad
+
+def preparar_tabla_calculo(df_ifc, col_material=None, col_cantidad=None):
+    """
+    Tabla [ID, Material, Cantidad] de los elementos con material, a partir de la extracción de procesar_ifc.
+    """
+    col_material, col_cantidad = _columnas_calculo(df_ifc, col_material, col_cantidad)
+    df = pd.DataFrame({
+        "ID": df_ifc["ID"].astype(str).str.strip(),
+        "Material": df_ifc[col_material],
+        "Cantidad": pd.to_numeric(df_ifc[col_cantidad], errors="coerce"),
+    })
+    return df[df["Material"].notna() & (df["Material"] != "N/A")].reset_index(drop=True)
+
+def procesar_archivo_ifc(ruta_ifc, carpeta_salida, etapas=ETAPAS_CICLO_VIDA, distancia_km=None, usar_ia=False,
+                         col_material=None, col_cantidad=None, exportar_ifc=True, ruta_base=RUTA_BASE_DATOS):
+    """
+    Calcula la huella de un IFC de principio a fin y guarda en carpeta_salida el CSV de extracción,
+    la huella por elemento, el resumen por material y (si exportar_ifc) el IFC con el pset ImpactoAmbiental.
+    Devuelve un diccionario con el resumen del cálculo.
+    """
+    inicio = time.perf_counter()
+    base = cargar_base_compilada(ruta_base)
+    if "error" in base:
+        raise ValueError(base["error"])
+    hojas = base["hojas"]
+
+    os.makedirs(carpeta_salida, exist_ok=True)
+    df_ifc = procesar_ifc(ruta_ifc, carpeta_salida=carpeta_salida)
+    df = preparar_tabla_calculo(df_ifc, col_material, col_cantidad)
+    df = normalizar_materiales_con_ia(df, hojas, usar_ia=usar_ia)
+
+    df_calculo = df.copy()
+    normalizado = df_calculo["Material_Normalizado"]
+    df_calculo["Material"] = normalizado.where(normalizado != "NO ENCONTRADO", df_calculo["Material"])
+
+    df_huella = calcular_huella_por_elemento(df_calculo, hojas, etapas, distancia_km=distancia_km)
+    df_huella["Material"] = df["Material"]
+    df_huella.insert(df_huella.columns.get_loc("Material") + 1, "Material_Base", df_calculo["Material"])
+    df_huella["Unidad"] = "kg CO₂ eq"
+    resumen = calcular_huella_carbono(df_calculo, hojas, etapas, distancia_km=distancia_km)
+
+    nombre = os.path.splitext(os.path.basename(ruta_ifc))[0]
+    df_huella.to_csv(os.path.join(carpeta_salida, f"{nombre}_huella_por_elemento.csv"), index=False)
+    resumen.to_csv(os.path.join(carpeta_salida, f"{nombre}_resumen_materiales.csv"), index=False)
+
+    ruta_exportado = None
+    if exportar_ifc:
+        df_resultado = postprocesar_huella(df_huella[["ID", "Total", "Unidad"]].copy(), df_ifc["ID"].astype(str).str.strip().tolist())
+        ruta_exportado = agregar_huella_ifc(ruta_ifc, df_resultado, nombre_salida=f"{nombre}_ImpactoAmbiental.ifc", carpeta_salida=carpeta_salida)
+
+    return {
+        "elementos": int(len(df_ifc)),
+        "elementos_con_material": int(len(df)),
+        "materiales": int(df["Material"].nunique()),
+        "materiales_no_encontrados": int(df.loc[df["Material_Normalizado"] == "NO ENCONTRADO", "Material"].nunique()),
+        "huella_total": float(df_huella["Total"].sum()),
+        "ifc_exportado": ruta_exportado,
+        "segundos": round(time.perf_counter() - inicio, 2),
+    }
+
+def _procesar_en_trabajador(ruta_ifc, carpeta_salida, opciones):
+    # Los errores se devuelven como resultado para que un archivo no detenga el lote.
+    # Los tiempos del trabajador vuelven con el resultado para unirlos al registro del proceso principal.
+    instrumentacion.reiniciar()
+    try:
+        with instrumentacion.medir("procesar_archivo_ifc", categoria="lote", archivo=os.path.basename(ruta_ifc)):
+            resultado = {"estado": "completado", **procesar_archivo_ifc(ruta_ifc, carpeta_salida, **opciones)}
+    except Exception as e:
+        resultado = {"estado": "error", "error": f"{type(e).__name__}: {e}"}
+    return resultado, instrumentacion.exportar_json()
+
+def _leer_estado(ruta_estado):
+    if not os.path.isfile(ruta_estado):
+        return {"archivos": {}}
+    try:
+        with open(ruta_estado, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"⚠️ Estado del lote ilegible, se empieza de cero ({ruta_estado}): {e}")
+        return {"archivos": {}}
+
+def _guardar_estado(ruta_estado, estado):
+    # Escritura atómica: un corte a mitad no deja el estado corrupto
+    temporal = f"{ruta_estado}.tmp"
+    with open(temporal, "w", encoding="utf-8") as f:
+        json.dump(estado, f, ensure_ascii=False, indent=2)
+    os.replace(temporal, ruta_estado)
+
+def _pendiente(ruta_ifc, anterior):
+    """
+    Devuelve (pendiente, firma). Un archivo ya completado se salta si no cambió: primero se compara
+    fecha y tamaño y, solo si difieren, el hash del contenido.
+    """
+    estado_archivo = os.stat(ruta_ifc)
+    firma = {"mtime_ns": estado_archivo.st_mtime_ns, "tamano": estado_archivo.st_size}
+    if not anterior or anterior.get("estado") != "completado":
+        return True, firma
+    if all(anterior.get(k) == v for k, v in firma.items()):
+        return False, {**firma, "hash": anterior.get("hash")}
+    firma["hash"] = hash_contenido(ruta_ifc)
+    return firma["hash"] != anterior.get("hash"), firma
+
+def procesar_directorio(directorio, carpeta_salida="resultados/lote", n_procesos=None, rehacer=False, **opciones):
+    """
+    Calcula la huella de todos los .ifc de directorio (incluidas subcarpetas) con un pool de procesos,
+    un archivo por tarea. El progreso se guarda en carpeta_salida/estado_lote.json tras cada archivo,
+    de modo que al relanzar solo se procesan los pendientes, los fallidos y los modificados
+    (rehacer=True procesa todos). Devuelve el resumen del lote como DataFrame y lo guarda en resumen_lote.csv.
+    opciones: argumentos de procesar_archivo_ifc (etapas, distancia_km, usar_ia, col_material...).
+    """
+    if not os.path.isdir(directorio):
+        raise FileNotFoundError(f"Directorio no encontrado: {directorio}")
+
+    os.makedirs(carpeta_salida, exist_ok=True)
+    ruta_estado = os.path.join(carpeta_salida, ARCHIVO_ESTADO)
+    estado = {"archivos": {}} if rehacer else _leer_estado(ruta_estado)
+    # Con otras etapas, distancia, base... los resultados guardados ya no sirven
+    opciones_lote = json.loads(json.dumps(opciones))
+    if estado.get("opciones", opciones_lote) != opciones_lote:
+        print("⚠️ Las opciones del lote cambiaron: se recalculan todos los archivos")
+        estado["archivos"] = {}
+    estado["opciones"] = opciones_lote
+
+    rutas = sorted(
+        os.path.join(raiz, nombre)
+        for raiz, _, nombres in os.walk(directorio)
+        for nombre in nombres if nombre.lower().endswith(".ifc")
+    )
+
+    tareas = {}
+    for ruta in rutas:
+        relativa = os.path.relpath(ruta, directorio)
+        pendiente, firma = _pendiente(ruta, estado["archivos"].get(relativa))
+        if pendiente:
+            tareas[relativa] = (ruta, firma)
+        else:
+            estado["archivos"][relativa].update(firma)
+
+    print(f"📂 {len(rutas)} IFC encontrados, {len(rutas) - len(tareas)} ya calculados, {len(tareas)} pendientes")
+
+    inicio = time.perf_counter()
+    if tareas:
+        n_procesos = max(1, min(n_procesos or os.cpu_count() or 1, len(tareas)))
+        with ProcessPoolExecutor(max_workers=n_procesos) as pool:
+            futuros = {
+                pool.submit(
+                    _procesar_en_trabajador, ruta,
+                    os.path.join(carpeta_salida, os.path.splitext(relativa)[0]), opciones
+                ): relativa
+                for relativa, (ruta, _) in tareas.items()
+            }
+            for n, futuro in enumerate(as_completed(futuros), start=1):
+                relativa = futuros[futuro]
+                firma = tareas[relativa][1]
+                if "hash" not in firma:
+                    firma["hash"] = hash_contenido(tareas[relativa][0])
+                resultado, registro = futuro.result()
+                instrumentacion.incorporar(registro)
+                estado["archivos"][relativa] = {**firma, **resultado}
+                _guardar_estado(ruta_estado, estado)
+                resultado = estado["archivos"][relativa]
+                detalle = f"{resultado['huella_total']:.2f} kg CO₂ eq" if resultado["estado"] == "completado" else resultado["error"]
+                print(f"[{n}/{len(tareas)}] {relativa}: {resultado['estado']} ({detalle})")
+
+    duracion = time.perf_counter() - inicio
+    _guardar_estado(ruta_estado, estado)
+
+    resumen = pd.DataFrame([{"archivo": relativa, **datos} for relativa, datos in sorted(estado["archivos"].items())])
+    resumen.to_csv(os.path.join(carpeta_salida, ARCHIVO_RESUMEN), index=False)
+
+    if tareas:
+        completados = sum(estado["archivos"][r]["estado"] == "completado" for r in tareas)
+        por_hora = len(tareas) / duracion * 3600 if duracion > 0 else float("inf")
+        print(f"✅ {completados}/{len(tareas)} archivos calculados en {duracion:.1f} s ({por_hora:.0f} archivos/hora)")
+    return resumen
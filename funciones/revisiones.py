@@ -0,0 +1,317 @@
+import json
+import logging
+import os
+import re
+import sqlite3
+from contextlib import closing
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+from funciones.cache_extraccion import escribir_parquet, leer_parquet
+from funciones.utils.instrumentacion import instrumentar
+
+logger = logging.getLogger(__name__)
+
+# Revisiones sucesivas de un mismo proyecto: registro en SQLite y, por cada IFC (hash de contenido),
+# la tabla de elementos [ID, Material, Cantidad, Unidad, hash_elemento] y los totales de la IA en Parquet
+RUTA_REGISTRO_REVISIONES = os.path.join("cache", "revisiones.sqlite")
+CARPETA_REVISIONES = os.path.join("cache", "revisiones")
+
+ESTADOS_REVISION = ("nuevo", "modificado", "eliminado", "igual")
+
+# Sufijos de revisión habituales al final del nombre: "_R03", "-rev2", " v4", "_rev.B"
+_PATRON_SUFIJO_REVISION = re.compile(r"(^|[\s_\-\.]+)(r|rev|revision|v|ver|version)[\s_\-\.]*([0-9]{1,3}|[a-z])$", re.IGNORECASE)
+
+def nombre_proyecto(nombre_archivo):
+    """
+    Nombre de proyecto a partir del nombre del IFC, sin extensión ni sufijo de revisión
+    ("Edificio_A_R03.ifc" → "Edificio_A"). Sirve de valor por defecto: el usuario puede cambiarlo.
+    """
+    base = os.path.splitext(os.path.basename(str(nombre_archivo)))[0].strip()
+    sin_sufijo = _PATRON_SUFIJO_REVISION.sub("", base)
+    return sin_sufijo or base
+
+def _hash_textos(textos):
+    return pd.util.hash_pandas_object(pd.Series(textos, dtype=object), index=False).to_numpy()
+
+def _numero_canonico(numero):
+    # 3, 3.0 y np.int64(3) se escriben igual: una columna entera que pasa a float64 porque a un
+    # elemento nuevo le falta la propiedad no cambia el hash de los demás
+    if isinstance(numero, (int, np.integer)):
+        return f"n:{int(numero)}"
+    numero = float(numero)
+    if numero.is_integer():
+        return f"n:{int(numero)}"
+    return f"n:{numero!r}"
+
+def _valor_canonico(valor):
+    if isinstance(valor, (bool, np.bool_)):
+        return "b:1" if valor else "b:0"
+    if isinstance(valor, (int, float, np.integer, np.floating)):
+        return _numero_canonico(valor)
+    # Otros objetos (tuplas de valores IFC) como texto, igual que en valor_texto de la tabla larga
+    return f"s:{valor}"
+
+def _textos_canonicos(serie):
+    """
+    Texto de cada valor no nulo de la serie, independiente del dtype que pandas eligió para la columna
+    entera: números como enteros si son enteros, booleanos y textos con su propia marca.
+    Devuelve (máscara de valores válidos, textos).
+    """
+    valida = serie.notna().to_numpy()
+    valores = serie[valida]
+    if pd.api.types.is_bool_dtype(valores.dtype):
+        textos = np.where(valores.to_numpy(dtype=bool), "b:1", "b:0")
+    elif pd.api.types.is_numeric_dtype(valores.dtype):
+        textos = [_numero_canonico(v) for v in valores.to_numpy()]
+    else:
+        textos = [_valor_canonico(v) for v in valores.to_numpy(dtype=object)]
+    return valida, np.asarray(textos, dtype=object)
+
+def _combinar(acumulado, posiciones, columnas, textos):
+    # Cada valor se mezcla con el nombre de su columna y se suma: el resultado no depende del orden
+    # de las columnas ni de las columnas vacías que aparezcan o desaparezcan entre revisiones
+    mezcla = (_hash_textos(textos) ^ _hash_textos(columnas)) * np.uint64(0x9E3779B97F4A7C15)
+    np.add.at(acumulado, posiciones, mezcla)
+
+def _combinar_columna(acumulado, nombre, serie, posiciones):
+    valida, textos = _textos_canonicos(serie)
+    if valida.any():
+        _combinar(acumulado, posiciones[valida], np.full(len(textos), str(nombre), dtype=object), textos)
+
+@instrumentar(categoria="revisiones")
+def hash_elementos(datos):
+    """
+    Hash de contenido de cada elemento extraído (atributos, psets, materiales y cantidades),
+    en el orden de las filas de la extracción.
+    datos: DataFrame ancho de procesar_ifc o tabla larga {"elementos", "propiedades"} de extraer_tabla_larga.
+    Dos elementos con los mismos valores dan el mismo hash aunque cambie el orden de las columnas,
+    el dtype de la columna (3 en una columna entera o 3.0 en una float64) o el formato (ancho o largo).
+    """
+    with np.errstate(over="ignore"):
+        if isinstance(datos, dict):
+            elementos = datos["elementos"].reset_index(drop=True)
+            acumulado = np.zeros(len(elementos), dtype=np.uint64)
+            posiciones = np.arange(len(elementos))
+            for col in elementos.columns:
+                if col != "element_idx":
+                    _combinar_columna(acumulado, col, elementos[col], posiciones)
+
+            # Cada propiedad está en una sola de valor_texto, valor_num o valor_bool, con su tipo
+            propiedades = datos["propiedades"]
+            fila = pd.Series(elementos.index, index=elementos["element_idx"].to_numpy())
+            filas = fila.reindex(propiedades["element_idx"].to_numpy()).to_numpy()
+            columnas = propiedades["columna"].astype(str).to_numpy()
+            for col in ("valor_texto", "valor_num", "valor_bool"):
+                valida, textos = _textos_canonicos(propiedades[col])
+                if valida.any():
+                    _combinar(acumulado, filas[valida], columnas[valida].astype(object), textos)
+        else:
+            acumulado = np.zeros(len(datos), dtype=np.uint64)
+            posiciones = np.arange(len(datos))
+            for col in datos.columns:
+                _combinar_columna(acumulado, col, datos[col], posiciones)
+
+    return pd.Series([f"{h:016x}" for h in acumulado], name="hash_elemento")
+
+@instrumentar(categoria="revisiones")
+def comparar_revisiones(anterior, actual):
+    """
+    Compara dos tablas de elementos [ID, hash_elemento, ...] por GlobalId y hash de contenido.
+    Devuelve un DataFrame [ID, estado, Material_anterior, Material] con estado en
+    "nuevo", "modificado", "eliminado" o "igual", en el orden de la revisión actual
+    (los eliminados al final).
+    """
+    columnas = ["ID", "hash_elemento", "Material"]
+
+    def _preparar(df):
+        df = df[[c for c in columnas if c in df.columns]].copy()
+        df["ID"] = df["ID"].astype(str).str.strip()
+        df = df[~df["ID"].isin(["", "nan", "None"])]
+        return df.drop_duplicates(subset="ID")
+
+    union = _preparar(actual).merge(_preparar(anterior), on="ID", how="outer", sort=False,
+                                    suffixes=("", "_anterior"), indicator=True)
+    estado = np.select(
+        [union["_merge"] == "left_only", union["_merge"] == "right_only",
+         union["hash_elemento"] != union["hash_elemento_anterior"]],
+        ["nuevo", "eliminado", "modificado"],
+        default="igual",
+    )
+    comparacion = pd.DataFrame({
+        "ID": union["ID"].to_numpy(),
+        "estado": estado,
+        "Material_anterior": union.get("Material_anterior", pd.Series(None, index=union.index)).to_numpy(),
+        "Material": union.get("Material", pd.Series(None, index=union.index)).to_numpy(),
+    })
+    # Misma posición que en la revisión actual; los eliminados van al final
+    return pd.concat([comparacion[comparacion["estado"] != "eliminado"],
+                      comparacion[comparacion["estado"] == "eliminado"]], ignore_index=True)
+
+def resumen_cambios(comparacion):
+    """
+    Número de elementos por estado: {"nuevo": n, "modificado": n, "eliminado": n, "igual": n}.
+    """
+    conteo = comparacion["estado"].value_counts()
+    return {estado: int(conteo.get(estado, 0)) for estado in ESTADOS_REVISION}
+
+def _conectar(ruta):
+    carpeta = os.path.dirname(ruta)
+    if carpeta:
+        os.makedirs(carpeta, exist_ok=True)
+    con = sqlite3.connect(ruta, timeout=30)
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS revisiones (
+            proyecto TEXT NOT NULL,
+            hash_ifc TEXT NOT NULL,
+            archivo TEXT,
+            fecha TEXT NOT NULL,
+            columnas TEXT,
+            elementos INTEGER,
+            seleccion_ia TEXT,
+            PRIMARY KEY (proyecto, hash_ifc)
+        )
+    """)
+    return con
+
+def _ruta_elementos(hash_ifc, carpeta, parte="elementos"):
+    return os.path.join(carpeta, f"{hash_ifc}-{parte}.parquet")
+
+def _guardar_parquet(df, ruta):
+    os.makedirs(os.path.dirname(ruta), exist_ok=True)
+    escribir_parquet(df, ruta)
+
+def _leer_parquet(ruta):
+    if not os.path.isfile(ruta):
+        return None
+    try:
+        return leer_parquet(ruta)
+    except Exception as e:
+        logger.warning("⚠️ Tabla de revisión ilegible, se ignora (%s): %s", ruta, e)
+        return None
+
+@instrumentar(categoria="revisiones")
+def guardar_revision(proyecto, hash_ifc, archivo, elementos, columnas=None,
+                     ruta=RUTA_REGISTRO_REVISIONES, carpeta=CARPETA_REVISIONES):
+    """
+    Registra (o actualiza) una revisión del proyecto con su tabla de elementos
+    [ID, Material, Cantidad, Unidad, hash_elemento] y las columnas clave detectadas en el IFC
+    ({"material_col", "cantidad_col", "unidad_col", "guid_col"}).
+    """
+    _guardar_parquet(elementos, _ruta_elementos(hash_ifc, carpeta))
+    with closing(_conectar(ruta)) as con, con:
+        con.execute("""
+            INSERT INTO revisiones (proyecto, hash_ifc, archivo, fecha, columnas, elementos)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT (proyecto, hash_ifc) DO UPDATE SET
+                archivo = excluded.archivo, fecha = excluded.fecha,
+                columnas = excluded.columnas, elementos = excluded.elementos
+        """, (proyecto, hash_ifc, archivo, datetime.now(timezone.utc).isoformat(),
+              json.dumps(columnas or {}), len(elementos)))
+
+def guardar_totales_ia(proyecto, hash_ifc, totales, seleccion,
+                       ruta=RUTA_REGISTRO_REVISIONES, carpeta=CARPETA_REVISIONES):
+    """
+    Guarda los totales por elemento [ID, Total, Unidad] calculados con la IA para una revisión,
+    junto con la selección con la que se calcularon ({"etapas": [...], "distancia_km": ...}).
+    """
+    _guardar_parquet(totales[[c for c in ("ID", "Total", "Unidad") if c in totales.columns]],
+                     _ruta_elementos(hash_ifc, carpeta, "totales_ia"))
+    with closing(_conectar(ruta)) as con, con:
+        con.execute("UPDATE revisiones SET seleccion_ia = ? WHERE proyecto = ? AND hash_ifc = ?",
+                    (json.dumps(seleccion), proyecto, hash_ifc))
+
+def listar_revisiones(proyecto, ruta=RUTA_REGISTRO_REVISIONES):
+    """
+    Revisiones registradas del proyecto, de la más reciente a la más antigua.
+    """
+    if not os.path.isfile(ruta):
+        return []
+    with closing(_conectar(ruta)) as con:
+        filas = con.execute(
+            "SELECT hash_ifc, archivo, fecha, columnas, elementos, seleccion_ia FROM revisiones "
+            "WHERE proyecto = ? ORDER BY fecha DESC", (proyecto,)
+        ).fetchall()
+    return [
+        {"hash_ifc": h, "archivo": archivo, "fecha": fecha, "columnas": json.loads(columnas or "{}"),
+         "n_elementos": n, "seleccion_ia": json.loads(seleccion) if seleccion else None}
+        for h, archivo, fecha, columnas, n, seleccion in filas
+    ]
+
+@instrumentar(categoria="revisiones")
+def revision_anterior(proyecto, hash_ifc, ruta=RUTA_REGISTRO_REVISIONES, carpeta=CARPETA_REVISIONES):
+    """
+    Última revisión registrada del proyecto distinta de hash_ifc, con su tabla de elementos
+    (clave "elementos") y, si se calcularon, sus totales de la IA (clave "totales_ia").
+    Devuelve None si no hay ninguna o si su tabla de elementos ya no está en disco.
+    """
+    for revision in listar_revisiones(proyecto, ruta):
+        if revision["hash_ifc"] == hash_ifc:
+            continue
+        elementos = _leer_parquet(_ruta_elementos(revision["hash_ifc"], carpeta))
+        if elementos is None:
+            continue
+        revision["elementos"] = elementos
+        revision["totales_ia"] = _leer_parquet(_ruta_elementos(revision["hash_ifc"], carpeta, "totales_ia"))
+        return revision
+    return None
+
+def totales_reutilizables(anterior, comparacion, seleccion):
+    """
+    Totales de la IA de la revisión anterior que siguen siendo válidos: elementos sin cambios,
+    calculados con la misma selección de etapas y distancia. DataFrame [ID, Total, Unidad] (vacío si no hay).
+    """
+    totales = anterior.get("totales_ia") if anterior else None
+    if totales is None or anterior.get("seleccion_ia") != seleccion:
+        return pd.DataFrame(columns=["ID", "Total", "Unidad"])
+    iguales = set(comparacion.loc[comparacion["estado"] == "igual", "ID"])
+    totales = totales.assign(ID=totales["ID"].astype(str).str.strip())
+    return totales[totales["ID"].isin(iguales)].reset_index(drop=True)
+
+def _totales_por_id(df):
+    df = df.assign(ID=df["ID"].astype(str).str.strip())
+    total = pd.to_numeric(df["Total"], errors="coerce").fillna(0.0)
+    return total.groupby(df["ID"], sort=False).sum()
+
+@instrumentar(categoria="revisiones")
+def delta_huella(comparacion, totales_anteriores, totales_actuales):
+    """
+    Diferencia de huella entre revisiones a partir de los totales por elemento [ID, Total] de cada una.
+    Devuelve un diccionario con:
+      "total_anterior", "total_actual", "delta" (kg CO₂ eq);
+      "por_estado": elementos y huella por estado de la comparación;
+      "por_material": huella de cada revisión y diferencia por material;
+      "elementos": detalle de los elementos nuevos, eliminados, modificados o con huella distinta.
+    """
+    detalle = comparacion.copy()
+    detalle["Total_anterior"] = detalle["ID"].map(_totales_por_id(totales_anteriores)).fillna(0.0).to_numpy()
+    detalle["Total_actual"] = detalle["ID"].map(_totales_por_id(totales_actuales)).fillna(0.0).to_numpy()
+    detalle["Delta"] = detalle["Total_actual"] - detalle["Total_anterior"]
+
+    por_estado = (
+        detalle.groupby("estado", sort=False)
+        .agg(Elementos=("ID", "size"), Total_anterior=("Total_anterior", "sum"),
+             Total_actual=("Total_actual", "sum"), Delta=("Delta", "sum"))
+        .reindex(list(ESTADOS_REVISION)).dropna(how="all").reset_index()
+    )
+
+    material = detalle["Material"].where(detalle["Material"].notna(), detalle["Material_anterior"])
+    por_material = (
+        detalle.assign(Material=material.fillna("N/A"))
+        .groupby("Material", sort=False)[["Total_anterior", "Total_actual", "Delta"]].sum()
+        .reset_index()
+    )
+    por_material = por_material.reindex(por_material["Delta"].abs().sort_values(ascending=False).index).reset_index(drop=True)
+
+    cambios = (detalle["estado"] != "igual") | (detalle["Delta"].abs() > 1e-9)
+
+    return {
+        "total_anterior": float(detalle["Total_anterior"].sum()),
+        "total_actual": float(detalle["Total_actual"].sum()),
+        "delta": float(detalle["Delta"].sum()),
+        "por_estado": por_estado,
+        "por_material": por_material,
+        "elementos": detalle[cambios].reset_index(drop=True),
+    }
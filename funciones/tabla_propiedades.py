@@ -0,0 +1,134 @@
+import os
+import pandas as pd
+
+from funciones.cache_modelos import abrir_ifc
+from funciones.procesar_ifc_con_progreso import indexar_relaciones, atributos_simples, texto_materiales
+from funciones.utils.instrumentacion import instrumentar
+
+# Tabla larga (EAV): en lugar de una columna por cada "{pset}_{prop}", una fila por valor.
+#   tabla["elementos"]:   element_idx, ID, Nombre, atributos simples, Material_IFC (una fila por producto)
+#   tabla["propiedades"]: element_idx, pset, prop, columna (categorías) + valor_num / valor_bool / valor_texto
+# "columna" es el nombre que tendría el valor en el DataFrame ancho de procesar_ifc.
+
+def _tabla_propiedades(element_idx, psets, props, columnas, valores):
+    valor_num = [float(v) if isinstance(v, (int, float)) and not isinstance(v, bool) else None for v in valores]
+    valor_bool = [v if isinstance(v, bool) else None for v in valores]
+    valor_texto = [None if v is None or isinstance(v, (int, float)) else str(v) for v in valores]
+
+    return pd.DataFrame({
+        "element_idx": pd.array(element_idx, dtype="int32"),
+        # Categorías en orden de primera aparición para mantener el orden de columnas del formato ancho
+        "pset": pd.Categorical(psets, categories=list(dict.fromkeys(psets))),
+        "prop": pd.Categorical(props, categories=list(dict.fromkeys(props))),
+        "columna": pd.Categorical(columnas, categories=list(dict.fromkeys(columnas))),
+        "valor_num": pd.array(valor_num, dtype="Float64"),
+        "valor_bool": pd.array(valor_bool, dtype="boolean"),
+        "valor_texto": pd.array(valor_texto, dtype="string"),
+    })
+
+@instrumentar(categoria="extraccion")
+def extraer_tabla_larga(ruta_ifc, update_progress=None):
+    """
+    Extrae el IFC en formato largo: un DataFrame denso de elementos y una tabla de propiedades
+    con nombres codificados como categorías y valores tipados.
+    Devuelve un diccionario {"elementos": DataFrame, "propiedades": DataFrame}.
+    """
+    if not os.path.isfile(ruta_ifc):
+        raise FileNotFoundError(f"Archivo IFC no encontrado: {ruta_ifc}")
+
+    model = abrir_ifc(ruta_ifc)
+    indice = indexar_relaciones(model)
+    productos = model.by_type("IfcProduct")
+    total = len(productos)
+
+    elementos = []
+    element_idx, psets, props, columnas, valores = [], [], [], [], []
+
+    for idx, element in enumerate(productos):
+        if update_progress:
+            update_progress(idx / total)
+
+        elementos.append({
+            "element_idx": idx,
+            **atributos_simples(element),
+            "Material_IFC": texto_materiales(element, indice),
+        })
+
+        for pset, prop, valor in indice["psets"].get(element.id(), ()):
+            element_idx.append(idx)
+            psets.append(pset)
+            props.append(prop)
+            columnas.append(f"{pset}_{prop}")
+            valores.append(valor)
+
+        for qto, nombre, valor in indice["cantidades"].get(element.id(), ()):
+            element_idx.append(idx)
+            psets.append(qto)
+            props.append(nombre)
+            columnas.append(nombre)
+            valores.append(valor)
+
+    return {
+        "elementos": pd.DataFrame(elementos),
+        "propiedades": _tabla_propiedades(element_idx, psets, props, columnas, valores),
+    }
+
+def columnas_disponibles(tabla):
+    """
+    Nombres de columna que tendría el formato ancho, sin construirlo.
+    """
+    elementos = [c for c in tabla["elementos"].columns if c != "element_idx"]
+    return elementos + list(tabla["propiedades"]["columna"].cat.categories)
+
+def _valores_columna(propiedades, columna):
+    filas = propiedades[propiedades["columna"] == columna]
+    # Si un elemento repite la columna (dos psets con el mismo nombre), gana el último, como en procesar_ifc
+    filas = filas.drop_duplicates(subset="element_idx", keep="last")
+
+    if filas["valor_num"].notna().any() and filas["valor_texto"].isna().all() and filas["valor_bool"].isna().all():
+        serie = filas["valor_num"].astype("float64")
+    elif filas["valor_bool"].notna().any() and filas["valor_texto"].isna().all() and filas["valor_num"].isna().all():
+        serie = filas["valor_bool"].astype(object)
+    else:
+        serie = filas["valor_texto"].astype(object)
+        serie = serie.where(serie.notna(), filas["valor_num"].astype(object))
+        serie = serie.where(serie.notna(), filas["valor_bool"].astype(object))
+
+    return pd.Series(serie.to_numpy(), index=filas["element_idx"].to_numpy(), name=columna)
+
+def pivotar_propiedades(tabla, columnas, indices=None):
+    """
+    Construye un DataFrame ancho solo con las columnas pedidas (una fila por elemento).
+    Las columnas que no existen se ignoran. Con indices se limita a esos element_idx.
+    """
+    elementos = tabla["elementos"]
+    propiedades = tabla["propiedades"]
+    if indices is not None:
+        elementos = elementos[elementos["element_idx"].isin(indices)]
+        propiedades = propiedades[propiedades["element_idx"].isin(indices)]
+    disponibles_prop = set(propiedades["columna"].cat.categories)
+
+    resultado = pd.DataFrame(index=elementos["element_idx"].to_numpy())
+    for col in columnas:
+        if col in elementos.columns and col != "element_idx":
+            resultado[col] = elementos[col].to_numpy()
+        elif col in disponibles_prop:
+            resultado[col] = _valores_columna(propiedades, col)
+
+    return resultado.reset_index(drop=True)
+
+def fila_elemento(tabla, element_idx):
+    """
+    Devuelve como Series los valores no nulos de un elemento (equivalente a una fila del formato ancho sin NaN).
+    """
+    elementos = tabla["elementos"]
+    propiedades = tabla["propiedades"]
+
+    fila = elementos[elementos["element_idx"] == element_idx].drop(columns="element_idx")
+    datos = fila.iloc[0].to_dict() if not fila.empty else {}
+
+    filas_prop = propiedades[propiedades["element_idx"] == element_idx]
+    for col in filas_prop["columna"].astype(str).unique():
+        datos[col] = _valores_columna(filas_prop, col).iloc[0]
+
+    return pd.Series(datos).dropna()
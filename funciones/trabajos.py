@@ -0,0 +1,318 @@
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+
+import pandas as pd
+
+from funciones.cache_extraccion import escribir_parquet, leer_parquet
+
+logger = logging.getLogger(__name__)
+
+# Gestor de trabajos en segundo plano, compartido por todas las sesiones del proceso.
+# El estado se guarda en SQLite para poder consultarlo tras recargar la página. El resultado se queda en
+# memoria; si son tablas (DataFrame o dict de DataFrames) además se escribe en Parquet para recuperarlo después.
+CARPETA_TRABAJOS = os.path.join("cache", "trabajos")
+RUTA_REGISTRO_TRABAJOS = os.path.join(CARPETA_TRABAJOS, "trabajos.sqlite")
+TRABAJOS_SIMULTANEOS = int(os.environ.get("TRABAJOS_SIMULTANEOS", 4))
+ANTIGUEDAD_MAXIMA_TRABAJOS = 24 * 3600  # 1 día
+TAMANO_MAXIMO_RESULTADOS = 2 * 1024 ** 3  # 2 GB de resultados en disco
+INTERVALO_PURGA = 10 * 60  # segundos entre purgas
+
+ESTADOS_ACTIVOS = ("pendiente", "en_curso")
+
+class TrabajoCancelado(Exception):
+    pass
+
+_pool = None
+# id -> {"futuro", "cancelar", "estado", "resultado"} de los trabajos lanzados en este proceso
+_trabajos = {}
+_cerrojo_trabajos = threading.Lock()
+_ultima_purga = 0.0
+
+def _conectar(ruta=RUTA_REGISTRO_TRABAJOS):
+    os.makedirs(os.path.dirname(ruta), exist_ok=True)
+    con = sqlite3.connect(ruta, timeout=30)
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS trabajos (
+            id TEXT PRIMARY KEY,
+            tipo TEXT NOT NULL,
+            clave TEXT,
+            estado TEXT NOT NULL,
+            progreso REAL NOT NULL,
+            error TEXT,
+            creado REAL NOT NULL,
+            actualizado REAL NOT NULL,
+            pid INTEGER NOT NULL
+        )
+    """)
+    return con
+
+def _registrar(estado):
+    with closing(_conectar()) as con, con:
+        con.execute(
+            "INSERT OR REPLACE INTO trabajos (id, tipo, clave, estado, progreso, error, creado, actualizado, pid) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (estado["id"], estado["tipo"], estado["clave"], estado["estado"], estado["progreso"],
+             estado["error"], estado["creado"], estado["actualizado"], os.getpid()),
+        )
+
+def _ruta_resultado(id_trabajo):
+    # {id}.parquet si el resultado es un DataFrame; carpeta {id}/ con un Parquet por parte si es un dict
+    ruta = os.path.join(CARPETA_TRABAJOS, id_trabajo)
+    return ruta if os.path.isdir(ruta) else f"{ruta}.parquet"
+
+def _guardar_resultado(id_trabajo, resultado):
+    """
+    Escribe el resultado en Parquet si son tablas y devuelve True; cualquier otro resultado no se guarda.
+    """
+    ruta = os.path.join(CARPETA_TRABAJOS, id_trabajo)
+    if isinstance(resultado, pd.DataFrame):
+        escribir_parquet(resultado, f"{ruta}.parquet")
+        return True
+    if isinstance(resultado, dict) and resultado and all(
+        isinstance(parte, str) and parte.isidentifier() and isinstance(df, pd.DataFrame) for parte, df in resultado.items()
+    ):
+        # Se escribe en una carpeta temporal y se renombra: nunca se lee un resultado a medias
+        ruta_tmp = f"{ruta}.{os.getpid()}.tmp"
+        os.makedirs(ruta_tmp, exist_ok=True)
+        for parte, df in resultado.items():
+            escribir_parquet(df, os.path.join(ruta_tmp, f"{parte}.parquet"))
+        os.replace(ruta_tmp, ruta)
+        return True
+    return False
+
+def _leer_resultado(id_trabajo):
+    ruta = _ruta_resultado(id_trabajo)
+    if os.path.isdir(ruta):
+        return {nombre[:-len(".parquet")]: leer_parquet(os.path.join(ruta, nombre))
+                for nombre in sorted(os.listdir(ruta)) if nombre.endswith(".parquet")}
+    return leer_parquet(ruta)
+
+def _tamano_resultado(ruta):
+    if os.path.isdir(ruta):
+        return sum(os.path.getsize(os.path.join(ruta, nombre)) for nombre in os.listdir(ruta))
+    return os.path.getsize(ruta)
+
+def _obtener_pool():
+    global _pool
+    if _pool is None:
+        _pool = ThreadPoolExecutor(max_workers=TRABAJOS_SIMULTANEOS, thread_name_prefix="trabajo")
+    return _pool
+
+def _ejecutar(id_trabajo, funcion, args, kwargs, con_progreso):
+    trabajo = _trabajos[id_trabajo]
+    estado = trabajo["estado"]
+    ultimo_registro = [0.0]
+
+    def update_progress(fraccion):
+        # Punto de cancelación: el trabajo se detiene en la siguiente actualización de progreso
+        if trabajo["cancelar"].is_set():
+            raise TrabajoCancelado()
+        estado["progreso"] = float(min(max(fraccion, 0.0), 1.0))
+        estado["actualizado"] = time.time()
+        if estado["actualizado"] - ultimo_registro[0] >= 2:
+            ultimo_registro[0] = estado["actualizado"]
+            _registrar(estado)
+
+    if trabajo["cancelar"].is_set():
+        estado.update(estado="cancelado", actualizado=time.time())
+        _registrar(estado)
+        return
+
+    estado.update(estado="en_curso", actualizado=time.time())
+    _registrar(estado)
+    try:
+        if con_progreso:
+            kwargs = {**kwargs, "update_progress": update_progress}
+        resultado = funcion(*args, **kwargs)
+        # El resultado queda en memoria hasta que se recoge una vez (resultado_trabajo); después, si son
+        # tablas, solo en Parquet
+        trabajo["resultado"] = resultado
+        try:
+            trabajo["en_disco"] = _guardar_resultado(id_trabajo, resultado)
+        except Exception as e:
+            logger.warning("⚠️ No se pudo guardar el resultado del trabajo %s: %s", id_trabajo, e)
+        estado.update(estado="completado", progreso=1.0)
+    except TrabajoCancelado:
+        estado.update(estado="cancelado")
+    except Exception as e:
+        estado.update(estado="error", error=f"{type(e).__name__}: {e}")
+    estado["actualizado"] = time.time()
+    _registrar(estado)
+
+def _eliminar_resultado(id_trabajo):
+    ruta = _ruta_resultado(id_trabajo)
+    if os.path.isdir(ruta):
+        shutil.rmtree(ruta, ignore_errors=True)
+        return
+    try:
+        os.remove(ruta)
+    except FileNotFoundError:
+        pass
+
+def purgar_trabajos(antiguedad=ANTIGUEDAD_MAXIMA_TRABAJOS, tamano_maximo=TAMANO_MAXIMO_RESULTADOS):
+    """
+    Elimina del registro, de memoria y del disco los trabajos terminados hace más de `antiguedad` segundos.
+    Después borra los resultados en disco más antiguos hasta dejarlos por debajo de tamano_maximo bytes.
+    """
+    limite = time.time() - antiguedad
+    with closing(_conectar()) as con, con:
+        antiguos = [fila[0] for fila in con.execute(
+            f"SELECT id FROM trabajos WHERE actualizado < ? AND estado NOT IN ({','.join('?' * len(ESTADOS_ACTIVOS))})",
+            (limite, *ESTADOS_ACTIVOS),
+        )]
+        con.executemany("DELETE FROM trabajos WHERE id = ?", [(i,) for i in antiguos])
+    with _cerrojo_trabajos:
+        # También los terminados en este proceso que ya no están en el registro (p. ej. registro borrado)
+        antiguos += [id_trabajo for id_trabajo, t in _trabajos.items()
+                     if t["estado"]["estado"] not in ESTADOS_ACTIVOS and t["estado"]["actualizado"] < limite]
+        for id_trabajo in antiguos:
+            _trabajos.pop(id_trabajo, None)
+            _eliminar_resultado(id_trabajo)
+        # Resultados que nadie ha recogido: en memoria solo un intervalo, después se leen del Parquet.
+        # Los que no se guardaron en disco siguen en memoria hasta que el trabajo caduca.
+        for t in _trabajos.values():
+            if t.get("en_disco") and t["estado"]["actualizado"] < time.time() - INTERVALO_PURGA:
+                t["resultado"] = None
+
+    if not os.path.isdir(CARPETA_TRABAJOS):
+        return
+    resultados = []
+    for nombre in os.listdir(CARPETA_TRABAJOS):
+        ruta = os.path.join(CARPETA_TRABAJOS, nombre)
+        if nombre.endswith(".parquet") or (os.path.isdir(ruta) and not nombre.endswith(".tmp")):
+            resultados.append((os.path.getmtime(ruta), _tamano_resultado(ruta), nombre.removesuffix(".parquet")))
+    total = sum(tamano for _, tamano, _ in resultados)
+    for _, tamano, id_trabajo in sorted(resultados):
+        if total <= tamano_maximo:
+            break
+        _eliminar_resultado(id_trabajo)
+        total -= tamano
+
+def _purgar_si_toca():
+    global _ultima_purga
+    ahora = time.time()
+    if ahora - _ultima_purga < INTERVALO_PURGA:
+        return
+    _ultima_purga = ahora
+    try:
+        purgar_trabajos()
+    except Exception as e:
+        logger.warning("⚠️ No se pudieron purgar los trabajos: %s", e)
+
+def lanzar_trabajo(tipo, funcion, *args, clave=None, con_progreso=True, **kwargs):
+    """
+    Ejecuta funcion(*args, **kwargs) en segundo plano y devuelve el id del trabajo.
+    Con con_progreso=True la función recibe update_progress (fracción 0-1), que además es el punto
+    de cancelación. Si ya hay un trabajo activo con la misma clave (p. ej. el mismo IFC subido desde
+    otra sesión o tras recargar la página) se devuelve ese en lugar de lanzar otro.
+    """
+    with _cerrojo_trabajos:
+        if clave is not None:
+            for id_trabajo, trabajo in _trabajos.items():
+                if trabajo["estado"]["clave"] == clave and trabajo["estado"]["estado"] in ESTADOS_ACTIVOS:
+                    return id_trabajo
+
+        id_trabajo = uuid.uuid4().hex
+        ahora = time.time()
+        estado = {"id": id_trabajo, "tipo": tipo, "clave": clave, "estado": "pendiente", "progreso": 0.0,
+                  "error": None, "creado": ahora, "actualizado": ahora}
+        _trabajos[id_trabajo] = {"estado": estado, "cancelar": threading.Event(), "resultado": None}
+    _registrar(estado)
+    _trabajos[id_trabajo]["futuro"] = _obtener_pool().submit(_ejecutar, id_trabajo, funcion, args, kwargs, con_progreso)
+
+    _purgar_si_toca()
+    return id_trabajo
+
+def estado_trabajo(id_trabajo):
+    """
+    Devuelve {"id", "tipo", "clave", "estado", "progreso", "error", "creado", "actualizado"} o None si no existe.
+    estado: pendiente, en_curso, completado, error, cancelado o interrumpido (el proceso que lo ejecutaba terminó).
+    """
+    _purgar_si_toca()
+    trabajo = _trabajos.get(id_trabajo)
+    if trabajo is not None:
+        return dict(trabajo["estado"])
+
+    if not os.path.isfile(RUTA_REGISTRO_TRABAJOS):
+        return None
+    with closing(_conectar()) as con:
+        fila = con.execute(
+            "SELECT id, tipo, clave, estado, progreso, error, creado, actualizado, pid FROM trabajos WHERE id = ?", (id_trabajo,)
+        ).fetchone()
+    if fila is None:
+        return None
+    estado = dict(zip(("id", "tipo", "clave", "estado", "progreso", "error", "creado", "actualizado"), fila[:8]))
+    if estado["estado"] in ESTADOS_ACTIVOS:
+        estado["estado"] = "interrumpido"
+    return estado
+
+def buscar_trabajo(clave):
+    """
+    Id del trabajo más reciente con esa clave que sigue activo en este proceso o que terminó
+    con su resultado disponible, para volver a engancharse a él tras recargar la página. None si no hay.
+    """
+    with _cerrojo_trabajos:
+        candidatos = sorted((dict(t["estado"]) for t in _trabajos.values() if t["estado"]["clave"] == clave),
+                            key=lambda e: e["creado"], reverse=True)
+    for estado in candidatos:
+        if estado["estado"] in ESTADOS_ACTIVOS:
+            return estado["id"]
+        if estado["estado"] == "completado" and (
+            _trabajos.get(estado["id"], {}).get("resultado") is not None or os.path.exists(_ruta_resultado(estado["id"]))
+        ):
+            return estado["id"]
+
+    # Completados en otro proceso (p. ej. antes de reiniciar el servidor) con el resultado en Parquet
+    if not os.path.isfile(RUTA_REGISTRO_TRABAJOS):
+        return None
+    with closing(_conectar()) as con:
+        filas = con.execute(
+            "SELECT id FROM trabajos WHERE clave = ? AND estado = 'completado' ORDER BY creado DESC", (clave,)
+        ).fetchall()
+    return next((fila[0] for fila in filas if os.path.exists(_ruta_resultado(fila[0]))), None)
+
+def resultado_trabajo(id_trabajo):
+    """
+    Resultado de un trabajo completado. La primera vez sale de memoria y, si está guardado en Parquet,
+    se libera; las siguientes, o si se lanzó en otro proceso, se lee del Parquet.
+    """
+    trabajo = _trabajos.get(id_trabajo)
+    if trabajo is not None and trabajo["estado"]["estado"] == "completado" and trabajo["resultado"] is not None:
+        resultado = trabajo["resultado"]
+        # Sin copia en disco (no se pudo guardar) se mantiene en memoria hasta la purga
+        if trabajo.get("en_disco"):
+            trabajo["resultado"] = None
+        return resultado
+    if not os.path.exists(_ruta_resultado(id_trabajo)):
+        raise KeyError(f"El trabajo {id_trabajo} no tiene resultado")
+    return _leer_resultado(id_trabajo)
+
+def cancelar_trabajo(id_trabajo):
+    """
+    Pide la cancelación: un trabajo pendiente no llega a empezar y uno en curso se detiene
+    en su siguiente actualización de progreso.
+    """
+    trabajo = _trabajos.get(id_trabajo)
+    if trabajo is None:
+        return False
+    trabajo["cancelar"].set()
+    futuro = trabajo.get("futuro")
+    if futuro is not None and futuro.cancel():
+        trabajo["estado"].update(estado="cancelado", actualizado=time.time())
+        _registrar(trabajo["estado"])
+    return True
+
+def listar_trabajos(activos=False):
+    """
+    Estados de los trabajos lanzados en este proceso, del más reciente al más antiguo.
+    """
+    estados = [dict(t["estado"]) for t in list(_trabajos.values())]
+    if activos:
+        estados = [e for e in estados if e["estado"] in ESTADOS_ACTIVOS]
+    return sorted(estados, key=lambda e: e["creado"], reverse=True)
@@ -0,0 +1,101 @@
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from contextlib import closing
+from types import SimpleNamespace
+
+# Caché en disco de respuestas de la IA, clave = (modelo, hash del prompt, parámetros de generación)
+RUTA_CACHE_RESPUESTAS = os.path.join("cache", "respuestas_ia.sqlite")
+TTL_RESPUESTAS = 7 * 24 * 3600  # 7 días
+TAMANO_MAXIMO_RESPUESTAS = 200 * 1024 ** 2  # 200 MB
+
+def clave_respuesta(nombre_modelo, prompt, parametros=None):
+    """
+    SHA-256 de (modelo, prompt, parámetros de generación serializados de forma estable).
+    """
+    parametros_json = json.dumps(parametros or {}, sort_keys=True, default=str)
+    contenido = "\x1f".join([str(nombre_modelo), parametros_json, str(prompt)])
+    return hashlib.sha256(contenido.encode("utf-8")).hexdigest()
+
+def _conectar(ruta):
+    carpeta = os.path.dirname(ruta)
+    if carpeta:
+        os.makedirs(carpeta, exist_ok=True)
+    con = sqlite3.connect(ruta, timeout=30)
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS respuestas (
+            clave TEXT PRIMARY KEY,
+            modelo TEXT NOT NULL,
+            texto TEXT NOT NULL,
+            creado REAL NOT NULL,
+            ultimo_uso REAL NOT NULL,
+            tamano INTEGER NOT NULL
+        )
+    """)
+    return con
+
+def leer_respuesta(clave, ruta=RUTA_CACHE_RESPUESTAS, ttl=TTL_RESPUESTAS):
+    """
+    Devuelve el texto cacheado o None si no existe o ha caducado.
+    """
+    if not os.path.isfile(ruta):
+        return None
+    ahora = time.time()
+    with closing(_conectar(ruta)) as con, con:
+        fila = con.execute("SELECT texto, creado FROM respuestas WHERE clave = ?", (clave,)).fetchone()
+        if fila is None:
+            return None
+        texto, creado = fila
+        if ttl and ahora - creado > ttl:
+            con.execute("DELETE FROM respuestas WHERE clave = ?", (clave,))
+            return None
+        con.execute("UPDATE respuestas SET ultimo_uso = ? WHERE clave = ?", (ahora, clave))
+    return texto
+
+def guardar_respuesta(clave, nombre_modelo, texto, ruta=RUTA_CACHE_RESPUESTAS, ttl=TTL_RESPUESTAS,
+                      tamano_maximo=TAMANO_MAXIMO_RESPUESTAS):
+    """
+    Guarda una respuesta y purga las caducadas y, si se supera tamano_maximo, las usadas hace más tiempo.
+    """
+    ahora = time.time()
+    tamano = len(texto.encode("utf-8"))
+    with closing(_conectar(ruta)) as con, con:
+        con.execute(
+            "INSERT OR REPLACE INTO respuestas (clave, modelo, texto, creado, ultimo_uso, tamano) VALUES (?, ?, ?, ?, ?, ?)",
+            (clave, str(nombre_modelo), texto, ahora, ahora, tamano),
+        )
+        if ttl:
+            con.execute("DELETE FROM respuestas WHERE creado < ?", (ahora - ttl,))
+
+        total = con.execute("SELECT COALESCE(SUM(tamano), 0) FROM respuestas").fetchone()[0]
+        if total > tamano_maximo:
+            for clave_antigua, tamano_antiguo in con.execute(
+                "SELECT clave, tamano FROM respuestas WHERE clave != ? ORDER BY ultimo_uso", (clave,)
+            ).fetchall():
+                if total <= tamano_maximo:
+                    break
+                con.execute("DELETE FROM respuestas WHERE clave = ?", (clave_antigua,))
+                total -= tamano_antiguo
+
+def con_cache(modelo, ruta=RUTA_CACHE_RESPUESTAS, ttl=TTL_RESPUESTAS, tamano_maximo=TAMANO_MAXIMO_RESPUESTAS):
+    """
+    Envuelve un modelo (Gemini o compatible) para que generate_content consulte antes la caché.
+    El objeto devuelto expone generate_content(prompt, **kwargs) -> objeto con .text, igual que el modelo,
+    y además .desde_cache y, si el modelo lo da, .usage_metadata (tokens consumidos).
+    """
+    nombre_modelo = getattr(modelo, "model_name", type(modelo).__name__)
+    config_modelo = getattr(modelo, "_generation_config", None)
+
+    def generate_content(prompt, **kwargs):
+        clave = clave_respuesta(nombre_modelo, prompt, {"modelo": config_modelo, **kwargs})
+        texto = leer_respuesta(clave, ruta=ruta, ttl=ttl)
+        if texto is not None:
+            return SimpleNamespace(text=texto, desde_cache=True, usage_metadata=None)
+        respuesta = modelo.generate_content(prompt, **kwargs)
+        texto = respuesta.text if hasattr(respuesta, "text") else str(respuesta)
+        guardar_respuesta(clave, nombre_modelo, texto, ruta=ruta, ttl=ttl, tamano_maximo=tamano_maximo)
+        return SimpleNamespace(text=texto, desde_cache=False, usage_metadata=getattr(respuesta, "usage_metadata", None))
+
+    return SimpleNamespace(generate_content=generate_content, model_name=nombre_modelo, modelo=modelo)
@@ -1,67 +1,236 @@
+import numpy as np
 import pandas as pd
 
-def calcular_huella_carbono(df_ifc, hojas_bbdd, etapas):
+from funciones.utils.emparejar_materiales import normalizar_texto
+from funciones.utils.factores_digitaec import factores_digitaec_v2
+from funciones.utils.instrumentacion import instrumentar
+
+ETAPAS_CICLO_VIDA = ["A1-3", "A4", "A5", "C1", "C2", "C3", "C4", "D"]
+
+def _es_formato_clasico(hojas_bbdd):
+    # Formato original: hojas A1-3 / A4-A5 / C / D con columnas 'Nombre', 'GWP' y 'Ud'
+    return any({'Nombre', 'GWP', 'Ud'} <= set(h.columns) for h in hojas_bbdd.values())
+
+def _hoja_clasica(etapa):
+    if etapa == 'A1-3':
+        return 'A1-3'
+    if etapa == 'D':
+        return 'D'
+    return 'C'
+
+def _factores_formato_clasico(hojas_bbdd, etapas):
+    filas = []
+    for etapa in etapas:
+        hoja = _hoja_clasica(etapa)
+        if hoja not in hojas_bbdd:
+            continue
+        df = hojas_bbdd[hoja].dropna(subset=['Nombre', 'GWP', 'Ud'])
+        filas.append(pd.DataFrame({
+            'Nombre': df['Nombre'].astype(str).str.lower().str.strip().to_numpy(),
+            'etapa': etapa,
+            'GWP': pd.to_numeric(df['GWP'], errors='coerce').to_numpy(),
+        }))
+    return filas
+
+@instrumentar(categoria="calculo")
+def tabla_factores_gwp(hojas_bbdd, etapas, distancia_km=None):
+    """
+    Tabla larga [Nombre, etapa, GWP] con una fila por cada fila de la base y etapa pedida.
+    Admite el formato clásico (hojas A1-3/C/D con 'Nombre' y 'GWP') y la base DIGITAEC v2
+    (ver factores_digitaec_v2; distancia_km solo se usa en ese formato, para A4).
+    """
+    if _es_formato_clasico(hojas_bbdd):
+        filas = _factores_formato_clasico(hojas_bbdd, etapas)
+    else:
+        filas = factores_digitaec_v2(hojas_bbdd, etapas, distancia_km)
+
+    if not filas:
+        return pd.DataFrame(columns=['Nombre', 'etapa', 'GWP'])
+    return pd.concat(filas, ignore_index=True).dropna(subset=['GWP'])
+
+def _claves(nombres):
+    # normalizar_texto una sola vez por nombre distinto
+    unicos = pd.unique(pd.Series(nombres, dtype=object).astype(str))
+    return pd.Series(nombres, dtype=object).astype(str).map(dict(zip(unicos, map(normalizar_texto, unicos))))
+
+@instrumentar(categoria="calculo")
+def tabla_gwp_por_clave(factores, etapas):
+    """
+    Tabla de búsqueda material → GWP por etapa, indexada por el nombre normalizado (normalizar_texto)
+    de la base: media del GWP de las filas con ese nombre en cada etapa (0 si la etapa no tiene dato).
+    Se construye una vez por cálculo y se cruza con los materiales mediante un merge.
+    """
+    if factores.empty:
+        return pd.DataFrame(columns=list(etapas), index=pd.Index([], name='clave'), dtype=float)
+    tabla = (
+        factores.assign(clave=_claves(factores['Nombre']).to_numpy())
+        .pivot_table(index='clave', columns='etapa', values='GWP', aggfunc='mean')
+    )
+    return tabla.reindex(columns=list(etapas)).fillna(0.0)
+
+def gwp_por_material(materiales, factores, etapas, tabla=None):
+    """
+    Matriz material × etapa con el GWP de la base para cada material, por nombre normalizado
+    ("Hormigón HA-30" == "hormigon ha 30"); 0 si el material no está en la base.
+    Los materiales deben venir ya emparejados con los nombres de la base (normalizar_materiales_con_ia).
+    tabla: resultado de tabla_gwp_por_clave ya calculado (opcional, para reutilizarlo entre llamadas).
+    """
+    materiales = list(materiales)
+    if tabla is None:
+        tabla = tabla_gwp_por_clave(factores, etapas)
+    if tabla.empty or not materiales:
+        return pd.DataFrame(0.0, index=materiales, columns=etapas)
+
+    gwp = pd.DataFrame({'clave': _claves(materiales).to_numpy()}).merge(
+        tabla, left_on='clave', right_index=True, how='left'
+    )
+    return pd.DataFrame(gwp[list(etapas)].fillna(0.0).to_numpy(dtype=float), index=materiales, columns=etapas)
+
+@instrumentar(categoria="calculo")
+def calcular_huella_por_elemento(df_ifc, hojas_bbdd, etapas, distancia_km=None, factores=None):
+    """
+    Huella por elemento: una fila por fila de df_ifc con GWP por etapa, huella por etapa y Total.
+
+    df_ifc: DataFrame con columnas ['Material', 'Cantidad'] (y opcionalmente 'ID', 'Unidad')
+    factores: tabla de tabla_factores_gwp ya calculada (opcional, para reutilizarla entre llamadas)
+    """
+    if factores is None:
+        factores = tabla_factores_gwp(hojas_bbdd, etapas, distancia_km)
+
+    materiales = df_ifc['Material'].astype(str).str.lower().str.strip()
+    cantidades = pd.to_numeric(df_ifc['Cantidad'], errors='coerce').fillna(0.0)
+
+    unicos = pd.unique(materiales)
+    gwp = gwp_por_material(unicos, factores, etapas)
+    gwp_elementos = gwp.reindex(materiales.to_numpy()).to_numpy()
+    huella = gwp_elementos * cantidades.to_numpy()[:, None]
+
+    resultado = pd.DataFrame(index=df_ifc.index)
+    if 'ID' in df_ifc.columns:
+        resultado['ID'] = df_ifc['ID']
+    resultado['Material'] = df_ifc['Material']
+    resultado['Cantidad'] = cantidades
+    if 'Unidad' in df_ifc.columns:
+        resultado['Unidad'] = df_ifc['Unidad']
+    for j, etapa in enumerate(etapas):
+        resultado[f"GWP {etapa}"] = gwp_elementos[:, j]
+    for j, etapa in enumerate(etapas):
+        resultado[f"Huella {etapa}"] = huella[:, j]
+    resultado['Total'] = huella.sum(axis=1)
+    return resultado
+
+@instrumentar(categoria="calculo")
+def calcular_huella_carbono(df_ifc, hojas_bbdd, etapas, distancia_km=None):
     """
     Calcula la huella de carbono por material en base a las etapas seleccionadas y la base de datos.
 
     df_ifc: DataFrame con columnas ['Material', 'Cantidad', 'Unidad', 'ID']
     hojas_bbdd: Diccionario de hojas del Excel de sostenibilidad
     etapas: Lista de etapas seleccionadas (e.g. ['A1-3', 'A4-A5', 'C1', 'C2', 'C3', 'C4', 'D'])
+    distancia_km: Distancia de transporte para A4 (solo base DIGITAEC v2)
 
     Devuelve un DataFrame con los cálculos.
     """
+    factores = tabla_factores_gwp(hojas_bbdd, etapas, distancia_km)
 
-    # Unificar hojas relevantes (A1-3, A4-A5, C-D)
-    hojas_uso = ['A1-3', 'A4-A5', 'C', 'D']
-    base = pd.concat(
-        [hojas_bbdd[h].copy().assign(etapa=h) for h in hojas_uso if h in hojas_bbdd],
-        ignore_index=True
-    )
+    materiales = df_ifc['Material'].astype(str).str.lower().str.strip()
+    cantidades = pd.to_numeric(df_ifc['Cantidad'], errors='coerce')
 
-    base = base.dropna(subset=['Nombre', 'GWP', 'Ud'])  # Solo filas con datos clave
+    # Agrupar por material (en orden de aparición) y buscar el GWP de cada material una sola vez
+    cantidad_total = cantidades.groupby(materiales, sort=False).sum()
+    gwp = gwp_por_material(cantidad_total.index, factores, etapas)
 
-    # Normalizar nombres de materiales
-    base['Nombre'] = base['Nombre'].astype(str).str.lower().str.strip()
-    df_ifc['Material'] = df_ifc['Material'].astype(str).str.lower().str.strip()
+    resultado = pd.DataFrame({
+        'Material': [m.title() for m in cantidad_total.index],
+        'Cantidad [m³]': cantidad_total.round(4).to_numpy(),
+    })
+    for etapa in etapas:
+        resultado[f"GWP {etapa} [kg CO₂ eq/m³]"] = gwp[etapa].round(2).to_numpy()
+    resultado['Huella Total [kg CO₂ eq]'] = (gwp.to_numpy() * cantidad_total.to_numpy()[:, None]).sum(axis=1).round(2)
 
-    # Agrupar por material y etapa
-    resultados = []
+    return resultado
 
-    for material in df_ifc['Material'].unique():
-        filas_material = df_ifc[df_ifc['Material'] == material]
-        cantidad_total = filas_material['Cantidad'].sum()
-
-        fila_resultado = {
-            'Material': material.title(),
-            'Cantidad [m³]': round(cantidad_total, 4)
-        }
-
-        total_huella = 0
-
-        for etapa in etapas:
-            etapa_nombre = etapa if etapa != 'A4-5' else 'A4-A5'
-            if etapa_nombre == 'A1-3':
-                hoja_etapa = base[base['etapa'] == 'A1-3']
-            elif etapa_nombre == 'A4-5':
-                hoja_etapa = base[base['etapa'] == 'A4-A5']
-            elif etapa_nombre == 'D':
-                hoja_etapa = base[base['etapa'] == 'D']
-            else:
-                hoja_etapa = base[base['etapa'] == 'C']
-
-            # Buscar GWP para el material
-            posibles = hoja_etapa[hoja_etapa['Nombre'].str.contains(material.lower(), case=False)]
-
-            if posibles.empty:
-                valor_gwp = 0
-            else:
-                valor_gwp = posibles['GWP'].mean()
-
-            etapa_col = f"GWP {etapa} [kg CO₂ eq/m³]"
-            fila_resultado[etapa_col] = round(valor_gwp, 2)
-            total_huella += valor_gwp * cantidad_total
-
-        fila_resultado['Huella Total [kg CO₂ eq]'] = round(total_huella, 2)
-        resultados.append(fila_resultado)
+@instrumentar(categoria="calculo")
+def matriz_huella(df_ifc, hojas_bbdd, etapas=ETAPAS_CICLO_VIDA):
+    """
+    GWP por unidad de cada elemento y etapa, calculado una sola vez para todas las etapas.
+    A4 es lineal en la distancia de transporte: se guarda su valor a 0 km y su pendiente por km.
+    Cambiar etapas, materiales o distancia_km es después solo aplicar máscaras y escalares
+    (ver huella_desde_matriz y resumen_desde_matriz), sin volver a buscar en la base.
 
-    return pd.DataFrame(resultados)
+    df_ifc: DataFrame con columnas ['Material', 'Cantidad'] (y opcionalmente 'ID', 'Unidad')
+    """
+    etapas = list(etapas)
+    materiales = df_ifc['Material'].astype(str).str.lower().str.strip()
+    unicos = pd.unique(materiales)
+
+    gwp = gwp_por_material(unicos, tabla_factores_gwp(hojas_bbdd, etapas, 0), etapas)
+    pendiente = pd.Series(0.0, index=unicos)
+    if 'A4' in etapas:
+        pendiente = gwp_por_material(unicos, tabla_factores_gwp(hojas_bbdd, ['A4'], 1), ['A4'])['A4'] - gwp['A4']
+
+    return {
+        'etapas': etapas,
+        'elementos': df_ifc[[c for c in ('ID', 'Material', 'Unidad') if c in df_ifc.columns]].copy(),
+        'materiales': materiales.to_numpy(),
+        'cantidades': pd.to_numeric(df_ifc['Cantidad'], errors='coerce').to_numpy(dtype=float),
+        'gwp': gwp.reindex(materiales.to_numpy()).to_numpy(),
+        'pendiente_km': pendiente.reindex(materiales.to_numpy()).to_numpy(),
+    }
+
+def _gwp_seleccion(matriz, etapas, distancia_km):
+    # Columnas de las etapas pedidas, con A4 escalado a la distancia
+    columnas = [matriz['etapas'].index(etapa) for etapa in etapas]
+    gwp = matriz['gwp'][:, columnas]
+    if 'A4' in etapas:
+        j = list(etapas).index('A4')
+        gwp[:, j] = gwp[:, j] + matriz['pendiente_km'] * float(distancia_km or 0)
+    return gwp
+
+def huella_desde_matriz(matriz, etapas, distancia_km=None, filas=None):
+    """
+    Huella por elemento (mismo formato que calcular_huella_por_elemento) a partir de matriz_huella.
+    filas: máscara booleana o posiciones de los elementos a incluir (p. ej. los materiales seleccionados).
+    """
+    etapas = [etapa for etapa in etapas if etapa in matriz['etapas']]
+    seleccion = slice(None) if filas is None else np.asarray(filas)
+    gwp = _gwp_seleccion(matriz, etapas, distancia_km)[seleccion]
+    cantidades = np.nan_to_num(matriz['cantidades'][seleccion])
+    huella = gwp * cantidades[:, None]
+
+    elementos = matriz['elementos'].iloc[seleccion]
+    resultado = pd.DataFrame(index=elementos.index)
+    if 'ID' in elementos.columns:
+        resultado['ID'] = elementos['ID']
+    resultado['Material'] = elementos['Material']
+    resultado['Cantidad'] = cantidades
+    if 'Unidad' in elementos.columns:
+        resultado['Unidad'] = elementos['Unidad']
+    for j, etapa in enumerate(etapas):
+        resultado[f"GWP {etapa}"] = gwp[:, j]
+    for j, etapa in enumerate(etapas):
+        resultado[f"Huella {etapa}"] = huella[:, j]
+    resultado['Total'] = huella.sum(axis=1)
+    return resultado
+
+def resumen_desde_matriz(matriz, etapas, distancia_km=None, filas=None):
+    """
+    Huella por material (mismo formato que calcular_huella_carbono) a partir de matriz_huella.
+    """
+    etapas = [etapa for etapa in etapas if etapa in matriz['etapas']]
+    seleccion = slice(None) if filas is None else np.asarray(filas)
+    materiales = pd.Series(matriz['materiales'][seleccion])
+    gwp = pd.DataFrame(_gwp_seleccion(matriz, etapas, distancia_km)[seleccion], columns=etapas)
+
+    # Todos los elementos de un material comparten GWP: basta con el primero de cada grupo
+    cantidad_total = pd.Series(matriz['cantidades'][seleccion]).groupby(materiales, sort=False).sum()
+    gwp_material = gwp.groupby(materiales, sort=False).first().reindex(cantidad_total.index)
+
+    resultado = pd.DataFrame({
+        'Material': [m.title() for m in cantidad_total.index],
+        'Cantidad [m³]': cantidad_total.round(4).to_numpy(),
+    })
+    for etapa in etapas:
+        resultado[f"GWP {etapa} [kg CO₂ eq/m³]"] = gwp_material[etapa].round(2).to_numpy()
+    resultado['Huella Total [kg CO₂ eq]'] = (gwp_material.to_numpy() * cantidad_total.to_numpy()[:, None]).sum(axis=1).round(2)
+    return resultado
@@ -0,0 +1,138 @@
+import math
+import re
+import unicodedata
+from collections import Counter, defaultdict
+
+# Reglas para códigos normativos habituales en modelos IFC españoles.
+# Cada código se expande con su descripción para que el emparejamiento por n-gramas lo reconozca.
+REGLAS_CODIGOS = [
+    (re.compile(r"\bHA-?\s?(\d{2})\b", re.I), r"hormigon armado HA-\1 hormigon \1MPa"),
+    (re.compile(r"\bHM-?\s?(\d{2})\b", re.I), r"hormigon en masa HM-\1 hormigon \1MPa"),
+    (re.compile(r"\bHP-?\s?(\d{2})\b", re.I), r"hormigon pretensado HP-\1 hormigon \1MPa"),
+    (re.compile(r"\bB\s?(400|500)\s?(S|SD|T)?\b", re.I), r"acero corrugado B\1 barras corrugadas acero de refuerzo en hormigon"),
+    (re.compile(r"\bS\s?(235|275|355|420|460)\s?(JR|J0|J2|N|NL|M|ML)?\b", re.I), r"acero estructural S\1 vigas y pilares"),
+    (re.compile(r"\bA-?\s?(37|42|52)\b", re.I), r"acero laminado A-\1 acero estructural vigas y pilares"),
+    (re.compile(r"\bXPS\b", re.I), "poliestireno extruido XPS"),
+    (re.compile(r"\bEPS\b", re.I), "poliestireno expandido EPS"),
+    (re.compile(r"\b(MW|lana mineral)\b", re.I), "lana mineral lana de roca lana de vidrio"),
+    (re.compile(r"\b(PUR|PIR)\b", re.I), "poliuretano rigido"),
+    (re.compile(r"\bOSB\b", re.I), "tablero de virutas orientadas OSB"),
+    (re.compile(r"\bMDF\b", re.I), "tablero de fibra de densidad media MDF"),
+    (re.compile(r"\bCLT\b", re.I), "CLT paneles de madera contralaminada"),
+    (re.compile(r"\b(PYL|pladur)\b", re.I), "panel de yeso laminado"),
+]
+
+UMBRAL_CONFIANZA = 0.6
+# Si los dos mejores candidatos están a menos de esta distancia, el emparejamiento se considera ambiguo
+MARGEN_AMBIGUEDAD = 0.05
+
+def normalizar_texto(texto):
+    """
+    Minúsculas, sin tildes y con cualquier signo sustituido por espacios.
+    """
+    texto = unicodedata.normalize("NFKD", str(texto))
+    texto = "".join(c for c in texto if not unicodedata.combining(c))
+    texto = re.sub(r"[^a-z0-9]+", " ", texto.lower())
+    return texto.strip()
+
+def expandir_codigos(texto):
+    """
+    Añade al texto la descripción de los códigos normativos que contiene (HA-30 → hormigón armado...).
+    """
+    extras = [regla.sub(expansion, m.group(0)) for regla, expansion in REGLAS_CODIGOS for m in regla.finditer(str(texto))]
+    return " ".join([str(texto)] + extras)
+
+def _rasgos(texto):
+    # Palabras completas + trigramas de caracteres por palabra (con bordes), para tolerar abreviaturas y erratas
+    rasgos = Counter()
+    for palabra in normalizar_texto(texto).split():
+        rasgos[f"w:{palabra}"] += 1
+        relleno = f" {palabra} "
+        for i in range(len(relleno) - 2):
+            rasgos[f"c:{relleno[i:i + 3]}"] += 1
+    return rasgos
+
+def _vector(rasgos, idf):
+    vector = {r: (1 + math.log(n)) * idf[r] for r, n in rasgos.items() if r in idf}
+    norma = math.sqrt(sum(v * v for v in vector.values())) or 1.0
+    return {r: v / norma for r, v in vector.items()}
+
+def columna_nombre(hoja):
+    """
+    Columna con el nombre del material en una hoja de la base: 'Nombre' o, en la v2 de DIGITAEC, 'Material'.
+    """
+    for col in ("Nombre", "Material"):
+        if col in hoja.columns:
+            return col
+    return None
+
+def nombres_base_datos(hojas_bbdd):
+    """
+    Nombres de material de todas las hojas, sin duplicados y en orden de aparición.
+    En hojas con columna 'Ud' se omiten las filas sin unidad (títulos de categoría).
+    """
+    nombres = []
+    for hoja in hojas_bbdd.values():
+        col = columna_nombre(hoja)
+        if col is None:
+            continue
+        filas = hoja[hoja["Ud"].notna()] if "Ud" in hoja.columns else hoja
+        nombres.extend(filas[col].dropna().astype(str).str.strip())
+    return list(dict.fromkeys(n for n in nombres if n))
+
+def construir_indice_materiales(nombres):
+    """
+    Construye un índice TF-IDF de trigramas y palabras sobre los nombres de la base de datos.
+    Se calcula una vez y se reutiliza para todas las consultas.
+    """
+    rasgos_docs = [_rasgos(n) for n in nombres]
+    n_docs = len(nombres)
+    frecuencia_docs = Counter(r for rasgos in rasgos_docs for r in rasgos)
+    idf = {r: math.log((1 + n_docs) / (1 + df)) + 1 for r, df in frecuencia_docs.items()}
+
+    invertido = defaultdict(list)
+    for i, rasgos in enumerate(rasgos_docs):
+        for r, peso in _vector(rasgos, idf).items():
+            invertido[r].append((i, peso))
+
+    return {"nombres": list(nombres), "idf": idf, "invertido": dict(invertido)}
+
+def posiciones_similares(texto, indice, n=5):
+    """
+    Devuelve las posiciones (en indice["nombres"]) de los n textos más parecidos a texto,
+    como lista de (posición, puntuación) de mayor a menor.
+    """
+    consulta = _vector(_rasgos(expandir_codigos(texto)), indice["idf"])
+    puntuaciones = defaultdict(float)
+    for r, peso in consulta.items():
+        for i, peso_doc in indice["invertido"].get(r, ()):
+            puntuaciones[i] += peso * peso_doc
+
+    return sorted(puntuaciones.items(), key=lambda x: x[1], reverse=True)[:n]
+
+def candidatos_material(material, indice, n=5):
+    """
+    Devuelve los n nombres de la base más parecidos a material, como lista de (nombre, puntuación)
+    con la puntuación (similitud coseno) entre 0 y 1, de mayor a menor.
+    """
+    return [(indice["nombres"][i], round(p, 4)) for i, p in posiciones_similares(material, indice, n)]
+
+def emparejar_materiales(materiales, indice, umbral=UMBRAL_CONFIANZA, margen=MARGEN_AMBIGUEDAD):
+    """
+    Empareja cada material con su mejor candidato de la base.
+    Devuelve un diccionario material → {"Material_Normalizado", "Confianza", "Candidatos"};
+    por debajo del umbral, o si el segundo candidato está a menos de margen del primero,
+    el material queda como "NO ENCONTRADO" (pendiente de revisión o IA).
+    """
+    resultado = {}
+    for material in materiales:
+        candidatos = candidatos_material(material, indice)
+        mejor, confianza = candidatos[0] if candidatos else ("NO ENCONTRADO", 0.0)
+        segunda = candidatos[1][1] if len(candidatos) > 1 else 0.0
+        fiable = confianza >= umbral and confianza - segunda >= margen
+        resultado[material] = {
+            "Material_Normalizado": mejor if fiable else "NO ENCONTRADO",
+            "Confianza": confianza,
+            "Candidatos": candidatos,
+        }
+    return resultado
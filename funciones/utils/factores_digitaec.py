@@ -0,0 +1,86 @@
+import pandas as pd
+
+from funciones.utils.emparejar_materiales import normalizar_texto
+
+# Lectura de los factores de la base DIGITAEC v2 para el cálculo local (calcular_huella.tabla_factores_gwp)
+
+def _columna_gwp(hoja):
+    if 'GWP' in hoja.columns:
+        return 'GWP'
+    return next((c for c in hoja.columns if str(c).strip().startswith('GWP - TOTAL')), None)
+
+def _reparar_encabezado(df, clave):
+    # En algunas hojas de la v2 el encabezado real está en la primera fila de datos
+    if clave in df.columns:
+        return df
+    for i in range(min(5, len(df))):
+        fila = df.iloc[i].astype(str).str.strip().tolist()
+        if clave in fila:
+            df = df.iloc[i + 1:].copy()
+            df.columns = fila
+            return df
+    return df
+
+def _factor_transporte(hojas_bbdd):
+    """
+    GWP por t·km del primer transporte por carretera de la hoja A4-A5 (0 si no existe).
+    """
+    hoja = hojas_bbdd.get('A4-A5')
+    if hoja is None or hoja.shape[1] < 3:
+        return 0.0
+    col_gwp = _columna_gwp(hoja)
+    if col_gwp is None:
+        return 0.0
+    unidades = hoja.iloc[:, 2].astype(str).str.strip().str.lower()
+    valores = pd.to_numeric(hoja.loc[unidades == 'tkm', col_gwp], errors='coerce').dropna()
+    return float(valores.iloc[0]) if not valores.empty else 0.0
+
+def factores_digitaec_v2(hojas_bbdd, etapas, distancia_km=None):
+    """
+    Factores GWP de la base DIGITAEC v2 (la de datos/), que no tiene hojas por etapa con 'Nombre' y 'GWP':
+    A1-3 por material (columna 'Material'); C1-C4 y D por escenario de fin de vida (hoja C-D);
+    A4 como transporte por carretera × distancia_km para materiales en kg o t.
+    A5 no depende del material y se deja a 0.
+    Devuelve una lista de tablas [Nombre, etapa, GWP], una por etapa (ver tabla_factores_gwp).
+    """
+    hoja = hojas_bbdd.get('A1-3')
+    if hoja is None or 'Material' not in hoja.columns:
+        return []
+
+    col_gwp = _columna_gwp(hoja)
+    materiales = pd.DataFrame({
+        'Nombre': hoja['Material'].astype(str).str.lower().str.strip(),
+        'Ud': hoja['Ud'].astype(str).str.strip().str.lower() if 'Ud' in hoja.columns else '',
+        'escenario': hoja['Escenario fin de vida'].map(normalizar_texto) if 'Escenario fin de vida' in hoja.columns else '',
+        'GWP': pd.to_numeric(hoja[col_gwp], errors='coerce'),
+    })
+    materiales = materiales[hoja['Ud'].notna() & materiales['GWP'].notna()] if 'Ud' in hoja.columns else materiales.dropna(subset=['GWP'])
+
+    fin_de_vida = pd.DataFrame(columns=['escenario', 'etapa', 'GWP'])
+    if 'C-D' in hojas_bbdd:
+        cd = _reparar_encabezado(hojas_bbdd['C-D'], 'Etapa')
+        col_gwp_cd = _columna_gwp(cd)
+        if 'Etapa' in cd.columns and col_gwp_cd is not None:
+            fin_de_vida = pd.DataFrame({
+                'escenario': cd.iloc[:, 1].map(normalizar_texto),
+                'etapa': cd['Etapa'].astype(str).str.strip(),
+                'GWP': pd.to_numeric(cd[col_gwp_cd], errors='coerce'),
+            }).dropna(subset=['GWP'])
+            fin_de_vida = fin_de_vida.groupby(['escenario', 'etapa'], as_index=False)['GWP'].mean()
+
+    factor_a4 = _factor_transporte(hojas_bbdd) * float(distancia_km or 0)
+    masa_por_unidad = materiales['Ud'].map({'kg': 0.001, 't': 1.0}).fillna(0.0)
+
+    filas = []
+    for etapa in etapas:
+        if etapa == 'A1-3':
+            gwp = materiales['GWP']
+        elif etapa == 'A4':
+            gwp = masa_por_unidad * factor_a4
+        elif etapa in ('C1', 'C2', 'C3', 'C4', 'D'):
+            por_escenario = fin_de_vida[fin_de_vida['etapa'] == etapa].set_index('escenario')['GWP']
+            gwp = materiales['escenario'].map(por_escenario).fillna(0.0)
+        else:
+            gwp = pd.Series(0.0, index=materiales.index)
+        filas.append(pd.DataFrame({'Nombre': materiales['Nombre'].to_numpy(), 'etapa': etapa, 'GWP': gwp.to_numpy(dtype=float)}))
+    return filas
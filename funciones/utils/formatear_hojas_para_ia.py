@@ -1,4 +1,10 @@
-import pandas as pd
+from funciones.utils.emparejar_materiales import construir_indice_materiales, normalizar_texto, posiciones_similares
+from funciones.utils.instrumentacion import instrumentar
+
+# Hojas con pocas filas (p. ej. transportes A4-A5) se envían siempre completas
+MAX_FILAS_HOJA_COMPLETA = 10
+# Un valor solo enlaza filas de otra hoja (p. ej. escenario de fin de vida → hoja C-D) si aparece en pocas filas
+MAX_FILAS_ENLACE = 10
 
 def formatear_hojas_para_ia(hojas_dict, max_filas_por_hoja=25):
     """
@@ -27,3 +33,111 @@ def formatear_hojas_para_ia(hojas_dict, max_filas_por_hoja=25):
             partes.append(f"### Hoja: {nombre_hoja} (⚠️ Error al procesar: {e})")
 
     return "\n\n".join(partes)
+
+def _texto_fila(fila):
+    return " ".join(v.strip() for v in fila if isinstance(v, str) and v.strip())
+
+def _filas_encabezado(df):
+    # Hojas cuyo encabezado real está en los datos (columnas sin nombre): se conservan las filas hasta él
+    if df.columns.isna().sum() <= df.shape[1] // 2:
+        return []
+    for i in range(min(5, len(df))):
+        if sum(isinstance(v, str) for v in df.iloc[i]) >= 3:
+            return list(range(i + 1))
+    return []
+
+def markdown_por_fila(hojas_dict):
+    """
+    Markdown de cada hoja completa partido en líneas: {hoja: {"encabezado": [...], "filas": [...]}},
+    con una línea por fila, para componer tablas con cualquier subconjunto de filas sin volver a renderizar.
+    """
+    markdown = {}
+    for nombre_hoja, df in hojas_dict.items():
+        if df.empty or df.shape[1] < 2:
+            continue
+        lineas = df.dropna(axis=1, how="all").to_markdown(index=False).split("\n")
+        # Una celda con saltos de línea rompería la correspondencia línea ↔ fila
+        if len(lineas) == len(df) + 2:
+            markdown[nombre_hoja] = {"encabezado": lineas[:2], "filas": lineas[2:]}
+    return markdown
+
+def indexar_hojas_para_ia(hojas_dict, markdown=None):
+    """
+    Índice local de las filas de todas las hojas (texto de sus celdas) para seleccionar contexto relevante.
+    Se calcula una vez y se reutiliza en todas las consultas. markdown: resultado de markdown_por_fila
+    (opcional) para no renderizar las tablas en cada consulta.
+    También guarda los textos normalizados de cada fila ("celdas") y, por hoja, las filas en que aparece
+    cada texto ("filas_por_valor"), para seguir los enlaces entre hojas sin normalizar celdas en cada consulta.
+    """
+    filas, textos = [], []
+    celdas, filas_por_valor = {}, {}
+    for nombre_hoja, df in hojas_dict.items():
+        if df.empty or df.shape[1] < 2:
+            continue
+        celdas[nombre_hoja] = []
+        por_valor = filas_por_valor[nombre_hoja] = {}
+        for pos, fila in enumerate(df.itertuples(index=False, name=None)):
+            normalizados = tuple(dict.fromkeys(normalizar_texto(v) for v in fila if isinstance(v, str) and v.strip()))
+            celdas[nombre_hoja].append(normalizados)
+            for valor in normalizados:
+                por_valor.setdefault(valor, []).append(pos)
+            texto = _texto_fila(fila)
+            if texto:
+                filas.append((nombre_hoja, pos))
+                textos.append(texto)
+    return {
+        "filas": filas, "indice": construir_indice_materiales(textos), "markdown": markdown or {},
+        "celdas": celdas, "filas_por_valor": filas_por_valor,
+    }
+
+@instrumentar(categoria="ia")
+def contexto_relevante_para_ia(hojas_dict, consultas, indice=None, n_por_consulta=3, puntuacion_minima=0.15):
+    """
+    Igual que formatear_hojas_para_ia, pero solo con las filas relacionadas con las consultas
+    (materiales de un bloque, pregunta del chat...): las n_por_consulta filas más parecidas a cada
+    consulta, las filas de otras hojas que comparten con ellas un valor poco frecuente (escenario de
+    fin de vida), los encabezados y las hojas pequeñas completas.
+    """
+    if indice is None:
+        indice = indexar_hojas_para_ia(hojas_dict)
+
+    seleccion = {nombre_hoja: set() for nombre_hoja in hojas_dict}
+    for consulta in dict.fromkeys(str(c) for c in consultas if isinstance(c, str) and c.strip()):
+        for i, puntuacion in posiciones_similares(consulta, indice["indice"], n_por_consulta):
+            if puntuacion >= puntuacion_minima:
+                nombre_hoja, pos = indice["filas"][i]
+                seleccion[nombre_hoja].add(pos)
+
+    # Valores de las filas elegidas que enlazan con otras hojas
+    enlaces = {
+        valor
+        for nombre_hoja, posiciones in seleccion.items()
+        for pos in posiciones
+        for valor in indice["celdas"][nombre_hoja][pos]
+    }
+
+    partes = []
+    for nombre_hoja, df in hojas_dict.items():
+        if df.empty or df.shape[1] < 2:
+            continue
+        if len(df) <= MAX_FILAS_HOJA_COMPLETA:
+            posiciones = set(range(len(df)))
+        else:
+            por_valor = indice["filas_por_valor"][nombre_hoja]
+            posiciones = set(seleccion[nombre_hoja])
+            for valor in enlaces:
+                if 0 < len(por_valor.get(valor, ())) <= MAX_FILAS_ENLACE:
+                    posiciones.update(por_valor[valor])
+            if not posiciones:
+                continue
+            posiciones |= set(_filas_encabezado(df))
+
+        titulo = f"### Hoja: {nombre_hoja} ({len(posiciones)} filas relevantes de {len(df)})"
+        md = indice.get("markdown", {}).get(nombre_hoja)
+        if md:
+            partes.append("\n".join([titulo] + md["encabezado"] + [md["filas"][p] for p in sorted(posiciones)]))
+        else:
+            df_chunk = df.iloc[sorted(posiciones)].dropna(axis=1, how="all")
+            partes.append(f"{titulo}\n{df_chunk.to_markdown(index=False)}")
+
+    return "\n\n".join(partes)
@@ -1,15 +1,75 @@
-import streamlit as st
-import google.generativeai as genai
+import os
+import sys
+import time
+from types import SimpleNamespace
 
-def cargar_modelo():
+from funciones.utils.cache_respuestas import con_cache
+from funciones.utils.instrumentacion import registrar_llamada_ia
+
+MODELO_GEMINI = "gemini-1.5-pro-latest"
+
+# Fuentes de configuración consultadas en orden: función(nombre) -> valor o None
+_fuentes_configuracion = []
+
+def registrar_fuente_configuracion(fuente):
+    """
+    Añade una fuente de configuración (p. ej. lambda nombre: st.secrets.get(nombre) en la app,
+    o un gestor de secretos en un servidor). Las fuentes registradas se consultan antes que
+    las variables de entorno.
     """
-    Carga el modelo generativo de Gemini usando la clave en st.secrets.
+    if fuente not in _fuentes_configuracion:
+        _fuentes_configuracion.append(fuente)
+
+def _secrets_streamlit(nombre):
+    # Solo si streamlit ya está cargado: un proceso por lotes no debe importarlo
+    if "streamlit" not in sys.modules:
+        return None
+    try:
+        return sys.modules["streamlit"].secrets.get(nombre)
+    except Exception:
+        return None
+
+def obtener_configuracion(nombre):
     """
-    api_key = st.secrets.get("GOOGLE_API_KEY")
+    Valor de configuración: fuentes registradas, variable de entorno y secrets de Streamlit, en ese orden.
+    """
+    for fuente in [*_fuentes_configuracion, os.environ.get, _secrets_streamlit]:
+        valor = fuente(nombre)
+        if valor:
+            return valor
+    return None
+
+def _con_medicion(modelo):
+    # Cada llamada suma a los contadores de la IA: llamadas, aciertos de caché, bytes, tokens y tiempo
+    def generate_content(prompt, **kwargs):
+        inicio = time.perf_counter()
+        respuesta = modelo.generate_content(prompt, **kwargs)
+        texto = respuesta.text if hasattr(respuesta, "text") else str(respuesta)
+        registrar_llamada_ia(prompt, texto, time.perf_counter() - inicio,
+                             desde_cache=getattr(respuesta, "desde_cache", False),
+                             uso=getattr(respuesta, "usage_metadata", None))
+        return respuesta
+
+    return SimpleNamespace(generate_content=generate_content, model_name=getattr(modelo, "model_name", None), modelo=modelo)
+
+def cargar_modelo(usar_cache=True, api_key=None):
+    """
+    Carga el modelo generativo de Gemini con la clave GOOGLE_API_KEY de la configuración (ver obtener_configuracion).
+    Con usar_cache=True las respuestas se guardan en disco y un prompt repetido no vuelve a enviarse.
+    Con IA_BACKEND=falso se usa un modelo simulado sin conexión (latencia por llamada en IA_LATENCIA_FALSA).
+    """
+    if (obtener_configuracion("IA_BACKEND") or "").lower() == "falso":
+        from funciones.utils.ia_falsa import crear_modelo_falso
+        return _con_medicion(crear_modelo_falso(latencia=float(obtener_configuracion("IA_LATENCIA_FALSA") or 0)))
+
+    api_key = api_key or obtener_configuracion("GOOGLE_API_KEY")
     if not api_key:
-        raise ValueError("❌ No se encontró GOOGLE_API_KEY en los secrets de Streamlit.")
-    
+        raise ValueError("❌ No se encontró GOOGLE_API_KEY (secrets de Streamlit, variable de entorno o fuente registrada).")
+
+    # Importación diferida: google.generativeai tarda en cargar y solo hace falta al usar la IA
+    import google.generativeai as genai
+
     genai.configure(api_key=api_key)
-    modelo = genai.GenerativeModel("gemini-1.5-pro-latest")
+    modelo = genai.GenerativeModel(MODELO_GEMINI)
 
-    return modelo
+    return _con_medicion(con_cache(modelo) if usar_cache else modelo)
@@ -0,0 +1,147 @@
+import hashlib
+import json
+import re
+import threading
+import time
+from types import SimpleNamespace
+
+# Modelo de IA simulado para trabajar sin conexión (benchmarks, pruebas de la app con IA_BACKEND=falso).
+# Responde con el mismo formato que se pide en cada prompt de la app, con valores deterministas.
+NOMBRE_MODELO_FALSO = "falso"
+
+def _leer_tabla(texto):
+    """
+    Primera tabla Markdown de texto → (encabezado, filas). Se ignoran las líneas de alineación.
+    """
+    encabezado, filas = None, []
+    for linea in texto.splitlines():
+        if "|" not in linea:
+            if encabezado is not None:
+                break
+            continue
+        if re.fullmatch(r"[:\-\s\|]+", linea):
+            continue
+        celdas = [c.strip() for c in linea.strip().strip("|").split("|")]
+        if encabezado is None:
+            encabezado = celdas
+        else:
+            filas.append(celdas)
+    return encabezado or [], filas
+
+def _columna(encabezado, *claves, excluir=()):
+    for i, nombre in enumerate(encabezado):
+        nombre_l = nombre.lower()
+        if any(c in nombre_l for c in claves) and not any(e in nombre_l for e in excluir):
+            return i
+    return None
+
+def _columna_id(encabezado):
+    # "Cantidad" también contiene "id": primero se busca la columna con nombre exacto
+    exacta = next((i for i, nombre in enumerate(encabezado) if nombre.lower() in ("id", "globalid", "guid")), None)
+    return exacta if exacta is not None else _columna(encabezado, "id", excluir=("unidad", "cantidad"))
+
+def _numero(valor):
+    try:
+        return float(str(valor).replace(",", "."))
+    except ValueError:
+        return 0.0
+
+def _gwp_simulado(material):
+    # Factor estable por material, entre 100 y 500 kg CO₂ eq por unidad
+    return 100 + int(hashlib.md5(str(material).encode("utf-8")).hexdigest(), 16) % 400
+
+def _tabla_markdown(encabezado, filas):
+    lineas = ["| " + " | ".join(encabezado) + " |", "|" + "|".join("---" for _ in encabezado) + "|"]
+    lineas += ["| " + " | ".join(str(c) for c in fila) + " |" for fila in filas]
+    return "\n".join(lineas)
+
+def _detectar_columnas(prompt):
+    columnas = re.findall(r"^- ([^:\n]+):", prompt.split("Propiedades detectadas:", 1)[-1], flags=re.M)
+    def primera(*claves):
+        return next((c for c in columnas if any(k in c.lower() for k in claves)), "")
+    return "\n".join([
+        f"material_col: {primera('material')}",
+        f"cantidad_col: {primera('volum', 'cantidad')}",
+        f"unidad_col: {primera('unidad')}",
+        f"guid_col: {'ID' if 'ID' in columnas else primera('globalid', 'guid')}",
+    ])
+
+def _normalizar_materiales(prompt):
+    filas = []
+    for material, candidatos in re.findall(r"^- (.+) \(candidatos: ([^\n]*)\)$", prompt, flags=re.M):
+        primero = candidatos.split(";")[0].strip()
+        filas.append(f"{material} | {primero or 'NO ENCONTRADO'}")
+    return "\n".join(["Material_IFC | Material_Normalizado", *filas])
+
+def _huella_por_bloque(prompt):
+    encabezado, filas = _leer_tabla(prompt.split("### IFC:", 1)[1])
+    i_id = _columna_id(encabezado)
+    i_material = _columna(encabezado, "material", excluir=("normalizado",))
+    i_normalizado = _columna(encabezado, "material_normalizado")
+    i_cantidad = _columna(encabezado, "cantidad")
+    salida = []
+    for fila in filas:
+        material = fila[i_material] if i_material is not None else ""
+        if i_normalizado is not None and fila[i_normalizado] != "NO ENCONTRADO":
+            material = fila[i_normalizado]
+        cantidad = _numero(fila[i_cantidad]) if i_cantidad is not None else 0.0
+        gwp = _gwp_simulado(material)
+        salida.append([fila[i_id] if i_id is not None else "", material, cantidad, gwp, round(cantidad * gwp, 3)])
+    return _tabla_markdown(["ID", "Material", "Cantidad [m³]", "GWP A1-3 [kg CO₂ eq/m³]", "Total [kg CO₂ eq]"], salida)
+
+def _huella_por_bloque_json(prompt, etapas):
+    # Mismos valores que _huella_por_bloque, como array JSON (salida estructurada)
+    _, filas = _leer_tabla(_huella_por_bloque(prompt))
+    return json.dumps([
+        {"ID": id_elemento, "Material": material, "Cantidad": float(cantidad),
+         "GWP": {etapa: (float(gwp) if j == 0 else 0.0) for j, etapa in enumerate(etapas)},
+         "Total": float(total), "Unidad": "kg CO₂ eq"}
+        for id_elemento, material, cantidad, gwp, total in filas
+    ], ensure_ascii=False)
+
+def _normalizar_tabla_huella(prompt):
+    encabezado, filas = _leer_tabla(prompt.split("Tengo esta tabla con huellas de carbono por elemento IFC:", 1)[1])
+    i_id = _columna_id(encabezado)
+    i_total = _columna(encabezado, "total")
+    salida = [[fila[i_id], _numero(fila[i_total]) if i_total is not None else 0.0, "kg CO₂ eq"]
+              for fila in filas if i_id is not None and i_id < len(fila)]
+    return _tabla_markdown(["ID", "Total", "Unidad"], salida)
+
+def responder(prompt, generation_config=None):
+    """
+    Respuesta simulada según el tipo de prompt de la app.
+    Con generation_config de salida JSON (ver salida_estructurada.configuracion_json) los bloques
+    de huella se responden en JSON con las etapas del esquema.
+    """
+    config = generation_config or {}
+    if config.get("response_mime_type") == "application/json" and "### IFC:" in prompt:
+        esquema = config.get("response_schema") or {}
+        etapas = list(esquema.get("items", {}).get("properties", {}).get("GWP", {}).get("properties", {}))
+        return _huella_por_bloque_json(prompt, etapas or ["A1-3"])
+    if "material_col" in prompt and "Propiedades detectadas:" in prompt:
+        return _detectar_columnas(prompt)
+    if "Material_IFC | Material_Normalizado" in prompt:
+        return _normalizar_materiales(prompt)
+    if "### IFC:" in prompt:
+        return _huella_por_bloque(prompt)
+    if "Tengo esta tabla con huellas de carbono por elemento IFC:" in prompt:
+        return _normalizar_tabla_huella(prompt)
+    return "Respuesta simulada: los materiales con mayor huella concentran la mayor parte del impacto."
+
+def crear_modelo_falso(latencia=0.0):
+    """
+    Modelo compatible con generate_content(prompt) -> objeto con .text. latencia: segundos de espera por
+    llamada, para simular la red. contador["llamadas"] acumula las llamadas recibidas (también desde
+    varios hilos, p. ej. generar_en_paralelo).
+    """
+    contador = {"llamadas": 0}
+    cerrojo = threading.Lock()
+
+    def generate_content(prompt, **kwargs):
+        with cerrojo:
+            contador["llamadas"] += 1
+        if latencia:
+            time.sleep(latencia)
+        return SimpleNamespace(text=responder(str(prompt), kwargs.get("generation_config")))
+
+    return SimpleNamespace(generate_content=generate_content, model_name=NOMBRE_MODELO_FALSO, contador=contador)
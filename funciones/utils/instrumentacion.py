@@ -0,0 +1,238 @@
+import functools
+import json
+import os
+import threading
+import time
+import tracemalloc
+from collections import deque
+from contextlib import contextmanager
+
+# Registro de tiempos por etapa, contadores (llamadas a la IA, bytes, tokens) y memoria del proceso.
+# Es común a todo el proceso: en la app lo comparten todas las sesiones y los trabajos en segundo plano.
+# INSTRUMENTACION=0 lo desactiva; INSTRUMENTACION_TRACEMALLOC=1 registra además la memoria de Python por etapa.
+ACTIVA = os.environ.get("INSTRUMENTACION", "1") != "0"
+MAX_EVENTOS = 10000
+
+_eventos = deque(maxlen=MAX_EVENTOS)
+_contadores = {}
+_cerrojo = threading.Lock()
+_inicio_registro = time.time()
+
+if os.environ.get("INSTRUMENTACION_TRACEMALLOC") == "1":
+    tracemalloc.start()
+
+def memoria_proceso():
+    """
+    {"rss_mb", "pico_rss_mb"} del proceso actual (Linux: /proc/self/status; otros Unix: solo el pico).
+    """
+    memoria = {}
+    try:
+        with open("/proc/self/status", encoding="ascii") as f:
+            for linea in f:
+                if linea.startswith("VmRSS:"):
+                    memoria["rss_mb"] = round(int(linea.split()[1]) / 1024, 1)
+                elif linea.startswith("VmHWM:"):
+                    memoria["pico_rss_mb"] = round(int(linea.split()[1]) / 1024, 1)
+    except OSError:
+        try:
+            import resource
+            memoria["pico_rss_mb"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+        except ImportError:
+            pass
+    return memoria
+
+def _registrar_evento(evento):
+    with _cerrojo:
+        _eventos.append(evento)
+
+@contextmanager
+def medir(nombre, categoria="etapa", **datos):
+    """
+    Mide el bloque como una etapa: duración, hilo, memoria al terminar y, con tracemalloc activo,
+    memoria de Python asignada durante el bloque. datos se guarda con el evento (p. ej. elementos=...).
+    """
+    if not ACTIVA:
+        yield
+        return
+    traza = tracemalloc.is_tracing()
+    memoria_inicial = tracemalloc.get_traced_memory()[0] if traza else None
+    inicio = time.time()
+    inicio_reloj = time.perf_counter()
+    error = None
+    try:
+        yield
+    except BaseException as e:
+        error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        evento = {
+            "nombre": nombre,
+            "categoria": categoria,
+            "inicio": inicio,
+            "duracion": time.perf_counter() - inicio_reloj,
+            "proceso": os.getpid(),
+            "hilo": threading.current_thread().name,
+            **memoria_proceso(),
+        }
+        if traza:
+            actual, pico = tracemalloc.get_traced_memory()
+            evento["python_mb"] = round((actual - memoria_inicial) / 1024 ** 2, 2)
+            evento["python_pico_mb"] = round(pico / 1024 ** 2, 2)
+        if error:
+            evento["error"] = error
+        if datos:
+            evento["datos"] = datos
+        _registrar_evento(evento)
+
+def instrumentar(nombre=None, categoria="etapa"):
+    """
+    Decorador: cada llamada a la función se registra como una etapa (por defecto con el nombre de la función).
+    """
+    def decorador(funcion):
+        etiqueta = nombre or funcion.__name__
+
+        @functools.wraps(funcion)
+        def envoltura(*args, **kwargs):
+            with medir(etiqueta, categoria):
+                return funcion(*args, **kwargs)
+        return envoltura
+    return decorador
+
+def contar(nombre, cantidad=1):
+    if not ACTIVA:
+        return
+    with _cerrojo:
+        _contadores[nombre] = _contadores.get(nombre, 0) + cantidad
+
+def registrar_llamada_ia(prompt, texto, segundos, desde_cache=False, uso=None):
+    """
+    Contadores de la IA: llamadas (y cuántas se sirvieron de la caché), bytes enviados y recibidos y tokens.
+    uso: usage_metadata de Gemini si existe; si no, los tokens se estiman como bytes / 4.
+    """
+    if not ACTIVA:
+        return
+    bytes_prompt = len(str(prompt).encode("utf-8"))
+    bytes_respuesta = len(str(texto).encode("utf-8"))
+    tokens_prompt = getattr(uso, "prompt_token_count", None)
+    tokens_respuesta = getattr(uso, "candidates_token_count", None)
+    estimados = tokens_prompt is None
+    if estimados:
+        tokens_prompt, tokens_respuesta = bytes_prompt // 4, bytes_respuesta // 4
+
+    contar("ia_llamadas")
+    if desde_cache:
+        contar("ia_llamadas_cache")
+    else:
+        contar("ia_bytes_prompt", bytes_prompt)
+        contar("ia_bytes_respuesta", bytes_respuesta)
+        contar("ia_tokens_prompt_estimados" if estimados else "ia_tokens_prompt", tokens_prompt)
+        contar("ia_tokens_respuesta_estimados" if estimados else "ia_tokens_respuesta", tokens_respuesta)
+    contar("ia_segundos", segundos)
+    _registrar_evento({
+        "nombre": "llamada_ia",
+        "categoria": "ia",
+        "inicio": time.time() - segundos,
+        "duracion": segundos,
+        "proceso": os.getpid(),
+        "hilo": threading.current_thread().name,
+        "datos": {"bytes_prompt": bytes_prompt, "bytes_respuesta": bytes_respuesta, "desde_cache": desde_cache},
+    })
+
+def eventos():
+    with _cerrojo:
+        return list(_eventos)
+
+def contadores():
+    with _cerrojo:
+        return dict(_contadores)
+
+def incorporar(registro):
+    """
+    Añade eventos y contadores de otro proceso (p. ej. un trabajador del cálculo por lotes), con el formato de exportar_json.
+    """
+    with _cerrojo:
+        _eventos.extend(registro.get("eventos", []))
+        for nombre, valor in registro.get("contadores", {}).items():
+            _contadores[nombre] = _contadores.get(nombre, 0) + valor
+
+def reiniciar():
+    global _inicio_registro
+    with _cerrojo:
+        _eventos.clear()
+        _contadores.clear()
+        _inicio_registro = time.time()
+
+def resumen_etapas():
+    """
+    Una fila por etapa: llamadas, tiempo total, medio y máximo (s) y memoria máxima del proceso al terminarla.
+    Ordenado por tiempo total.
+    """
+    resumen = {}
+    for evento in eventos():
+        fila = resumen.setdefault(evento["nombre"], {
+            "etapa": evento["nombre"], "categoria": evento["categoria"], "llamadas": 0,
+            "total_s": 0.0, "max_s": 0.0, "rss_max_mb": None,
+        })
+        fila["llamadas"] += 1
+        fila["total_s"] += evento["duracion"]
+        fila["max_s"] = max(fila["max_s"], evento["duracion"])
+        if evento.get("rss_mb") is not None:
+            fila["rss_max_mb"] = max(fila["rss_max_mb"] or 0, evento["rss_mb"])
+    for fila in resumen.values():
+        fila["media_s"] = round(fila["total_s"] / fila["llamadas"], 4)
+        fila["total_s"] = round(fila["total_s"], 4)
+        fila["max_s"] = round(fila["max_s"], 4)
+    return sorted(resumen.values(), key=lambda f: f["total_s"], reverse=True)
+
+def instantanea_tracemalloc(n=15):
+    """
+    Las n líneas de código con más memoria de Python asignada ahora mismo (vacío si tracemalloc no está activo).
+    """
+    if not tracemalloc.is_tracing():
+        return []
+    estadisticas = tracemalloc.take_snapshot().statistics("lineno")[:n]
+    return [{"linea": str(e.traceback[0]), "mb": round(e.size / 1024 ** 2, 2), "bloques": e.count} for e in estadisticas]
+
+def exportar_json(ruta=None):
+    """
+    Registro completo (eventos, contadores, memoria actual y resumen por etapa). Si se da ruta, se guarda en ella.
+    """
+    registro = {
+        "inicio_registro": _inicio_registro,
+        "memoria": memoria_proceso(),
+        "contadores": contadores(),
+        "resumen": resumen_etapas(),
+        "eventos": eventos(),
+    }
+    if ruta:
+        with open(ruta, "w", encoding="utf-8") as f:
+            json.dump(registro, f, ensure_ascii=False, indent=2, default=str)
+    return registro
+
+def exportar_chrome_trace(ruta=None):
+    """
+    Eventos en formato Trace Event de Chrome (chrome://tracing, Perfetto): una barra por etapa
+    por proceso e hilo, más una serie con la memoria RSS. Si se da ruta, se guarda en ella.
+    """
+    lista = eventos()
+    origen = min((e["inicio"] for e in lista), default=_inicio_registro)
+    traza = []
+    hilos = {}
+    for e in lista:
+        clave_hilo = (e["proceso"], e["hilo"])
+        if clave_hilo not in hilos:
+            # El formato espera tid numérico; el nombre del hilo va en un evento de metadatos
+            hilos[clave_hilo] = len(hilos) + 1
+            traza.append({"name": "thread_name", "ph": "M", "pid": e["proceso"], "tid": hilos[clave_hilo], "args": {"name": e["hilo"]}})
+        ts = (e["inicio"] - origen) * 1e6
+        args = {k: v for k, v in e.items() if k not in ("nombre", "categoria", "inicio", "duracion", "proceso", "hilo")}
+        traza.append({"name": e["nombre"], "cat": e["categoria"], "ph": "X", "ts": ts, "dur": e["duracion"] * 1e6,
+                      "pid": e["proceso"], "tid": hilos[clave_hilo], "args": args})
+        if e.get("rss_mb") is not None:
+            traza.append({"name": "memoria", "ph": "C", "ts": ts + e["duracion"] * 1e6, "pid": e["proceso"],
+                          "args": {"rss_mb": e["rss_mb"]}})
+    documento = {"traceEvents": traza, "displayTimeUnit": "ms", "otherData": {"contadores": contadores()}}
+    if ruta:
+        with open(ruta, "w", encoding="utf-8") as f:
+            json.dump(documento, f, ensure_ascii=False, default=str)
+    return documento
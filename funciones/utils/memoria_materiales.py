@@ -0,0 +1,106 @@
+import os
+import sqlite3
+from contextlib import closing
+from datetime import datetime, timezone
+
+from funciones.utils.emparejar_materiales import normalizar_texto
+
+# Memoria persistente material IFC → material de la base DIGITAEC, compartida entre proyectos
+RUTA_MEMORIA = os.path.join("cache", "memoria_materiales.sqlite")
+
+# Prioridad de cada fuente: una corrección manual nunca se sobrescribe con un resultado automático
+PRIORIDAD_FUENTE = {"ia": 1, "local": 2, "manual": 3}
+
+def _conectar(ruta):
+    carpeta = os.path.dirname(ruta)
+    if carpeta:
+        os.makedirs(carpeta, exist_ok=True)
+    con = sqlite3.connect(ruta, timeout=30)
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS mapeos (
+            clave TEXT PRIMARY KEY,
+            material_ifc TEXT NOT NULL,
+            material_normalizado TEXT NOT NULL,
+            fuente TEXT NOT NULL,
+            confianza REAL,
+            prioridad INTEGER NOT NULL,
+            fecha TEXT NOT NULL,
+            usos INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    return con
+
+def consultar_mapeos(materiales, ruta=RUTA_MEMORIA):
+    """
+    Devuelve {material: {"Material_Normalizado", "Fuente", "Confianza", "Fecha"}} para los materiales
+    ya conocidos. La búsqueda ignora mayúsculas, tildes y signos ("HA-30/B" == "ha 30 b"), así que
+    todas las variantes de un mismo material reciben su mapeo.
+    """
+    claves = {}
+    for m in materiales:
+        claves.setdefault(normalizar_texto(m), []).append(m)
+    if not claves or not os.path.isfile(ruta):
+        return {}
+
+    encontrados = {}
+    with closing(_conectar(ruta)) as con, con:
+        lista = list(claves)
+        for i in range(0, len(lista), 500):
+            bloque = lista[i:i + 500]
+            filas = con.execute(
+                f"SELECT clave, material_normalizado, fuente, confianza, fecha FROM mapeos WHERE clave IN ({','.join('?' * len(bloque))})",
+                bloque,
+            ).fetchall()
+            for clave, normalizado, fuente, confianza, fecha in filas:
+                for material in claves[clave]:
+                    encontrados[material] = {
+                        "Material_Normalizado": normalizado,
+                        "Fuente": fuente,
+                        "Confianza": confianza,
+                        "Fecha": fecha,
+                    }
+            con.executemany("UPDATE mapeos SET usos = usos + 1 WHERE clave = ?", [(f[0],) for f in filas])
+    return encontrados
+
+def guardar_mapeos(mapeos, fuente, ruta=RUTA_MEMORIA):
+    """
+    Guarda mapeos {material: material_normalizado} o {material: (material_normalizado, confianza)}.
+    Los "NO ENCONTRADO" no se guardan, y un mapeo existente solo se sustituye por otro
+    de una fuente de igual o mayor prioridad (manual > local > ia).
+    """
+    if fuente not in PRIORIDAD_FUENTE:
+        raise ValueError(f"Fuente no válida: {fuente}. Usa una de {list(PRIORIDAD_FUENTE)}")
+
+    fecha = datetime.now(timezone.utc).isoformat(timespec="seconds")
+    filas = []
+    for material, valor in mapeos.items():
+        normalizado, confianza = valor if isinstance(valor, tuple) else (valor, None)
+        if not normalizado or normalizado == "NO ENCONTRADO":
+            continue
+        filas.append((normalizar_texto(material), str(material), str(normalizado), fuente, confianza, PRIORIDAD_FUENTE[fuente], fecha))
+
+    if not filas:
+        return
+
+    with closing(_conectar(ruta)) as con, con:
+        con.executemany("""
+            INSERT INTO mapeos (clave, material_ifc, material_normalizado, fuente, confianza, prioridad, fecha)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(clave) DO UPDATE SET
+                material_ifc = excluded.material_ifc,
+                material_normalizado = excluded.material_normalizado,
+                fuente = excluded.fuente,
+                confianza = excluded.confianza,
+                prioridad = excluded.prioridad,
+                fecha = excluded.fecha
+            WHERE excluded.prioridad >= mapeos.prioridad
+        """, filas)
+
+def olvidar_mapeo(material, ruta=RUTA_MEMORIA):
+    """
+    Elimina un mapeo (por ejemplo, si se detecta que era incorrecto).
+    """
+    if not os.path.isfile(ruta):
+        return
+    with closing(_conectar(ruta)) as con, con:
+        con.execute("DELETE FROM mapeos WHERE clave = ?", (normalizar_texto(material),))
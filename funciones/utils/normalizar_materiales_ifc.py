@@ -1,19 +1,57 @@
 import pandas as pd
 from io import StringIO
-from funciones.utils.ia import cargar_modelo
+from funciones.utils.emparejar_materiales import (
+    UMBRAL_CONFIANZA, nombres_base_datos, construir_indice_materiales, emparejar_materiales
+)
+from funciones.utils.instrumentacion import instrumentar
+from funciones.utils.memoria_materiales import RUTA_MEMORIA, consultar_mapeos, guardar_mapeos
 
-def normalizar_materiales_con_ia(df_ifc, hojas_bbdd):
+@instrumentar(categoria="calculo")
+def normalizar_materiales_con_ia(df_ifc, hojas_bbdd, umbral_confianza=UMBRAL_CONFIANZA, usar_ia=True, ruta_memoria=RUTA_MEMORIA):
     """
-    Usa IA para mapear materiales del IFC a nombres equivalentes en la base de sostenibilidad.
+    Mapea materiales del IFC a nombres equivalentes en la base de sostenibilidad.
+    Orden de consulta: memoria persistente de mapeos (si ruta_memoria no es None), emparejamiento
+    local (n-gramas + códigos normativos) y, solo para lo que quede por debajo de
+    umbral_confianza, la IA (si usar_ia=True). Los nuevos mapeos se guardan en la memoria.
     Añade una nueva columna 'Material_Normalizado'.
     """
-    modelo = cargar_modelo()
-
     materiales_unicos = df_ifc['Material'].dropna().unique().tolist()
-    nombres_bbdd = set()
-    for hoja in hojas_bbdd.values():
-        if 'Nombre' in hoja.columns:
-            nombres_bbdd.update(hoja['Nombre'].dropna().astype(str).str.strip())
+    nombres_bbdd = nombres_base_datos(hojas_bbdd)
+
+    mapeo = {}
+    if ruta_memoria:
+        # Se descartan mapeos a nombres que ya no existen en la versión actual de la base
+        validos = set(nombres_bbdd)
+        conocidos = consultar_mapeos(materiales_unicos, ruta=ruta_memoria)
+        mapeo.update({m: r['Material_Normalizado'] for m, r in conocidos.items() if r['Material_Normalizado'] in validos})
+
+    pendientes = [m for m in materiales_unicos if m not in mapeo]
+    if pendientes:
+        indice = construir_indice_materiales(nombres_bbdd)
+        emparejados = emparejar_materiales(pendientes, indice, umbral=umbral_confianza)
+        locales = {m: (r['Material_Normalizado'], r['Confianza']) for m, r in emparejados.items() if r['Material_Normalizado'] != "NO ENCONTRADO"}
+        mapeo.update({m: normalizado for m, (normalizado, _) in locales.items()})
+        if ruta_memoria:
+            guardar_mapeos(locales, fuente="local", ruta=ruta_memoria)
+
+        pendientes = [m for m in pendientes if m not in mapeo]
+        if pendientes and usar_ia:
+            respuesta_ia = _normalizar_pendientes_con_ia(pendientes, nombres_bbdd, emparejados)
+            mapeo.update(respuesta_ia)
+            if ruta_memoria:
+                guardar_mapeos(respuesta_ia, fuente="ia", ruta=ruta_memoria)
+
+    df_ifc['Material_Normalizado'] = df_ifc['Material'].map(mapeo).fillna("NO ENCONTRADO")
+    return df_ifc
+
+def _normalizar_pendientes_con_ia(materiales_unicos, nombres_bbdd, emparejados):
+    """
+    Consulta a la IA solo los materiales que el emparejamiento local no resolvió,
+    indicando los candidatos locales como pista.
+    """
+    # Importación diferida: sin IA (modo local, cálculo por lotes) no se carga streamlit ni Gemini
+    from funciones.utils.ia import cargar_modelo
+    modelo = cargar_modelo()
 
     ejemplos = """
 Ejemplos comunes:
@@ -31,8 +69,8 @@ Tu objetivo es identificar el material que realmente representa cada uno de esto
 
 {ejemplos}
 
-### Lista de materiales del modelo IFC:
-{chr(10).join('- ' + m for m in materiales_unicos)}
+### Lista de materiales del modelo IFC (con candidatos locales sugeridos):
+{chr(10).join('- ' + m + ' (candidatos: ' + '; '.join(n for n, _ in emparejados[m]['Candidatos'][:3]) + ')' for m in materiales_unicos)}
 
 ### Lista de nombres válidos en la base de datos:
 {chr(10).join('- ' + n for n in sorted(nombres_bbdd))}
@@ -52,10 +90,7 @@ Material_IFC | Material_Normalizado
         tabla.columns = [col.strip() for col in tabla.columns]
         tabla['Material_IFC'] = tabla['Material_IFC'].str.strip()
         tabla['Material_Normalizado'] = tabla['Material_Normalizado'].str.strip()
-        mapeo = dict(zip(tabla['Material_IFC'], tabla['Material_Normalizado']))
-        df_ifc['Material_Normalizado'] = df_ifc['Material'].map(mapeo).fillna("NO ENCONTRADO")
+        return dict(zip(tabla['Material_IFC'], tabla['Material_Normalizado']))
     except Exception as e:
         print("❌ Error interpretando la tabla de la IA:", e)
-        df_ifc['Material_Normalizado'] = "NO ENCONTRADO"
-
-    return df_ifc
+        return {}
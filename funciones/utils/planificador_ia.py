@@ -0,0 +1,115 @@
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from funciones.utils.instrumentacion import instrumentar
+
+# Errores que se reintentan: límite de cuota (429), errores del servidor (5xx), tiempos de espera y conexión.
+# Se reconocen por el código HTTP del error o por el nombre de su clase, sin depender del SDK instalado
+CODIGOS_TRANSITORIOS = {408, 429}
+ERRORES_TRANSITORIOS = {
+    "ResourceExhausted", "TooManyRequests", "ServiceUnavailable", "InternalServerError", "DeadlineExceeded",
+    "GatewayTimeout", "BadGateway", "Timeout", "ReadTimeout", "ConnectTimeout", "ConnectionError",
+}
+
+def crear_limitador(peticiones_por_minuto, rafaga=None):
+    """
+    Limitador tipo "token bucket": permite ráfagas de hasta `rafaga` peticiones y después
+    un ritmo sostenido de peticiones_por_minuto. Devuelve una función que bloquea hasta
+    que haya un token disponible. Es seguro entre hilos.
+    """
+    if not peticiones_por_minuto:
+        return lambda: None
+
+    capacidad = float(rafaga or max(1, peticiones_por_minuto // 6))
+    ritmo = peticiones_por_minuto / 60.0
+    estado = {"tokens": capacidad, "ultimo": time.monotonic()}
+    cerrojo = threading.Lock()
+
+    def esperar_turno():
+        while True:
+            with cerrojo:
+                ahora = time.monotonic()
+                estado["tokens"] = min(capacidad, estado["tokens"] + (ahora - estado["ultimo"]) * ritmo)
+                estado["ultimo"] = ahora
+                if estado["tokens"] >= 1:
+                    estado["tokens"] -= 1
+                    return
+                espera = (1 - estado["tokens"]) / ritmo
+            time.sleep(espera)
+
+    return esperar_turno
+
+def es_error_transitorio(error):
+    """
+    True si merece la pena repetir la petición: 429, 5xx, tiempo de espera agotado o error de conexión.
+    Los demás (clave no válida, petición mal formada, contenido bloqueado...) fallarían igual.
+    """
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    codigo = getattr(error, "code", None)
+    if codigo is None or callable(codigo):
+        codigo = getattr(error, "status_code", None)
+    try:
+        codigo = int(codigo)
+    except (TypeError, ValueError):
+        codigo = None
+    if codigo is not None:
+        return codigo in CODIGOS_TRANSITORIOS or 500 <= codigo < 600
+    return any(clase.__name__ in ERRORES_TRANSITORIOS for clase in type(error).__mro__)
+
+def generar_con_reintentos(modelo, prompt, reintentos=4, espera_base=1.0, esperar_turno=None, **kwargs):
+    """
+    Llama a modelo.generate_content(prompt) y devuelve el texto.
+    Ante un error transitorio (ver es_error_transitorio) reintenta hasta `reintentos` veces con espera
+    exponencial (1 s, 2 s, 4 s... con jitter); cualquier otro error se lanza de inmediato.
+    """
+    for intento in range(reintentos + 1):
+        if esperar_turno:
+            esperar_turno()
+        try:
+            respuesta = modelo.generate_content(prompt, **kwargs)
+            return respuesta.text if hasattr(respuesta, "text") else str(respuesta)
+        except Exception as e:
+            if intento == reintentos or not es_error_transitorio(e):
+                raise
+            time.sleep(espera_base * (2 ** intento) * (0.5 + random.random()))
+
+@instrumentar(categoria="ia")
+def generar_en_paralelo(modelo, prompts, max_concurrencia=4, peticiones_por_minuto=60, reintentos=4,
+                        espera_base=1.0, update_progress=None, **kwargs):
+    """
+    Envía varios prompts al modelo en paralelo (hilos) y devuelve las respuestas en el mismo orden.
+
+    modelo: cualquier objeto con generate_content(prompt) -> objeto con .text (Gemini o un modelo falso)
+    max_concurrencia: peticiones simultáneas como máximo
+    peticiones_por_minuto: límite de ritmo compartido por todos los hilos (None = sin límite)
+    update_progress: función opcional que recibe la fracción completada (se llama desde el hilo que invoca)
+    """
+    prompts = list(prompts)
+    if not prompts:
+        return []
+
+    esperar_turno = crear_limitador(peticiones_por_minuto)
+    respuestas = [None] * len(prompts)
+    completados = 0
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_concurrencia, len(prompts)))) as pool:
+        futuros = {
+            pool.submit(generar_con_reintentos, modelo, prompt, reintentos, espera_base, esperar_turno, **kwargs): i
+            for i, prompt in enumerate(prompts)
+        }
+        try:
+            for futuro in as_completed(futuros):
+                respuestas[futuros[futuro]] = futuro.result()
+                completados += 1
+                if update_progress:
+                    update_progress(completados / len(prompts))
+        except Exception:
+            # Si un bloque falla tras agotar los reintentos, no se lanzan los que aún no empezaron
+            for futuro in futuros:
+                futuro.cancel()
+            raise
+
+    return respuestas
@@ -0,0 +1,127 @@
+import json
+import re
+
+import numpy as np
+import pandas as pd
+
+from funciones.utils.instrumentacion import instrumentar
+
+# Salida estructurada de la IA: cada bloque devuelve un array JSON validado contra un esquema
+# y se lee directamente a un DataFrame tipado, sin tablas Markdown ni segunda consulta de normalización
+UNIDAD_HUELLA = "kg CO₂ eq"
+
+def esquema_huella(etapas):
+    """
+    Esquema de respuesta (subconjunto OpenAPI que acepta Gemini en response_schema):
+    array de {ID, Material, Cantidad, GWP: {etapa: número}, Total, Unidad}.
+    Sin etapas se omite GWP: un OBJECT sin propiedades no es un esquema válido.
+    """
+    propiedades = {
+        "ID": {"type": "STRING", "description": "GlobalId del elemento IFC"},
+        "Material": {"type": "STRING"},
+        "Cantidad": {"type": "NUMBER"},
+    }
+    if etapas:
+        propiedades["GWP"] = {
+            "type": "OBJECT",
+            "description": "GWP por unidad de cada etapa [kg CO₂ eq/unidad]",
+            "properties": {etapa: {"type": "NUMBER"} for etapa in etapas},
+        }
+    propiedades["Total"] = {"type": "NUMBER", "description": "Huella total del elemento [kg CO₂ eq]"}
+    propiedades["Unidad"] = {"type": "STRING"}
+    return {
+        "type": "ARRAY",
+        "items": {"type": "OBJECT", "properties": propiedades, "required": ["ID", "Total"]},
+    }
+
+def configuracion_json(etapas):
+    """
+    generation_config para generate_content: respuesta en JSON con el esquema de esquema_huella.
+    """
+    return {"response_mime_type": "application/json", "response_schema": esquema_huella(list(etapas))}
+
+def _numero(valor):
+    if valor is None or isinstance(valor, bool):
+        return np.nan
+    if isinstance(valor, (int, float)):
+        return float(valor)
+    # Números que llegan como texto ("1,234.5 kg"): mismo criterio que limpiar_valor_total
+    match = re.search(r"-?[\d\.,]+", str(valor))
+    if not match:
+        return np.nan
+    try:
+        return float(match.group(0).replace(",", ""))
+    except ValueError:
+        return np.nan
+
+def _cargar_json(texto):
+    texto = str(texto).strip()
+    # Sin response_schema algunos modelos envuelven el JSON en un bloque ```json
+    bloque = re.search(r"```(?:json)?\s*(.*?)```", texto, flags=re.S)
+    if bloque:
+        texto = bloque.group(1).strip()
+    datos = json.loads(texto)
+    if isinstance(datos, dict):
+        listas = [v for v in datos.values() if isinstance(v, list)]
+        datos = listas[0] if len(listas) == 1 else [datos]
+    if not isinstance(datos, list):
+        raise ValueError("la respuesta no es un array JSON")
+    return datos
+
+@instrumentar(categoria="ia")
+def leer_huella_json(texto, etapas):
+    """
+    Convierte la respuesta JSON de un bloque en un DataFrame tipado:
+    ID, Material (texto), Cantidad, GWP {etapa}, Total (float64) y Unidad.
+    Se descartan los objetos sin ID. Si falta Total se calcula como Cantidad × suma del GWP por etapa.
+    Lanza ValueError si la respuesta no es JSON válido.
+    """
+    try:
+        datos = _cargar_json(texto)
+    except (json.JSONDecodeError, ValueError) as e:
+        raise ValueError(f"❌ Respuesta de la IA no válida como JSON: {e}") from e
+
+    etapas = list(etapas)
+    filas = []
+    for item in datos:
+        if not isinstance(item, dict):
+            continue
+        id_elemento = str(item.get("ID") or "").strip()
+        if not id_elemento:
+            continue
+        gwp = item.get("GWP") if isinstance(item.get("GWP"), dict) else {}
+        fila = {
+            "ID": id_elemento,
+            "Material": str(item.get("Material") or ""),
+            "Cantidad": _numero(item.get("Cantidad")),
+        }
+        for etapa in etapas:
+            fila[f"GWP {etapa}"] = _numero(gwp.get(etapa))
+        total = _numero(item.get("Total"))
+        if np.isnan(total):
+            total = np.nansum([fila[f"GWP {etapa}"] for etapa in etapas]) * np.nan_to_num(fila["Cantidad"])
+        fila["Total"] = total
+        fila["Unidad"] = str(item.get("Unidad") or UNIDAD_HUELLA)
+        filas.append(fila)
+
+    columnas = ["ID", "Material", "Cantidad", *[f"GWP {etapa}" for etapa in etapas], "Total", "Unidad"]
+    df = pd.DataFrame(filas, columns=columnas)
+    tipos = {col: "float64" for col in columnas if col not in ("ID", "Material", "Unidad")}
+    return df.astype(tipos)
+
+def unir_respuestas_json(partes, etapas):
+    """
+    Une las respuestas JSON de todos los bloques en un único DataFrame (ver leer_huella_json),
+    en el orden de los bloques y sin IDs repetidos.
+    Devuelve (DataFrame, errores) con errores = [(número de bloque, mensaje)] de los bloques ilegibles.
+    """
+    tablas, errores = [], []
+    for i, parte in enumerate(partes):
+        try:
+            tablas.append(leer_huella_json(parte, etapas))
+        except ValueError as e:
+            errores.append((i, str(e)))
+    if not tablas:
+        return leer_huella_json("[]", etapas), errores
+    df = pd.concat(tablas, ignore_index=True)
+    return df.drop_duplicates(subset="ID").reset_index(drop=True), errores
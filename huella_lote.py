@@ -0,0 +1,45 @@
+import argparse
+import os
+
+from funciones.procesar_lote import RUTA_BASE_DATOS, procesar_directorio
+from funciones.utils import instrumentacion
+from funciones.utils.calcular_huella import ETAPAS_CICLO_VIDA
+
+# Uso: python huella_lote.py carpeta_con_ifc --salida resultados/lote --procesos 4
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Calcula la huella de carbono de todos los IFC de una carpeta, sin interfaz.")
+    parser.add_argument("directorio", help="Carpeta con los archivos .ifc (se recorren también las subcarpetas)")
+    parser.add_argument("--salida", default="resultados/lote", help="Carpeta de resultados, estado y resumen del lote")
+    parser.add_argument("--procesos", type=int, default=None, help="Archivos en paralelo (por defecto, uno por CPU)")
+    parser.add_argument("--etapas", nargs="+", default=ETAPAS_CICLO_VIDA, choices=ETAPAS_CICLO_VIDA, help="Etapas del ciclo de vida")
+    parser.add_argument("--distancia-km", type=float, default=None, help="Distancia de transporte para A4")
+    parser.add_argument("--base", default=RUTA_BASE_DATOS, help="Excel de la base de sostenibilidad")
+    parser.add_argument("--col-material", default=None, help="Columna de material (por defecto Material_IFC)")
+    parser.add_argument("--col-cantidad", default=None, help="Columna de cantidad (por defecto la primera de volumen)")
+    parser.add_argument("--ia", action="store_true", help="Consultar a la IA los materiales sin emparejamiento local")
+    parser.add_argument("--sin-ifc", action="store_true", help="No exportar el IFC con el pset ImpactoAmbiental")
+    parser.add_argument("--rehacer", action="store_true", help="Ignorar el estado guardado y recalcular todo")
+    parser.add_argument("--traza", action="store_true", help="Guardar tiempos por etapa (instrumentacion.json y traza_chrome.json) en la carpeta de salida")
+    args = parser.parse_args(argv)
+
+    resumen = procesar_directorio(
+        args.directorio,
+        carpeta_salida=args.salida,
+        n_procesos=args.procesos,
+        rehacer=args.rehacer,
+        etapas=args.etapas,
+        distancia_km=args.distancia_km,
+        usar_ia=args.ia,
+        col_material=args.col_material,
+        col_cantidad=args.col_cantidad,
+        exportar_ifc=not args.sin_ifc,
+        ruta_base=args.base,
+    )
+    if args.traza:
+        instrumentacion.exportar_json(os.path.join(args.salida, "instrumentacion.json"))
+        instrumentacion.exportar_chrome_trace(os.path.join(args.salida, "traza_chrome.json"))
+    return 1 if "estado" in resumen and (resumen["estado"] == "error").any() else 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,5 +1,8 @@
 import pandas as pd
 
+from funciones.utils.instrumentacion import instrumentar
+
+@instrumentar(categoria="calculo")
 def postprocesar_huella(df_ia, ids_ifc):
     """
     Asegura que todos los IDs del IFC estén presentes en el DataFrame final.
@@ -0,0 +1,175 @@
+import argparse
+import os
+import random
+
+import ifcopenshell
+import ifcopenshell.guid
+
+# Generador de modelos IFC sintéticos (IFC4 / IFC2X3) para medir el rendimiento del cálculo de huella.
+# Los materiales coinciden con nombres de la base DIGITAEC para que el emparejamiento local los resuelva.
+MATERIALES_SINTETICOS = ("HA-30", "Acero B500S", "Ladrillo cerámico", "XPS", "Madera CLT", "Mortero de cemento", "Lana mineral", "Vidrio")
+CLASES_SINTETICAS = ("IfcWall", "IfcSlab", "IfcColumn", "IfcBeam")
+ESQUEMAS_SINTETICOS = ("IFC4", "IFC2X3")
+
+def _cabecera(f, esquema):
+    # En IFC2X3 OwnerHistory es obligatorio en toda entidad IfcRoot
+    if esquema != "IFC2X3":
+        return None
+    persona = f.create_entity("IfcPerson", FamilyName="Sintetico")
+    organizacion = f.create_entity("IfcOrganization", Name="IA_6D")
+    usuario = f.create_entity("IfcPersonAndOrganization", ThePerson=persona, TheOrganization=organizacion)
+    aplicacion = f.create_entity("IfcApplication", ApplicationDeveloper=organizacion, Version="1",
+                                 ApplicationFullName="ifc_sintetico", ApplicationIdentifier="ifc_sintetico")
+    return f.create_entity("IfcOwnerHistory", OwningUser=usuario, OwningApplication=aplicacion,
+                           ChangeAction="ADDED", CreationDate=0)
+
+def _raiz(f, clase, owner_history, **atributos):
+    return f.create_entity(clase, GlobalId=ifcopenshell.guid.new(), OwnerHistory=owner_history, **atributos)
+
+def _estructura_espacial(f, oh):
+    """
+    Proyecto con unidades SI, contexto geométrico y la jerarquía sitio → edificio → planta.
+    Devuelve (contexto, planta, colocación de la planta).
+    """
+    origen = f.create_entity("IfcAxis2Placement3D", Location=f.create_entity("IfcCartesianPoint", Coordinates=(0.0, 0.0, 0.0)))
+    contexto = f.create_entity("IfcGeometricRepresentationContext", ContextType="Model", CoordinateSpaceDimension=3,
+                               Precision=1e-5, WorldCoordinateSystem=origen)
+    unidades = f.create_entity("IfcUnitAssignment", Units=[
+        f.create_entity("IfcSIUnit", UnitType=tipo, Name=nombre)
+        for tipo, nombre in (("LENGTHUNIT", "METRE"), ("AREAUNIT", "SQUARE_METRE"), ("VOLUMEUNIT", "CUBIC_METRE"))
+    ])
+    proyecto = _raiz(f, "IfcProject", oh, Name="Proyecto sintético", RepresentationContexts=[contexto], UnitsInContext=unidades)
+
+    colocacion = None
+    padre = proyecto
+    for clase, nombre in (("IfcSite", "Parcela"), ("IfcBuilding", "Edificio"), ("IfcBuildingStorey", "Planta 0")):
+        colocacion = f.create_entity("IfcLocalPlacement", PlacementRelTo=colocacion, RelativePlacement=origen)
+        hijo = _raiz(f, clase, oh, Name=nombre, ObjectPlacement=colocacion, CompositionType="ELEMENT")
+        _raiz(f, "IfcRelAggregates", oh, RelatingObject=padre, RelatedObjects=[hijo])
+        padre = hijo
+    return contexto, padre, colocacion
+
+def _geometrias(f, contexto):
+    # Una representación compartida (IfcRepresentationMap) por clase, como los tipos de un modelo real
+    origen = f.create_entity("IfcAxis2Placement3D", Location=f.create_entity("IfcCartesianPoint", Coordinates=(0.0, 0.0, 0.0)))
+    eje_z = f.create_entity("IfcDirection", DirectionRatios=(0.0, 0.0, 1.0))
+    mapas = {}
+    for clase, (ancho, fondo, alto) in zip(CLASES_SINTETICAS, ((4.0, 0.2, 3.0), (5.0, 5.0, 0.25), (0.3, 0.3, 3.0), (5.0, 0.3, 0.5))):
+        perfil = f.create_entity("IfcRectangleProfileDef", ProfileType="AREA", XDim=ancho, YDim=fondo,
+                                 Position=f.create_entity("IfcAxis2Placement2D", Location=f.create_entity("IfcCartesianPoint", Coordinates=(0.0, 0.0))))
+        solido = f.create_entity("IfcExtrudedAreaSolid", SweptArea=perfil, Position=origen, ExtrudedDirection=eje_z, Depth=alto)
+        representacion = f.create_entity("IfcShapeRepresentation", ContextOfItems=contexto, RepresentationIdentifier="Body",
+                                         RepresentationType="SweptSolid", Items=[solido])
+        mapas[clase] = f.create_entity("IfcRepresentationMap", MappingOrigin=origen, MappedRepresentation=representacion)
+    return mapas
+
+def _conjuntos_de_capas(f, materiales, rng, n_conjuntos=6):
+    # Pocas combinaciones de capas compartidas por muchos elementos, como en un modelo real
+    usos = []
+    for k in range(n_conjuntos):
+        capas = [f.create_entity("IfcMaterialLayer", Material=rng.choice(materiales), LayerThickness=round(rng.uniform(0.01, 0.2), 3))
+                 for _ in range(rng.randint(2, 4))]
+        conjunto = f.create_entity("IfcMaterialLayerSet", MaterialLayers=capas, LayerSetName=f"Capas {k + 1}")
+        usos.append(f.create_entity("IfcMaterialLayerSetUsage", ForLayerSet=conjunto, LayerSetDirection="AXIS2",
+                                    DirectionSense="POSITIVE", OffsetFromReferenceLine=0.0))
+    return usos
+
+def generar_ifc_sintetico(ruta, n_elementos, esquema="IFC4", psets_por_elemento=2, propiedades_por_pset=4,
+                          fraccion_capas=0.3, con_cantidades=True, materiales=MATERIALES_SINTETICOS, semilla=0):
+    """
+    Escribe en ruta un IFC con n_elementos muros, forjados, pilares y vigas repartidos por igual.
+
+    Cada elemento lleva:
+    - el pset "Dimensiones" (Volumen, Area, Longitud), legible también en IFC2X3,
+    - psets_por_elemento psets propios con propiedades_por_pset propiedades cada uno,
+    - un material simple o, con probabilidad fraccion_capas, un IfcMaterialLayerSetUsage compartido,
+    - si con_cantidades, un IfcElementQuantity "Qto_BaseQuantities" (NetVolume, NetArea, Length).
+    Con la misma semilla el contenido es el mismo (salvo los GlobalId). Devuelve la ruta.
+    """
+    if esquema not in ESQUEMAS_SINTETICOS:
+        raise ValueError(f"❌ Esquema no soportado: {esquema} (usa {', '.join(ESQUEMAS_SINTETICOS)})")
+    rng = random.Random(semilla)
+    f = ifcopenshell.file(schema=esquema)
+    oh = _cabecera(f, esquema)
+    contexto, planta, colocacion_planta = _estructura_espacial(f, oh)
+    mapas = _geometrias(f, contexto)
+
+    ifc_materiales = [f.create_entity("IfcMaterial", Name=nombre) for nombre in materiales]
+    usos_capas = _conjuntos_de_capas(f, ifc_materiales, rng)
+    por_material = {id(m): (m, []) for m in [*ifc_materiales, *usos_capas]}
+
+    elementos = []
+    for i in range(n_elementos):
+        clase = CLASES_SINTETICAS[i % len(CLASES_SINTETICAS)]
+        punto = f.create_entity("IfcCartesianPoint", Coordinates=(float(i % 100) * 6.0, float(i // 100) * 6.0, 0.0))
+        colocacion = f.create_entity("IfcLocalPlacement", PlacementRelTo=colocacion_planta,
+                                     RelativePlacement=f.create_entity("IfcAxis2Placement3D", Location=punto))
+        instancia = f.create_entity("IfcMappedItem", MappingSource=mapas[clase],
+                                    MappingTarget=f.create_entity("IfcCartesianTransformationOperator3D",
+                                                                  LocalOrigin=f.create_entity("IfcCartesianPoint", Coordinates=(0.0, 0.0, 0.0))))
+        forma = f.create_entity("IfcProductDefinitionShape", Representations=[
+            f.create_entity("IfcShapeRepresentation", ContextOfItems=contexto, RepresentationIdentifier="Body",
+                            RepresentationType="MappedRepresentation", Items=[instancia])
+        ])
+        elemento = _raiz(f, clase, oh, Name=f"{clase[3:]} {i + 1}", ObjectPlacement=colocacion, Representation=forma)
+        elementos.append(elemento)
+
+        material = rng.choice(usos_capas) if rng.random() < fraccion_capas else rng.choice(ifc_materiales)
+        por_material[id(material)][1].append(elemento)
+
+        volumen = round(rng.uniform(0.1, 5.0), 3)
+        area = round(rng.uniform(1.0, 25.0), 2)
+        longitud = round(rng.uniform(0.5, 8.0), 2)
+        psets = [("Dimensiones", [
+            f.create_entity("IfcPropertySingleValue", Name="Volumen", NominalValue=f.create_entity("IfcVolumeMeasure", volumen)),
+            f.create_entity("IfcPropertySingleValue", Name="Area", NominalValue=f.create_entity("IfcAreaMeasure", area)),
+            f.create_entity("IfcPropertySingleValue", Name="Longitud", NominalValue=f.create_entity("IfcLengthMeasure", longitud)),
+        ])]
+        for k in range(psets_por_elemento):
+            psets.append((f"Pset_Sintetico_{k + 1}", [
+                f.create_entity("IfcPropertySingleValue", Name=f"Propiedad_{j + 1}",
+                                NominalValue=f.create_entity("IfcLabel", f"Valor {rng.randint(1, 50)}") if j % 2 else f.create_entity("IfcReal", round(rng.random() * 100, 2)))
+                for j in range(propiedades_por_pset)
+            ]))
+        for nombre, propiedades in psets:
+            pset = _raiz(f, "IfcPropertySet", oh, Name=nombre, HasProperties=propiedades)
+            _raiz(f, "IfcRelDefinesByProperties", oh, RelatedObjects=[elemento], RelatingPropertyDefinition=pset)
+
+        if con_cantidades:
+            cantidades = _raiz(f, "IfcElementQuantity", oh, Name="Qto_BaseQuantities", Quantities=[
+                f.create_entity("IfcQuantityVolume", Name="NetVolume", VolumeValue=volumen),
+                f.create_entity("IfcQuantityArea", Name="NetArea", AreaValue=area),
+                f.create_entity("IfcQuantityLength", Name="Length", LengthValue=longitud),
+            ])
+            _raiz(f, "IfcRelDefinesByProperties", oh, RelatedObjects=[elemento], RelatingPropertyDefinition=cantidades)
+
+    for material, relacionados in por_material.values():
+        if relacionados:
+            _raiz(f, "IfcRelAssociatesMaterial", oh, RelatedObjects=relacionados, RelatingMaterial=material)
+    if elementos:
+        _raiz(f, "IfcRelContainedInSpatialStructure", oh, RelatedElements=elementos, RelatingStructure=planta)
+
+    carpeta = os.path.dirname(ruta)
+    if carpeta:
+        os.makedirs(carpeta, exist_ok=True)
+    f.write(ruta)
+    return ruta
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Genera un IFC sintético para pruebas de rendimiento.")
+    parser.add_argument("ruta", help="Archivo .ifc de salida")
+    parser.add_argument("elementos", type=int, help="Número de elementos")
+    parser.add_argument("--esquema", default="IFC4", choices=ESQUEMAS_SINTETICOS)
+    parser.add_argument("--psets", type=int, default=2, help="Psets propios por elemento (además de Dimensiones)")
+    parser.add_argument("--propiedades", type=int, default=4, help="Propiedades por pset")
+    parser.add_argument("--fraccion-capas", type=float, default=0.3, help="Fracción de elementos con conjunto de capas")
+    parser.add_argument("--sin-cantidades", action="store_true", help="No crear IfcElementQuantity")
+    parser.add_argument("--semilla", type=int, default=0)
+    args = parser.parse_args(argv)
+    generar_ifc_sintetico(args.ruta, args.elementos, esquema=args.esquema, psets_por_elemento=args.psets,
+                          propiedades_por_pset=args.propiedades, fraccion_capas=args.fraccion_capas,
+                          con_cantidades=not args.sin_cantidades, semilla=args.semilla)
+    print(f"✅ IFC sintético generado: {args.ruta}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,304 @@
+import argparse
+import json
+import os
+import platform
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from io import BytesIO
+
+import pandas as pd
+
+from funciones.agregar_huella_ifc import agregar_huella_ifc
+from funciones.cache_modelos import vaciar_cache_modelos
+from funciones.cargar_base import cargar_base_compilada
+from funciones.procesar_ifc_con_progreso import procesar_ifc
+from funciones.procesar_lote import RUTA_BASE_DATOS, preparar_tabla_calculo
+from funciones.utils.calcular_huella import (
+    ETAPAS_CICLO_VIDA, calcular_huella_carbono, calcular_huella_por_elemento, huella_desde_matriz, matriz_huella
+)
+from funciones.utils.formatear_hojas_para_ia import contexto_relevante_para_ia
+from funciones.utils.ia_falsa import crear_modelo_falso
+from funciones.utils.normalizar_materiales_ifc import normalizar_materiales_con_ia
+from funciones.utils.planificador_ia import generar_en_paralelo
+from funciones.utils.salida_estructurada import configuracion_json, unir_respuestas_json
+from postprocesar_huella import postprocesar_huella
+from rendimiento.ifc_sintetico import ESQUEMAS_SINTETICOS, generar_ifc_sintetico
+
+# Medición de tiempos por etapa del cálculo de huella sobre modelos sintéticos.
+# Uso: python -m rendimiento.medir_etapas --elementos 1000 10000 100000 --comparar resultados/rendimiento/anterior.json
+
+ELEMENTOS_POR_DEFECTO = (1000, 10000, 100000)
+CARPETA_MODELOS_SINTETICOS = os.path.join("cache", "ifc_sinteticos")
+CARPETA_RESULTADOS = os.path.join("resultados", "rendimiento")
+ELEMENTOS_IA = 2000  # las secciones 09 y 10 se miden sobre una selección, como en la app
+TAMANO_BLOQUE_IA = 20
+TOLERANCIA_REGRESION = 0.2
+
+def _medir(tiempos, etapa, funcion, *args, **kwargs):
+    inicio = time.perf_counter()
+    resultado = funcion(*args, **kwargs)
+    tiempos[etapa] = round(time.perf_counter() - inicio, 4)
+    return resultado
+
+def _ruta_modelo(esquema, n_elementos, parametros):
+    sufijo = "_".join(f"{k}{v}" for k, v in sorted(parametros.items()))
+    return os.path.join(CARPETA_MODELOS_SINTETICOS, f"{esquema}_{n_elementos}_{sufijo}.ifc")
+
+def _leer_tabla_markdown(texto):
+    df = pd.read_table(BytesIO(texto.encode()), sep="|", engine="python")
+    df = df.dropna(axis=1, how="all").iloc[1:].copy()
+    df.columns = [col.strip() for col in df.columns]
+    return df
+
+def _limpiar_respuesta(respuesta_total):
+    # Igual que la sección 09 de app.py: un solo encabezado y sin líneas de alineación
+    filtrado = []
+    encabezado_usado = False
+    for linea in respuesta_total.strip().split("\n"):
+        if "ID" in linea and "Material" in linea and "|" in linea:
+            if not encabezado_usado:
+                filtrado.append(linea)
+                encabezado_usado = True
+            continue
+        if re.fullmatch(r"[:\-\s\|]+", linea):
+            continue
+        filtrado.append(linea)
+    return "\n".join(filtrado)
+
+def flujo_ia_seccion_09(df_analizar, hojas, indice, etapas, modelo, concurrencia=4):
+    """
+    Reproduce la sección 09 de app.py en modo IA: contexto relevante y prompt por bloque de 20 elementos,
+    consultas en paralelo, limpieza de la respuesta y tabla normalizada [ID, Total, Unidad].
+    Devuelve (tabla_original en Markdown, df_normalizado).
+    """
+    prompts = _prompts_ia(df_analizar, hojas, indice, etapas)
+    partes = generar_en_paralelo(modelo, prompts, max_concurrencia=concurrencia, peticiones_por_minuto=None)
+    tabla_original = _limpiar_respuesta("".join(parte.strip() + "\n" for parte in partes))
+    respuesta = modelo.generate_content(f"Tengo esta tabla con huellas de carbono por elemento IFC:\n{tabla_original}\n\nTu tarea es:\n").text
+    return tabla_original, _leer_tabla_markdown(respuesta)
+
+def _prompts_ia(df_analizar, hojas, indice, etapas):
+    prompts = []
+    for i in range(0, len(df_analizar), TAMANO_BLOQUE_IA):
+        bloque = df_analizar.iloc[i:i + TAMANO_BLOQUE_IA]
+        consultas = bloque["Material"].tolist() + bloque["Material_Normalizado"].tolist()
+        contexto = contexto_relevante_para_ia(hojas, consultas, indice=indice)
+        prompts.append(f"### IFC:\n{bloque.to_markdown(index=False)}\n\n### Base de sostenibilidad:\n{contexto}\n\nEtapas seleccionadas: {etapas}\n")
+    return prompts
+
+def flujo_ia_estructurado(df_analizar, hojas, indice, etapas, modelo, concurrencia=4):
+    """
+    Sección 09 de app.py con salida estructurada (IA_SALIDA=json): un array JSON por bloque leído
+    directamente a un DataFrame tipado, sin la consulta de normalización de las secciones 09 y 10.
+    """
+    prompts = _prompts_ia(df_analizar, hojas, indice, etapas)
+    partes = generar_en_paralelo(modelo, prompts, max_concurrencia=concurrencia, peticiones_por_minuto=None,
+                                 generation_config=configuracion_json(etapas))
+    huella_ia, _ = unir_respuestas_json(partes, etapas)
+    return huella_ia
+
+def flujo_ia_seccion_10(tabla_original, modelo):
+    """
+    Reproduce la sección 10 de app.py: tabla original → DataFrame → Markdown → normalización con la IA.
+    """
+    df_origen = pd.read_csv(BytesIO(tabla_original.encode()), sep="|", engine="python", skipinitialspace=True)
+    df_origen = df_origen.dropna(axis=1, how="all").dropna(axis=0, how="all")
+    respuesta = modelo.generate_content(f"Tengo esta tabla con huellas de carbono por elemento IFC:\n{df_origen.to_markdown(index=False)}\n\nTu tarea es:\n").text
+    df_normalizado = _leer_tabla_markdown(respuesta)
+    df_normalizado["Total"] = pd.to_numeric(df_normalizado["Total"], errors="coerce").fillna(0.0)
+    return df_normalizado
+
+def medir_modelo(ruta_ifc, base, carpeta_trabajo, etapas=ETAPAS_CICLO_VIDA, distancia_km=None, n_procesos=1,
+                 elementos_ia=ELEMENTOS_IA, latencia_ia=0.0, concurrencia_ia=4):
+    """
+    Ejecuta la cadena completa sobre un IFC y devuelve {etapa: segundos} junto con contadores.
+    La extracción parte siempre de un modelo sin abrir (caché de modelos vacía).
+    """
+    hojas = base["hojas"]
+    tiempos = {}
+    vaciar_cache_modelos()
+
+    df_ifc = _medir(tiempos, "procesar_ifc", procesar_ifc, ruta_ifc, carpeta_salida=carpeta_trabajo, n_procesos=n_procesos)
+    df = _medir(tiempos, "preparar_tabla", preparar_tabla_calculo, df_ifc)
+    df = _medir(tiempos, "normalizar_materiales", normalizar_materiales_con_ia, df, hojas, usar_ia=False, ruta_memoria=None)
+
+    df_calculo = df.copy()
+    normalizado = df_calculo["Material_Normalizado"]
+    df_calculo["Material"] = normalizado.where(normalizado != "NO ENCONTRADO", df_calculo["Material"])
+    df_huella = _medir(tiempos, "calcular_huella_por_elemento", calcular_huella_por_elemento, df_calculo, hojas, etapas, distancia_km=distancia_km)
+    _medir(tiempos, "calcular_huella_carbono", calcular_huella_carbono, df_calculo, hojas, etapas, distancia_km=distancia_km)
+    # Recalculo incremental de la app (modo local): matriz una vez y después solo máscaras y escalares
+    matriz = _medir(tiempos, "matriz_huella", matriz_huella, df_calculo, hojas)
+    _medir(tiempos, "huella_desde_matriz", huella_desde_matriz, matriz, etapas, distancia_km=distancia_km)
+
+    df_huella["Unidad"] = "kg CO₂ eq"
+    ids_ifc = df_ifc["ID"].astype(str).str.strip().tolist()
+    df_resultado = _medir(tiempos, "postprocesar_huella", postprocesar_huella, df_huella[["ID", "Total", "Unidad"]].copy(), ids_ifc)
+    _medir(tiempos, "agregar_huella_ifc", agregar_huella_ifc, ruta_ifc, df_resultado,
+           nombre_salida="benchmark_ImpactoAmbiental.ifc", carpeta_salida=carpeta_trabajo)
+
+    contadores = {"filas_extraidas": int(len(df_ifc)), "filas_calculo": int(len(df)), "llamadas_ia": 0}
+    if elementos_ia:
+        modelo = crear_modelo_falso(latencia=latencia_ia)
+        seleccion = df.head(elementos_ia)
+        tabla_original, _ = _medir(tiempos, "ia_seccion_09", flujo_ia_seccion_09, seleccion, hojas, base.get("indice"),
+                                   etapas, modelo, concurrencia=concurrencia_ia)
+        _medir(tiempos, "ia_seccion_10", flujo_ia_seccion_10, tabla_original, modelo)
+        llamadas_markdown = modelo.contador["llamadas"]
+        _medir(tiempos, "ia_estructurada", flujo_ia_estructurado, seleccion, hojas, base.get("indice"),
+               etapas, modelo, concurrencia=concurrencia_ia)
+        contadores.update(elementos_ia=int(len(seleccion)), llamadas_ia=llamadas_markdown,
+                          llamadas_ia_estructurada=modelo.contador["llamadas"] - llamadas_markdown)
+
+    return {"etapas": tiempos, "total": round(sum(tiempos.values()), 4), **contadores}
+
+def _medir_en_proceso(ruta_ifc, ruta_base, carpeta_trabajo, opciones):
+    # Cada modelo se mide en un proceso nuevo: arranque en frío y sin memoria heredada del modelo anterior
+    base = cargar_base_compilada(ruta_base)
+    medida = medir_modelo(ruta_ifc, base, carpeta_trabajo, **opciones)
+    try:
+        import resource  # solo Unix; ru_maxrss en KB en Linux
+        medida["memoria_max_mb"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    except ImportError:
+        pass
+    return medida
+
+def _guardar_informe(ruta, informe):
+    os.makedirs(os.path.dirname(ruta) or ".", exist_ok=True)
+    temporal = f"{ruta}.tmp"
+    with open(temporal, "w", encoding="utf-8") as f:
+        json.dump(informe, f, ensure_ascii=False, indent=2)
+    os.replace(temporal, ruta)
+
+def ejecutar_benchmark(elementos=ELEMENTOS_POR_DEFECTO, esquemas=ESQUEMAS_SINTETICOS, psets_por_elemento=2,
+                       propiedades_por_pset=4, fraccion_capas=0.3, ruta_base=RUTA_BASE_DATOS, regenerar=False,
+                       ruta_informe=None, **opciones):
+    """
+    Genera (o reutiliza de cache/ifc_sinteticos) un modelo por esquema y tamaño y mide cada etapa,
+    cada modelo en un proceso propio.
+    opciones: argumentos de medir_modelo (n_procesos, elementos_ia, latencia_ia...).
+    Devuelve el informe completo como diccionario; con ruta_informe se guarda en JSON tras cada modelo,
+    de modo que un fallo a mitad (p. ej. falta de memoria con 100k elementos) no pierde lo ya medido.
+    """
+    base = cargar_base_compilada(ruta_base)
+    if "error" in base:
+        raise ValueError(base["error"])
+
+    import ifcopenshell
+    parametros = {"psets": psets_por_elemento, "props": propiedades_por_pset, "capas": fraccion_capas}
+    resultados = []
+    informe = {
+        "fecha": datetime.now().isoformat(timespec="seconds"),
+        "entorno": {
+            "python": platform.python_version(),
+            "plataforma": platform.platform(),
+            "cpus": os.cpu_count(),
+            "pandas": pd.__version__,
+            "ifcopenshell": getattr(ifcopenshell, "version", "desconocida"),
+        },
+        "parametros": {**parametros, **{k: v for k, v in opciones.items() if k != "etapas"},
+                       "etapas": list(opciones.get("etapas", ETAPAS_CICLO_VIDA))},
+        "resultados": resultados,
+    }
+    for esquema in esquemas:
+        for n in elementos:
+            ruta = _ruta_modelo(esquema, n, parametros)
+            segundos_generar = None
+            if regenerar or not os.path.isfile(ruta):
+                inicio = time.perf_counter()
+                generar_ifc_sintetico(ruta, n, esquema=esquema, psets_por_elemento=psets_por_elemento,
+                                      propiedades_por_pset=propiedades_por_pset, fraccion_capas=fraccion_capas)
+                segundos_generar = round(time.perf_counter() - inicio, 2)
+
+            print(f"⏱️ {esquema} · {n} elementos...")
+            carpeta_trabajo = os.path.join(CARPETA_RESULTADOS, "trabajo", f"{esquema}_{n}")
+            os.makedirs(carpeta_trabajo, exist_ok=True)
+            try:
+                with ProcessPoolExecutor(max_workers=1) as pool:
+                    medida = pool.submit(_medir_en_proceso, ruta, ruta_base, carpeta_trabajo, opciones).result()
+                estado = {"estado": "completado", **medida}
+            except Exception as e:
+                estado = {"estado": "error", "error": f"{type(e).__name__}: {e}"}
+                print(f"❌ {esquema} · {n}: {estado['error']}")
+            resultados.append({
+                "esquema": esquema,
+                "elementos": n,
+                "tamano_mb": round(os.path.getsize(ruta) / 1024 ** 2, 2),
+                "generar_s": segundos_generar,
+                **estado,
+            })
+            if ruta_informe:
+                _guardar_informe(ruta_informe, informe)
+
+    return informe
+
+def comparar_informes(actual, anterior, tolerancia=TOLERANCIA_REGRESION):
+    """
+    Compara dos informes etapa a etapa (mismo esquema y tamaño). Devuelve un DataFrame con
+    segundos antes/después, la razón y si supera la tolerancia de regresión.
+    """
+    previos = {(r["esquema"], r["elementos"]): r for r in anterior.get("resultados", []) if r.get("estado") == "completado"}
+    filas = []
+    for r in actual.get("resultados", []):
+        previo = previos.get((r["esquema"], r["elementos"]))
+        if r.get("estado") != "completado" or previo is None:
+            continue
+        for etapa, segundos in r["etapas"].items():
+            antes = previo["etapas"].get(etapa)
+            if antes is None:
+                continue
+            razon = segundos / antes if antes else float("inf") if segundos else 1.0
+            filas.append({"esquema": r["esquema"], "elementos": r["elementos"], "etapa": etapa,
+                          "antes_s": antes, "ahora_s": segundos, "razon": round(razon, 2),
+                          # Por debajo de 50 ms el ruido domina: no se marca como regresión
+                          "regresion": razon > 1 + tolerancia and segundos - antes > 0.05})
+    return pd.DataFrame(filas, columns=["esquema", "elementos", "etapa", "antes_s", "ahora_s", "razon", "regresion"])
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Mide el tiempo de cada etapa del cálculo de huella sobre IFC sintéticos.")
+    parser.add_argument("--elementos", nargs="+", type=int, default=list(ELEMENTOS_POR_DEFECTO), help="Tamaños de modelo")
+    parser.add_argument("--esquemas", nargs="+", default=list(ESQUEMAS_SINTETICOS), choices=ESQUEMAS_SINTETICOS)
+    parser.add_argument("--psets", type=int, default=2, help="Psets propios por elemento")
+    parser.add_argument("--propiedades", type=int, default=4, help="Propiedades por pset")
+    parser.add_argument("--fraccion-capas", type=float, default=0.3, help="Fracción de elementos con conjunto de capas")
+    parser.add_argument("--etapas", nargs="+", default=ETAPAS_CICLO_VIDA, choices=ETAPAS_CICLO_VIDA)
+    parser.add_argument("--distancia-km", type=float, default=None)
+    parser.add_argument("--procesos", type=int, default=1, help="Procesos para la extracción del IFC")
+    parser.add_argument("--elementos-ia", type=int, default=ELEMENTOS_IA, help="Elementos en los flujos de IA simulada (0 = omitir)")
+    parser.add_argument("--latencia-ia", type=float, default=0.0, help="Segundos por llamada del modelo simulado")
+    parser.add_argument("--concurrencia-ia", type=int, default=4)
+    parser.add_argument("--base", default=RUTA_BASE_DATOS)
+    parser.add_argument("--regenerar", action="store_true", help="Volver a generar los IFC sintéticos")
+    parser.add_argument("--salida", default=None, help="JSON de resultados (por defecto en resultados/rendimiento)")
+    parser.add_argument("--comparar", default=None, help="JSON de una ejecución anterior para detectar regresiones")
+    parser.add_argument("--tolerancia", type=float, default=TOLERANCIA_REGRESION, help="Aumento relativo admitido (0.2 = 20 %%)")
+    args = parser.parse_args(argv)
+
+    salida = args.salida or os.path.join(CARPETA_RESULTADOS, f"rendimiento_{datetime.now():%Y%m%d_%H%M%S}.json")
+    informe = ejecutar_benchmark(
+        ruta_informe=salida, elementos=args.elementos, esquemas=args.esquemas, psets_por_elemento=args.psets,
+        propiedades_por_pset=args.propiedades, fraccion_capas=args.fraccion_capas, ruta_base=args.base,
+        regenerar=args.regenerar, etapas=args.etapas, distancia_km=args.distancia_km, n_procesos=args.procesos,
+        elementos_ia=args.elementos_ia, latencia_ia=args.latencia_ia, concurrencia_ia=args.concurrencia_ia,
+    )
+
+    tabla = pd.DataFrame([{"esquema": r["esquema"], "elementos": r["elementos"], **r.get("etapas", {}), "total": r.get("total")}
+                          for r in informe["resultados"]])
+    print(tabla.to_string(index=False))
+    print(f"✅ Resultados guardados en {salida}")
+
+    codigo = 1 if any(r["estado"] == "error" for r in informe["resultados"]) else 0
+    if args.comparar:
+        with open(args.comparar, encoding="utf-8") as f:
+            comparacion = comparar_informes(informe, json.load(f), tolerancia=args.tolerancia)
+        print(comparacion.to_string(index=False))
+        regresiones = comparacion[comparacion["regresion"]]
+        if not regresiones.empty:
+            print(f"⚠️ {len(regresiones)} etapas más lentas que en {args.comparar} (tolerancia {args.tolerancia:.0%})")
+            codigo = 1
+    return codigo
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,41 @@
+import pandas as pd
+
+from funciones.revisiones import comparar_revisiones, hash_elementos
+from funciones.tabla_propiedades import _tabla_propiedades
+
+def _revision(filas):
+    df = pd.DataFrame(filas)
+    return pd.DataFrame({"ID": df["ID"], "hash_elemento": hash_elementos(df).to_numpy()})
+
+def test_columna_entera_convertida_a_float_no_cambia_el_hash():
+    # En r2 el elemento nuevo no tiene P_n: la columna pasa de int64 a float64 (3 → 3.0)
+    r1 = [{"ID": "a", "P_n": 3}, {"ID": "b", "P_n": 4}]
+    r2 = r1 + [{"ID": "c", "Nombre": "Muro"}]
+    assert pd.DataFrame(r2)["P_n"].dtype == "float64"
+
+    comparacion = comparar_revisiones(_revision(r1), _revision(r2)).set_index("ID")
+    assert comparacion.loc["a", "estado"] == "igual"
+    assert comparacion.loc["b", "estado"] == "igual"
+    assert comparacion.loc["c", "estado"] == "nuevo"
+
+def test_tipos_de_valor_se_distinguen():
+    hashes = hash_elementos(pd.DataFrame({"P": [1, "1", True, 1.5]}, dtype=object))
+    assert hashes.nunique() == 4
+    assert hash_elementos(pd.DataFrame({"P": [1.0]}))[0] == hash_elementos(pd.DataFrame({"P": [1]}))[0]
+
+def test_formato_ancho_y_largo_dan_el_mismo_hash():
+    ancho = pd.DataFrame([
+        {"ID": "a", "Nombre": "Muro", "Pset_A_n": 3, "Pset_A_t": "x", "Pset_A_b": True},
+        {"ID": "b", "Nombre": "Losa", "Pset_A_n": 2.5},
+    ])
+    largo = {
+        "elementos": pd.DataFrame({"element_idx": [0, 1], "ID": ["a", "b"], "Nombre": ["Muro", "Losa"]}),
+        "propiedades": _tabla_propiedades(
+            [0, 0, 0, 1],
+            ["Pset_A"] * 4,
+            ["n", "t", "b", "n"],
+            ["Pset_A_n", "Pset_A_t", "Pset_A_b", "Pset_A_n"],
+            [3, "x", True, 2.5],
+        ),
+    }
+    assert hash_elementos(ancho).tolist() == hash_elementos(largo).tolist()
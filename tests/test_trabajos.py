@@ -0,0 +1,38 @@
+import os
+
+import pandas as pd
+
+from funciones import trabajos
+
+def _esperar(id_trabajo):
+    trabajos._trabajos[id_trabajo]["futuro"].result(timeout=30)
+    return trabajos.estado_trabajo(id_trabajo)
+
+def test_resultado_en_tablas_se_recupera_de_parquet_tras_reiniciar(tmp_path, monkeypatch):
+    # Las rutas de trabajos son relativas al directorio de trabajo
+    monkeypatch.chdir(tmp_path)
+    df = pd.DataFrame({"ID": ["a", "b"], "valor": ["x", 3]})
+    id_df = trabajos.lanzar_trabajo("prueba", lambda: df, clave="df", con_progreso=False)
+    id_dict = trabajos.lanzar_trabajo("prueba", lambda: {"elementos": df, "propiedades": df[["ID"]]},
+                                      clave="dict", con_progreso=False)
+    assert _esperar(id_df)["estado"] == "completado"
+    assert _esperar(id_dict)["estado"] == "completado"
+    assert not [n for n in os.listdir(trabajos.CARPETA_TRABAJOS) if n.endswith(".pkl")]
+
+    # Simula un reinicio del servidor: solo queda lo guardado en SQLite y Parquet
+    monkeypatch.setattr(trabajos, "_trabajos", {})
+    assert trabajos.buscar_trabajo("df") == id_df
+    pd.testing.assert_frame_equal(trabajos.resultado_trabajo(id_df), df)
+    partes = trabajos.resultado_trabajo(trabajos.buscar_trabajo("dict"))
+    assert sorted(partes) == ["elementos", "propiedades"]
+    pd.testing.assert_frame_equal(partes["elementos"], df)
+
+def test_resultado_sin_tablas_solo_queda_en_memoria(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    id_trabajo = trabajos.lanzar_trabajo("prueba", lambda: ["uno", "dos"], clave="lista", con_progreso=False)
+    assert _esperar(id_trabajo)["estado"] == "completado"
+    assert trabajos.resultado_trabajo(id_trabajo) == ["uno", "dos"]
+    assert trabajos.resultado_trabajo(id_trabajo) == ["uno", "dos"]
+
+    monkeypatch.setattr(trabajos, "_trabajos", {})
+    assert trabajos.buscar_trabajo("lista") is None